@@ -1,6 +1,8 @@
 import logging
 import time
 
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 from pymongo.collection import Collection
 from pymongo.change_stream import CollectionChangeStream
 from tenacity import (
@@ -30,10 +32,21 @@ def manage_change_stream(
     # Starting point of the stream is queried from DB.
     latest_token = retrieve_token(token_target, collection, job)
 
+    # In raw BSON mode events stay as the bytes received from the server. Only the fields read
+    # below and by the job are decoded, nested documents are passed on without building dicts.
+    if config.get("RAW_BSON_MODE"):
+        stream_target = stream_target.with_options(
+            codec_options=CodecOptions(document_class=RawBSONDocument),
+        )
+
+    # Auditlogs are only ever inserted. Updates to them are compaction rewriting existing logs,
+    # which must not be published again as new events.
+    operation_types = ["insert"] if job == "publish" else ["insert", "update", "replace"]
+
     logger.info(f"Starting change stream...")
     cursor: CollectionChangeStream = stream_target.watch(
         pipeline=[
-            {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+            {"$match": {"operationType": {"$in": operation_types}}},
             {"$project": {"_id": 1, "fullDocument": 1, "ns": 1, "documentKey": 1}},
         ],
         full_document="updateLookup",
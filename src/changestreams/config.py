@@ -16,8 +16,41 @@ def load_config() -> dict:
         "AUDIT_DB_NAME": os.getenv("AUDIT_DB_NAME"),
         "TOKEN_COLLECTION": os.getenv("TOKEN_COLLECTION"),
         "AUDITLOG_ENDPOINT": os.getenv("AUDITLOG_ENDPOINT"),
+        # Body format for the audit service, "bson" keeps ObjectId and datetime types as they are.
+        # Only opt in once every audit service instance accepts BSON. Until then, endpoints rejecting
+        # BSON bodies (415, or 422 from services that predate it) are switched back to "json".
+        "AUDITLOG_FORMAT": os.getenv("AUDITLOG_FORMAT", "json"),
+        # Changes are skipped before reaching the audit service if an entity is unchanged apart from
+        # the ignored (bookkeeping) top level fields. Fingerprints of the last audited state are kept
+        # for up to AUDIT_FINGERPRINT_CACHE_SIZE entities, set it to 0 to disable suppression.
+        "AUDIT_IGNORED_FIELDS": [
+            field.strip() for field in os.getenv("AUDIT_IGNORED_FIELDS", "").split(",") if field.strip()
+        ],
+        "AUDIT_FINGERPRINT_CACHE_SIZE": int(os.getenv("AUDIT_FINGERPRINT_CACHE_SIZE", 100_000)),
+        # Listener orchestrator. Collection lists are polled every ORCHESTRATOR_POLL_SECONDS and,
+        # if ORCHESTRATOR_WATCH_DDL is set, reconciled as soon as a collection is created or dropped.
+        # ORCHESTRATOR_SPARE_WORKERS idle workers are kept pre-forked so listeners start right away.
+        "ORCHESTRATOR_POLL_SECONDS": float(os.getenv("ORCHESTRATOR_POLL_SECONDS", 60)),
+        "ORCHESTRATOR_WATCH_DDL": os.getenv("ORCHESTRATOR_WATCH_DDL", "false").lower() == "true",
+        "ORCHESTRATOR_SPARE_WORKERS": int(os.getenv("ORCHESTRATOR_SPARE_WORKERS", 2)),
+        "ORCHESTRATOR_HEALTH_PORT": int(os.getenv("ORCHESTRATOR_HEALTH_PORT", 9002)),
         "EVENT_DOMAIN_ENDPOINT": os.getenv("EVENT_DOMAIN_ENDPOINT"),
+        # Access key of the Event Grid domain. Managed identity is used if it is not set.
+        "EVENT_DOMAIN_KEY": os.getenv("EVENT_DOMAIN_KEY"),
         "FAILED_AUDITLOGS_TOPIC": os.getenv("FAILED_AUDITLOGS_TOPIC"),
+        # Claim-check publishing. Auditlogs larger than the threshold (bytes of JSON) of their collection
+        # are published as slim events, without the entity document and with a reference to fetch the
+        # full auditlog from GET <AUDITLOG_ENDPOINT>/<collection>/<id>. A threshold of 0 always publishes
+        # slim events, -1 never does. Overrides are set per collection, eg -> "comments=0,blog_posts=65536".
+        "PUBLISH_SLIM_THRESHOLD_BYTES": int(os.getenv("PUBLISH_SLIM_THRESHOLD_BYTES", -1)),
+        "PUBLISH_SLIM_THRESHOLDS": {
+            collection.strip(): int(threshold)
+            for collection, threshold in (
+                item.split("=", 1) for item in os.getenv("PUBLISH_SLIM_THRESHOLDS", "").split(",") if item.strip()
+            )
+        },
+        # Keep change events as raw BSON, only decoding the fields that are actually read.
+        "RAW_BSON_MODE": os.getenv("RAW_BSON_MODE", "false").lower() == "true",
     }
 
 
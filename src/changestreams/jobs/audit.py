@@ -1,7 +1,11 @@
 import json
 import logging
+from collections import OrderedDict
+from hashlib import blake2b
 
+import bson
 import httpx
+from bson.raw_bson import RawBSONDocument
 from publisher import publish_event
 from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
@@ -12,6 +16,63 @@ from utils import JobInterface, JSONEncoder
 # Status codes for which retrying could resolve the issue.
 retry_codes = [408, 429, 502, 503, 504]
 
+# Status codes of audit services that do not accept BSON bodies. Services that predate BSON
+# support answer 422, as they validate the body as JSON.
+_bson_rejected_codes = [415, 422]
+
+# Endpoints of audit services found not to accept BSON bodies.
+_json_only_endpoints = set()
+
+
+# Fingerprints of the last audited state of each entity, least recently seen first. Keys and
+# values are kept as short bytes, about 100 bytes per entity all in.
+_fingerprints: "OrderedDict[bytes, bytes]" = OrderedDict()
+
+# Counters for events seen by the job and events skipped as no-op changes.
+_stats = {"seen": 0, "suppressed": 0}
+
+
+# Method to hash an entity, ignoring bookkeeping fields. Top level fields are hashed in key order
+# so that field order does not matter, raw nested documents are hashed as they are.
+def fingerprint(document, ignored_fields: list) -> bytes:
+    digest = blake2b(digest_size=8)
+
+    for key in sorted(document.keys()):
+        if key in ignored_fields:
+            continue
+
+        value = document[key]
+        if isinstance(value, RawBSONDocument):
+            encoded = value.raw
+        else:
+            encoded = JSONEncoder(sort_keys=True).encode(value).encode()
+
+        digest.update(key.encode() + b"\0" + encoded + b"\0")
+
+    return digest.digest()
+
+
+def _entity_key(document) -> bytes:
+    entity_id = document["_id"]
+    return entity_id.binary if hasattr(entity_id, "binary") else str(entity_id).encode()
+
+
+# Method to remember the fingerprint of an entity once its change was audited.
+def remember_fingerprint(config: dict, key: bytes, value: bytes):
+    _fingerprints[key] = value
+    _fingerprints.move_to_end(key)
+
+    while len(_fingerprints) > config["AUDIT_FINGERPRINT_CACHE_SIZE"]:
+        _fingerprints.popitem(last=False)
+
+
+# Method to encode the request body in the configured format, returns the body and its content type.
+# BSON is written straight from the event, raw documents are copied over without being decoded.
+def encode_payload(config: dict, payload: dict):
+    if config.get("AUDITLOG_FORMAT") == "bson" and config["AUDITLOG_ENDPOINT"] not in _json_only_endpoints:
+        return bson.encode(payload), "application/bson"
+    return JSONEncoder().encode(payload).encode(), "application/json"
+
 
 # Function to post a failed event to a storage container via event grid topic for inspection.
 @retry(wait=wait_random_exponential(multiplier=1, max=10))
@@ -38,18 +99,44 @@ class Job(JobInterface):
     def run(self, config: dict, collection: str, document):
         logger = logging.getLogger(__name__)
 
-        # Structuring the request payload.
+        # Changes that leave the entity as it was last audited are skipped before any network I/O.
+        # Retries come through here again, but their fingerprint is only stored after success.
+        suppression = config.get("AUDIT_FINGERPRINT_CACHE_SIZE", 0) > 0
+        if suppression:
+            key = _entity_key(document["fullDocument"])
+            value = fingerprint(document["fullDocument"], config["AUDIT_IGNORED_FIELDS"])
+
+            if self.run.retry.statistics["attempt_number"] == 1:
+                _stats["seen"] += 1
+
+            if _fingerprints.get(key) == value:
+                _fingerprints.move_to_end(key)
+                _stats["suppressed"] += 1
+                logger.info(
+                    f"Change skipped as nothing audited has changed, "
+                    f"{_stats['suppressed']} of {_stats['seen']} events suppressed so far."
+                )
+                return 0
+
+        # Structuring the request payload. The change event ID (its resume token) is sent as an
+        # idempotency key, so redelivered events do not produce duplicate auditlogs.
+        # The body is encoded straight from the event, without an intermediate copy of the document.
         payload = {
             "collection": collection,
-            "document": json.loads(JSONEncoder().encode(document["fullDocument"])),
+            "event_id": document["_id"]["_data"],
+            "document": document["fullDocument"],
         }
 
         # Attempting to document the event via auditlogs endpoint.
         try:
             attempts = self.run.retry.statistics["attempt_number"]
-            response = httpx.post(config["AUDITLOG_ENDPOINT"], json=payload)
+            response = self.post(config, payload)
             response.raise_for_status()
             logger.info(f"Auditlog was created successfully after {attempts} attempt(s).")
+
+            if suppression:
+                remember_fingerprint(config, key, value)
+
             return attempts
 
         except httpx.RequestError as e:
@@ -62,17 +149,36 @@ class Job(JobInterface):
                 extra={
                     "status_code": e.response.status_code,
                     "reason": e.response.json(),
-                    "payload": json.dumps(payload),
+                    "payload": JSONEncoder().encode(payload),
                 },
             )
 
             # We only want to retry the task when failure is due to a dependency, eg DB.
             if e.response.status_code not in retry_codes:
-                backup_failed_event(config, collection, payload)
+                backup_failed_event(config, collection, json.loads(JSONEncoder().encode(payload)))
                 raise
 
             # For retryable codes, post payload to db-failed-events topic after 3 failed attempts.
             if attempts == 3:
-                backup_failed_event(config, collection, payload)
+                backup_failed_event(config, collection, json.loads(JSONEncoder().encode(payload)))
 
             raise DependencyException from e
+
+    # Posts the payload to the audit service. A BSON body that is rejected is sent again right away
+    # as JSON. The endpoint is switched to JSON for good, unless the JSON body is rejected as well,
+    # in which case it was the payload that was invalid and not its format.
+    def post(self, config: dict, payload: dict) -> httpx.Response:
+        endpoint = config["AUDITLOG_ENDPOINT"]
+
+        body, content_type = encode_payload(config, payload)
+        response = httpx.post(endpoint, content=body, headers={"Content-Type": content_type})
+
+        if response.status_code in _bson_rejected_codes and content_type == "application/bson":
+            body = JSONEncoder().encode(payload).encode()
+            response = httpx.post(endpoint, content=body, headers={"Content-Type": "application/json"})
+
+            if response.status_code not in _bson_rejected_codes:
+                logging.getLogger(__name__).warning(f"{endpoint} does not accept BSON, switching to JSON.")
+                _json_only_endpoints.add(endpoint)
+
+        return response
@@ -6,6 +6,28 @@ from tenacity import retry, wait_random_exponential
 from utils import JobInterface, JSONEncoder
 
 
+# Fields of an auditlog left out of slim events.
+_CLAIM_CHECK_FIELDS = ("document",)
+
+
+# Method to get the payload size above which auditlogs of a collection are published as slim events.
+def get_slim_threshold(config: dict, collection: str) -> int:
+    return config["PUBLISH_SLIM_THRESHOLDS"].get(collection, config["PUBLISH_SLIM_THRESHOLD_BYTES"])
+
+
+# Method to build a slim event from an auditlog, keeping its metadata and changes along with a
+# reference to fetch the full auditlog from the audit service.
+def slim_auditlog(config: dict, collection: str, auditlog: dict) -> dict:
+    slim = {key: value for key, value in auditlog.items() if key not in _CLAIM_CHECK_FIELDS}
+
+    reference = {"collection": collection, "id": auditlog["_id"]}
+    if config["AUDITLOG_ENDPOINT"]:
+        reference["url"] = f"{config['AUDITLOG_ENDPOINT'].rstrip('/')}/{collection}/{auditlog['_id']}"
+
+    slim["auditlog_ref"] = reference
+    return slim
+
+
 # Publishes auditlogs to corresponding event grid topic, where it can be used by subscribers.
 class Job(JobInterface):
     @retry(wait=wait_random_exponential(multiplier=1, max=10))
@@ -13,7 +35,14 @@ class Job(JobInterface):
         logger = logging.getLogger(__name__)
 
         try:
-            data = json.loads(JSONEncoder().encode(document["fullDocument"]))
+            encoded = JSONEncoder().encode(document["fullDocument"])
+
+            # Large auditlogs are published as slim events, subscribers fetch the rest on demand.
+            threshold = get_slim_threshold(config, collection)
+            if threshold >= 0 and len(encoded.encode()) > threshold:
+                encoded = JSONEncoder().encode(slim_auditlog(config, collection, document["fullDocument"]))
+
+            data = json.loads(encoded)
 
             publish_event(
                 config=config,
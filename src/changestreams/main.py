@@ -46,6 +46,15 @@ def main():
         logger.warning("Failed to proceed as argument combination is invalid.")
         sys.exit()
 
+    run_listener(job, collection, env)
+
+
+# Runs the listener of a single collection until it is stopped. Used by main for a standalone
+# listener process and by the orchestrator for listeners in its worker pool, which passes the
+# config it loaded already.
+def run_listener(job: str, collection: str, env: str = "\0", config: dict = None):
+    logger = logging.getLogger(__name__)
+
     # Adding custom record factory to logger so custom attributes are passed with every message.
     setup_logging(collection, job, env)
 
@@ -71,7 +80,7 @@ def main():
                 # [STEP 1] Load config from Azure App Configuration. Use .env if $RUN_ENV=LOCAL.
 
                 try:
-                    config = load_config(env)
+                    config = config or load_config()
                     logger.info("Successfully loaded configuration details.")
 
                 except Exception:
@@ -0,0 +1,334 @@
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import Connection
+from typing import Dict, List, Optional, Set, Tuple
+
+from pymongo import MongoClient
+
+from config import load_config
+
+
+# Runs every changestream listener from a single long-running process, replacing the static
+# supervisord.conf generated by supervisor.py.
+# Command syntax --> python orchestrator.py <env>
+# [OPTIONAL] env --> Azure App Config label (indicating env) to use when retrieving config data.
+#
+# -> Listeners are reconciled against the collections of both DBs, API collections get an audit
+#    listener and auditlog collections get a publish listener. New collections are picked up by
+#    polling and, optionally, a database level change stream on DDL events.
+# -> Listeners run in worker processes forked from a forkserver that has the changestream modules
+#    imported already, and idle workers are kept ready so starting a listener is just a message.
+# -> Listeners are pinned to cores round-robin and rebalanced whenever the set changes.
+# -> Crashed listeners are restarted with backoff, health and restart counters are served at
+#    http://localhost:<ORCHESTRATOR_HEALTH_PORT>/health.
+
+# Modules imported once by the forkserver and shared by every worker forked from it.
+_PRELOADED_MODULES = ["main", "changestream", "tokens", "publisher", "jobs.audit", "jobs.publish"]
+
+# Max delay before restarting a listener that keeps crashing.
+_MAX_RESTART_BACKOFF_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+# A listener is identified by its job and collection, eg -> ("audit", "comments").
+ListenerKey = Tuple[str, str]
+
+
+# Entrypoint of a pool worker. Waits idle until it is assigned a listener, then runs it until
+# the orchestrator terminates the process.
+def _worker(conn: Connection):
+    job, collection, env, config = conn.recv()
+    conn.close()
+
+    from main import run_listener
+
+    run_listener(job, collection, env, config)
+
+
+# A pre-forked worker process, idle until it is assigned a listener.
+class Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+        self.key: Optional[ListenerKey] = None
+        self.cpu: Optional[int] = None
+        self.started_at: Optional[float] = None
+
+    def assign(self, key: ListenerKey, env: str, config: dict):
+        self.key = key
+        self.started_at = time.time()
+        self.conn.send((key[0], key[1], env, config))
+        self.conn.close()
+
+    def pin(self, cpu: int):
+        # CPU affinity is only available on Linux.
+        if hasattr(os, "sched_setaffinity") and self.cpu != cpu:
+            try:
+                os.sched_setaffinity(self.process.pid, {cpu})
+                self.cpu = cpu
+            except OSError:
+                logger.warning(f"Failed to pin the {self.key} listener to CPU {cpu}.")
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=10)
+
+
+# Reconciles the listener workers with the collections found in both DBs.
+class Orchestrator:
+    def __init__(self, config: dict, env: str):
+        self.config = config
+        self.env = env
+
+        self.context = multiprocessing.get_context("forkserver")
+        self.context.set_forkserver_preload(_PRELOADED_MODULES)
+
+        self.spares: List[Worker] = []
+        self.listeners: Dict[ListenerKey, Worker] = {}
+        self.desired: Set[ListenerKey] = set()
+
+        # Restart counters and the earliest time each crashed listener may be restarted.
+        self.restarts: Dict[ListenerKey, int] = {}
+        self.next_start: Dict[ListenerKey, float] = {}
+
+        self.last_discovery: Optional[float] = None
+        self.discovery_errors = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+
+    # Method to list the collections of a DB to run listeners on.
+    def get_collection_list(self, connection_str: str, db_name: str) -> Set[str]:
+        mongo_client = MongoClient(connection_str)
+        try:
+            collections = mongo_client[db_name].list_collection_names()
+        finally:
+            mongo_client.close()
+
+        # Tokens collection is specific to changestreams and collections prefixed with "_"
+        # are internal to the audit service (eg its collection registry), not auditlogs.
+        return {
+            collection for collection in collections
+            if collection != self.config["TOKEN_COLLECTION"] and not collection.startswith("_")
+        }
+
+    # Method to work out which listeners should be running.
+    def discover(self):
+        api_collections = self.get_collection_list(
+            self.config["API_DB_CONNECTION_STRING"],
+            self.config["API_DB_NAME"],
+        )
+        audit_collections = self.get_collection_list(
+            self.config["AUDIT_DB_CONNECTION_STRING"],
+            self.config["AUDIT_DB_NAME"],
+        )
+
+        desired = {("audit", collection) for collection in api_collections}
+        desired |= {("publish", collection) for collection in audit_collections}
+
+        with self.lock:
+            if desired != self.desired:
+                logger.info(f"Discovered {len(api_collections)} API and {len(audit_collections)} audit collections.")
+            self.desired = desired
+            self.last_discovery = time.time()
+
+    # Method to watch a DB for created, dropped and renamed collections, waking up the
+    # reconcile loop right away. Created collections need MongoDB 6.0+ to be reported.
+    def watch_ddl(self, connection_str: str, db_name: str):
+        while not self.stopping.is_set():
+            try:
+                with MongoClient(connection_str) as mongo_client:
+                    with mongo_client[db_name].watch(
+                        pipeline=[{"$match": {"operationType": {"$in": ["create", "drop", "rename"]}}}],
+                        show_expanded_events=True,
+                    ) as stream:
+                        for event in stream:
+                            logger.info(f"Observed a {event['operationType']} event on collection {event['ns'].get('coll')}.")
+                            self.last_discovery = None
+                            self.wakeup.set()
+
+            except Exception:
+                logger.exception(f"DDL change stream on {db_name} failed, polling only until it is restarted.")
+                self.stopping.wait(_MAX_RESTART_BACKOFF_SECONDS)
+
+    # Method to take a pre-forked worker for a new listener, forking one if the pool is empty.
+    def take_worker(self) -> Worker:
+        return self.spares.pop() if self.spares else Worker(self.context)
+
+    # Method to bring the running listeners in line with the desired ones.
+    def reconcile(self):
+        now = time.time()
+
+        with self.lock:
+            desired = set(self.desired)
+
+        # Crashed listeners are restarted with exponential backoff.
+        for key, worker in list(self.listeners.items()):
+            if not worker.process.is_alive():
+                worker.process.join()
+                del self.listeners[key]
+
+                self.restarts[key] = self.restarts.get(key, 0) + 1
+                backoff = min(2 ** (self.restarts[key] - 1), _MAX_RESTART_BACKOFF_SECONDS)
+                self.next_start[key] = now + backoff
+                logger.warning(
+                    f"Listener {key[0]} {key[1]} exited with code {worker.process.exitcode}, "
+                    f"restarting in {backoff} seconds."
+                )
+
+        # Listeners of collections that are gone are stopped.
+        for key in set(self.listeners) - desired:
+            logger.info(f"Stopping listener {key[0]} {key[1]}.")
+            self.listeners.pop(key).stop()
+
+        # Missing listeners are started on pre-forked workers.
+        changed = False
+        for key in sorted(desired - set(self.listeners)):
+            if self.next_start.get(key, 0) > now:
+                continue
+
+            worker = self.take_worker()
+            worker.assign(key, self.env, self.config)
+            self.listeners[key] = worker
+            changed = True
+            logger.info(f"Started listener {key[0]} {key[1]} in worker {worker.process.pid}.")
+
+        # Spares are forked ahead of time, so the next listener starts without waiting.
+        while len(self.spares) < self.config["ORCHESTRATOR_SPARE_WORKERS"]:
+            self.spares.append(Worker(self.context))
+
+        if changed or any(worker.cpu is None for worker in self.listeners.values()):
+            self.rebalance()
+
+    # Method to spread the listeners evenly across the available cores.
+    def rebalance(self):
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+
+        for index, key in enumerate(sorted(self.listeners)):
+            self.listeners[key].pin(cpus[index % len(cpus)])
+
+    # Method to report the health of every listener along with restart counters.
+    def health(self) -> Tuple[bool, dict]:
+        with self.lock:
+            desired = set(self.desired)
+
+        # Served from another thread, so it works on copies of what the reconcile loop updates.
+        running, restarts = dict(self.listeners), dict(self.restarts)
+
+        listeners = {}
+        for key in sorted(desired | set(running) | set(restarts)):
+            worker = running.get(key)
+            listeners[f"{key[0]}:{key[1]}"] = {
+                "running": worker is not None and worker.process.is_alive(),
+                "pid": worker.process.pid if worker else None,
+                "cpu": worker.cpu if worker else None,
+                "started_at": worker.started_at if worker else None,
+                "restarts": restarts.get(key, 0),
+            }
+
+        healthy = all(listeners[f"{key[0]}:{key[1]}"]["running"] for key in desired)
+        return healthy, {
+            "status": "ok" if healthy else "degraded",
+            "listeners": listeners,
+            "spare_workers": len(self.spares),
+            "restarts": sum(restarts.values()),
+            "discovery_errors": self.discovery_errors,
+            "last_discovery": self.last_discovery,
+        }
+
+    # Method to serve the health report over HTTP from a background thread.
+    def serve_health(self):
+        orchestrator = self
+
+        class HealthHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/health":
+                    self.send_error(404)
+                    return
+
+                healthy, report = orchestrator.health()
+                body = json.dumps(report).encode()
+
+                self.send_response(200 if healthy else 503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", self.config["ORCHESTRATOR_HEALTH_PORT"]), HealthHandler)
+        threading.Thread(target=server.serve_forever, name="health", daemon=True).start()
+
+    # Method to run the orchestrator until it is signalled to stop.
+    def run(self):
+        self.serve_health()
+
+        if self.config["ORCHESTRATOR_WATCH_DDL"]:
+            for connection_str, db_name in (
+                (self.config["API_DB_CONNECTION_STRING"], self.config["API_DB_NAME"]),
+                (self.config["AUDIT_DB_CONNECTION_STRING"], self.config["AUDIT_DB_NAME"]),
+            ):
+                threading.Thread(target=self.watch_ddl, args=(connection_str, db_name), daemon=True).start()
+
+        while not self.stopping.is_set():
+            if (
+                self.last_discovery is None
+                or time.time() - self.last_discovery >= self.config["ORCHESTRATOR_POLL_SECONDS"]
+            ):
+                try:
+                    self.discover()
+                except Exception:
+                    self.discovery_errors += 1
+                    logger.exception("Failed to list collections, keeping the current listeners.")
+                    self.last_discovery = time.time()
+
+            self.reconcile()
+
+            # Liveness of the listeners is checked every second, unless a DDL event comes first.
+            self.wakeup.wait(1)
+            self.wakeup.clear()
+
+        self.shutdown()
+
+    # Method to stop every worker, listeners and spares alike.
+    def shutdown(self):
+        logger.info("Stopping all listeners...")
+        for worker in list(self.listeners.values()) + self.spares:
+            worker.stop()
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s.%(msecs)03d |:| %(levelname)s |:| %(name)s |:| %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+    env = sys.argv[1] if len(sys.argv) == 2 else "\0"  # \0 -> (No Label)
+    orchestrator = Orchestrator(load_config(), env)
+
+    def stop(signum, frame):
+        orchestrator.stopping.set()
+        orchestrator.wakeup.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    orchestrator.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from typing import Optional
 
+from azure.core.credentials import AzureKeyCredential
 from azure.core.messaging import CloudEvent
 from azure.eventgrid import EventGridPublisherClient
 from azure.identity import DefaultAzureCredential
@@ -18,7 +19,11 @@ def get_eventgrid_client(config: dict) -> EventGridPublisherClient:
 
     # Lazy initialization.
     if not _eventgrid_client:
-        credential = DefaultAzureCredential()
+        # An access key is used when set, eg -> for the local Event Grid emulator in src/emulator.
+        credential = (
+            AzureKeyCredential(config["EVENT_DOMAIN_KEY"])
+            if config.get("EVENT_DOMAIN_KEY") else DefaultAzureCredential()
+        )
         _eventgrid_client = EventGridPublisherClient(
             config["EVENT_DOMAIN_ENDPOINT"],
             credential,
@@ -7,6 +7,8 @@ from config import load_config
 # This script can be used to dynamically generate supervisord.conf file with:
 # -> Changestream listeners on all API collections to post to Auditlogs service.
 # -> Changestream listeners on all auditlog collections to post to Event Grid topic.
+# The conf is static, so new collections need it to be regenerated. orchestrator.py runs the
+# same listeners from a single process and picks up collection changes on its own.
 
 # Sample program block for an API collection listener.
 api_collection_program_block = [
@@ -50,9 +52,10 @@ def get_collection_list(config: dict, connection_str: str, db_name: str):
     if config["TOKEN_COLLECTION"] in collections:
         collections.remove(config["TOKEN_COLLECTION"])
 
-    # Close the connection and return the collection list.
+    # Close the connection and return the collection list. Collections prefixed with "_"
+    # are internal to the audit service (eg its collection registry), not auditlogs.
     mongo_client.close()
-    return sorted([collection for collection in collections])
+    return sorted([collection for collection in collections if not collection.startswith("_")])
 
 
 # Function to generate a conf program block for a collection.
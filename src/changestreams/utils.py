@@ -4,6 +4,7 @@ from abc import ABC, abstractmethod
 from datetime import datetime
 
 from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
 
 
 # Interface to be implemented by different job classes.
@@ -13,9 +14,12 @@ class JobInterface(ABC):
         pass
 
 
-# Custom handling of ObjectID and Datetime type values for JSON Encoder.
+# Custom handling of ObjectID, Datetime and raw BSON values for JSON Encoder.
 class JSONEncoder(json.JSONEncoder):
     def default(self, o):
+        # Only the top level of a raw document is decoded here, nested ones come back through default.
+        if isinstance(o, RawBSONDocument):
+            return dict(o.items())
         if isinstance(o, ObjectId):
             return str(o)
         if isinstance(o, datetime):
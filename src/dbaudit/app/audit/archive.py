@@ -0,0 +1,399 @@
+import asyncio
+import heapq
+import json
+import os
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+import bson
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytz
+from bson.codec_options import CodecOptions
+from bson.objectid import ObjectId
+
+from app.audit.config import AppConfig
+from app.audit.models import AuditlogFilter
+
+
+# Cold tier of the audit trail. Logs moved out of Mongo are kept as zstd compressed Parquet files:
+#   ARCHIVE_PATH/collection=<collection>/date=<YYYY-MM-DD>/part-<uuid>.parquet
+#   ARCHIVE_PATH/collection=<collection>/manifest.json
+# The manifest lists the parts of every date partition and the watermark of the collection.
+# Every archived log was executed before the watermark, so queries starting at or after it
+# never need the archive. Only parts listed in the manifest are ever read.
+
+# Columns used for filtering are typed, the rest of the log is kept as BSON so nested
+# documents round-trip without losing ObjectId and datetime values.
+_schema = pa.schema([
+    ("_id", pa.string()),
+    ("entity_id", pa.string()),
+    ("operation_type", pa.string()),
+    ("executed_at", pa.timestamp("ms", tz="UTC")),
+    ("executed_by", pa.string()),
+    ("version", pa.int64()),
+    ("event_id", pa.string()),
+    ("changed_fields", pa.list_(pa.string())),
+    ("created_at", pa.timestamp("ms", tz="UTC")),
+    ("payload", pa.binary()),
+])
+
+_codec_options = CodecOptions(tz_aware=True)
+
+# Fields of a log kept in the payload column.
+_payload_fields = ("document", "changes", "warnings")
+
+# Columns read to select and count the logs of a search, the payload is only read for its page.
+_index_columns = ["_id", "executed_at", "changed_fields"]
+
+# Manifests are reloaded whenever they change on disk, as they are written by the compaction job.
+_manifests: Dict[str, Tuple[float, Dict]] = {}
+_manifests_lock = threading.Lock()
+
+
+def _collection_dir(collection: str) -> str:
+    return os.path.join(AppConfig.ARCHIVE_PATH, f"collection={collection}")
+
+
+def _manifest_path(collection: str) -> str:
+    return os.path.join(_collection_dir(collection), "manifest.json")
+
+
+# Method to load the manifest of a collection, empty if nothing was archived yet.
+def load_manifest(collection: str) -> Dict:
+    path = _manifest_path(collection)
+    try:
+        mtime = os.path.getmtime(path)
+    except FileNotFoundError:
+        return {"watermark": None, "partitions": {}}
+
+    with _manifests_lock:
+        cached = _manifests.get(collection)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+    with open(path) as f:
+        manifest = json.load(f)
+
+    with _manifests_lock:
+        _manifests[collection] = (mtime, manifest)
+
+    return manifest
+
+
+# Method to save a manifest atomically, so readers never see a partially written one.
+def _save_manifest(collection: str, manifest: Dict):
+    path = _manifest_path(collection)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _to_row(log: Dict) -> Dict:
+    return {
+        "_id": str(log["_id"]),
+        "entity_id": str(log["entity_id"]),
+        "operation_type": log["operation_type"],
+        "executed_at": log["executed_at"],
+        "executed_by": str(log["executed_by"]),
+        "version": log.get("version"),
+        "event_id": log.get("event_id"),
+        "changed_fields": log.get("changed_fields") or [],
+        "created_at": log.get("created_at"),
+        "payload": bson.encode({
+            "document": log.get("document"),
+            "changes": log.get("changes"),
+            "warnings": log.get("warnings") or [],
+        }),
+    }
+
+
+# Method to rebuild a log from a row. Rows read with only some columns give the matching fields.
+def _to_log(row: Dict, collection: str) -> Dict:
+    payload = bson.decode(row["payload"], codec_options=_codec_options) if "payload" in row else {}
+    log = {
+        "_id": ObjectId(row["_id"]),
+        "collection": collection,
+        "entity_id": ObjectId(row["entity_id"]) if "entity_id" in row else None,
+        "operation_type": row.get("operation_type"),
+        "executed_at": row["executed_at"],
+        "executed_by": ObjectId(row["executed_by"]) if "executed_by" in row else None,
+        "version": row.get("version"),
+        "event_id": row.get("event_id"),
+        "document": payload.get("document"),
+        "changes": payload.get("changes"),
+        "changed_fields": row.get("changed_fields"),
+        "warnings": payload.get("warnings"),
+        "created_at": row.get("created_at"),
+    }
+    return {key: value for key, value in log.items() if key in row or key in payload or key == "collection"}
+
+
+# Method to list the columns needed for a Mongo style projection, None for all of them.
+def _projected_columns(projection: Optional[Dict]) -> Optional[List[str]]:
+    if not projection or not all(projection.values()):
+        return None
+
+    fields = {path.split(".")[0] for path in projection}
+    columns = [name for name in _schema.names if name in fields or name in _index_columns]
+    if fields.intersection(_payload_fields):
+        columns.append("payload")
+    return columns
+
+
+# Method to write logs to the archive, one part per date partition, and move the watermark up.
+# Called by the compaction job, which holds the lease of the collection.
+def write_archive(collection: str, logs: List[Dict], watermark: datetime):
+    by_date: Dict[str, List[Dict]] = defaultdict(list)
+    for log in logs:
+        by_date[log["executed_at"].astimezone(pytz.utc).date().isoformat()].append(log)
+
+    manifest = dict(load_manifest(collection))
+    partitions = {date: list(parts) for date, parts in manifest["partitions"].items()}
+
+    for date, date_logs in by_date.items():
+        directory = os.path.join(_collection_dir(collection), f"date={date}")
+        os.makedirs(directory, exist_ok=True)
+
+        name = f"part-{uuid.uuid4().hex}.parquet"
+        table = pa.Table.from_pylist([_to_row(log) for log in date_logs], schema=_schema)
+        pq.write_table(
+            table,
+            os.path.join(directory, name),
+            compression="zstd",
+            compression_level=AppConfig.ARCHIVE_COMPRESSION_LEVEL,
+            row_group_size=AppConfig.ARCHIVE_ROW_GROUP_SIZE,
+        )
+
+        partitions.setdefault(date, []).append({"file": f"date={date}/{name}", "rows": len(date_logs)})
+
+    current = manifest["watermark"]
+    manifest["watermark"] = max(current, watermark.isoformat()) if current else watermark.isoformat()
+    manifest["partitions"] = partitions
+
+    _save_manifest(collection, manifest)
+
+
+# Method to get the archive watermark of a collection, None if nothing was archived yet.
+def get_watermark(collection: str) -> Optional[datetime]:
+    watermark = load_manifest(collection)["watermark"]
+    return datetime.fromisoformat(watermark) if watermark else None
+
+
+# Method to check whether a query needs the archive of a collection. Reading the archive means
+# scanning Parquet parts, so it is only done when asked for, or for queries explicitly starting
+# before the watermark.
+def needs_archive(collection: str, start_date: Optional[datetime], include_archive: bool = False) -> bool:
+    watermark = get_watermark(collection)
+    if watermark is None:
+        return False
+    if include_archive:
+        return True
+    return start_date is not None and _as_utc(start_date) < watermark
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.astimezone(pytz.utc) if value.tzinfo else pytz.utc.localize(value)
+
+
+# Method to list the date partitions overlapping a date range, along with their part files.
+def _prune_partitions(collection: str, request: AuditlogFilter) -> List[Tuple[str, List[str]]]:
+    start = _as_utc(request.start_date).date().isoformat() if request.start_date else None
+    end = _as_utc(request.end_date).date().isoformat() if request.end_date else None
+
+    partitions = []
+    for date, parts in sorted(load_manifest(collection)["partitions"].items()):
+        if (start and date < start) or (end and date > end):
+            continue
+        partitions.append((date, [os.path.join(_collection_dir(collection), part["file"]) for part in parts]))
+
+    return partitions
+
+
+# Method to translate a search filter into Parquet row filters, so row groups are skipped using
+# their statistics. Changed fields are matched after reading, as they are a list column.
+def _row_filters(request: AuditlogFilter) -> Optional[List[Tuple]]:
+    filters = []
+
+    if request.entity_id:
+        filters.append(("entity_id", "=", request.entity_id))
+
+    if request.user_id:
+        filters.append(("executed_by", "=", request.user_id))
+
+    if request.operation_type:
+        filters.append(("operation_type", "=", request.operation_type.value))
+
+    if request.start_date:
+        filters.append(("executed_at", ">=", _as_utc(request.start_date)))
+
+    if request.end_date:
+        filters.append(("executed_at", "<=", _as_utc(request.end_date)))
+
+    return filters or None
+
+
+# Method to read the matching rows of one date partition without duplicates. Logs archived again
+# after an interrupted compaction pass always land in the same partition. Logs listed in exclude_ids
+# are skipped, eg -> those still in the hot tier.
+def _read_rows(
+    request: AuditlogFilter,
+    files: List[str],
+    columns: Optional[List[str]] = None,
+    exclude_ids: Optional[Set[str]] = None,
+) -> List[Dict]:
+    rows = []
+    for file in files:
+        rows.extend(pq.read_table(file, columns=columns, filters=_row_filters(request)).to_pylist())
+
+    seen = set(exclude_ids or ())
+    matches = []
+    for row in rows:
+        if row["_id"] in seen:
+            continue
+        if request.changed_field and request.changed_field not in row["changed_fields"]:
+            continue
+        seen.add(row["_id"])
+        matches.append(row)
+
+    return matches
+
+
+# Method to read the matching logs of one date partition in executed_at order.
+def _read_partition(
+    collection: str,
+    request: AuditlogFilter,
+    files: List[str],
+    descending: bool,
+    columns: Optional[List[str]] = None,
+) -> List[Dict]:
+    rows = _read_rows(request, files, columns=columns)
+    rows.sort(key=lambda row: row["executed_at"], reverse=descending)
+    return [_to_log(row, collection) for row in rows]
+
+
+# Method to read the given logs of one date partition, in the order of their IDs. IDs start with
+# their creation time, so the row groups of most parts are skipped using their statistics.
+def _read_logs(collection: str, files: List[str], ids: List[str], columns: Optional[List[str]]) -> List[Dict]:
+    rows = {}
+    for file in files:
+        for row in pq.read_table(file, columns=columns, filters=[("_id", "in", ids)]).to_pylist():
+            rows.setdefault(row["_id"], row)
+
+    return [_to_log(rows[log_id], collection) for log_id in ids]
+
+
+# Method to apply a Mongo style projection to an archived log. Dotted paths keep their whole top level field.
+def project(log: Dict, projection: Optional[Dict]) -> Dict:
+    if not projection:
+        return log
+
+    fields = {path.split(".")[0] for path in projection}
+    if all(projection.values()):
+        return {key: value for key, value in log.items() if key == "_id" or key in fields}
+
+    return {key: value for key, value in log.items() if key not in fields}
+
+
+# Method to search the archive, returning up to limit logs in executed_at order and the number of matches.
+# Matches are selected and counted from the few index columns, and only the logs making it into the
+# page are then read in full, or with just the columns of the projection. Logs listed in exclude_ids
+# are still in the hot tier, mid-archival, and are left to it.
+def query_archive(
+    request: AuditlogFilter,
+    limit: int,
+    descending: bool,
+    exclude_ids: Optional[Set[str]] = None,
+    projection: Optional[Dict] = None,
+) -> Tuple[List[Dict], int]:
+    partitions = _prune_partitions(request.collection, request)
+    if descending:
+        partitions.reverse()
+
+    columns = _projected_columns(projection)
+    logs: List[Dict] = []
+    count = 0
+    for _, files in partitions:
+        rows = _read_rows(request, files, columns=_index_columns, exclude_ids=exclude_ids)
+        count += len(rows)
+
+        if len(logs) < limit and rows:
+            rows.sort(key=lambda row: row["executed_at"], reverse=descending)
+            ids = [row["_id"] for row in rows[:limit - len(logs)]]
+            logs.extend(_read_logs(request.collection, files, ids, columns))
+
+    return logs, count
+
+
+# Method to stream the matching logs of the archive in executed_at order, one partition at a time.
+async def iter_archive(
+    request: AuditlogFilter,
+    projection: Optional[Dict],
+    descending: bool,
+) -> AsyncIterator[Dict]:
+    partitions = _prune_partitions(request.collection, request)
+    if descending:
+        partitions.reverse()
+
+    columns = _projected_columns(projection)
+    for _, files in partitions:
+        logs = await asyncio.to_thread(_read_partition, request.collection, request, files, descending, columns)
+        for log in logs:
+            yield project(log, projection)
+
+
+# Method to merge hot and archived logs of a search page, both already sorted by executed_at.
+# A log can briefly be in both tiers while it is being archived, so it is only kept once.
+def merge_logs(hot: Iterable[Dict], cold: Iterable[Dict], descending: bool) -> List[Dict]:
+    merged = heapq.merge(hot, cold, key=lambda log: log["executed_at"], reverse=descending)
+
+    seen = set()
+    logs = []
+    for log in merged:
+        if log["_id"] not in seen:
+            seen.add(log["_id"])
+            logs.append(log)
+
+    return logs
+
+
+# Method to merge hot and archived log streams for exports, both already sorted by executed_at.
+async def merge_log_streams(
+    hot: AsyncIterator[Dict],
+    cold: AsyncIterator[Dict],
+    descending: bool,
+) -> AsyncIterator[Dict]:
+    def before(a: Dict, b: Dict) -> bool:
+        return a["executed_at"] > b["executed_at"] if descending else a["executed_at"] <= b["executed_at"]
+
+    async def next_or_none(stream: AsyncIterator[Dict]) -> Optional[Dict]:
+        try:
+            return await stream.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    hot, cold = hot.__aiter__(), cold.__aiter__()
+    hot_log, cold_log = await next_or_none(hot), await next_or_none(cold)
+
+    # Duplicates share their executed_at, so only the IDs seen at the current timestamp are kept.
+    current_at, seen = None, set()
+
+    while hot_log is not None or cold_log is not None:
+        if cold_log is None or (hot_log is not None and before(hot_log, cold_log)):
+            log, hot_log = hot_log, await next_or_none(hot)
+        else:
+            log, cold_log = cold_log, await next_or_none(cold)
+
+        if log["executed_at"] != current_at:
+            current_at, seen = log["executed_at"], set()
+
+        if log["_id"] in seen:
+            continue
+
+        seen.add(log["_id"])
+        yield log
@@ -0,0 +1,62 @@
+import json
+from typing import Any, Dict
+
+import bson
+import msgpack
+from bson.codec_options import CodecOptions
+from bson.objectid import ObjectId
+
+
+# Media types accepted for auditlog ingestion. Binary bodies keep ObjectId and datetime values
+# as they are, so producers reading from Mongo can send documents without converting them.
+JSON_MEDIA_TYPE = "application/json"
+BSON_MEDIA_TYPE = "application/bson"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# MessagePack extension type carrying the 12 raw bytes of an ObjectId. Datetimes use the
+# standard timestamp extension.
+MSGPACK_OBJECTID_EXT = 1
+
+_bson_codec_options = CodecOptions(tz_aware=True)
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code == MSGPACK_OBJECTID_EXT:
+        return ObjectId(data)
+    return msgpack.ExtType(code, data)
+
+
+# Exception raised when a body is sent with a media type the service cannot decode.
+class UnsupportedMediaTypeException(Exception):
+    pass
+
+
+# Method to decode a request body according to its media type.
+def decode_body(content_type: str, body: bytes) -> Any:
+    media_type = content_type.split(";")[0].strip().lower() or JSON_MEDIA_TYPE
+
+    if media_type == JSON_MEDIA_TYPE:
+        return json.loads(body)
+
+    if media_type == BSON_MEDIA_TYPE:
+        return bson.decode(body, codec_options=_bson_codec_options)
+
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.unpackb(body, ext_hook=_msgpack_ext_hook, timestamp=3, raw=False)
+
+    raise UnsupportedMediaTypeException(media_type)
+
+
+# OpenAPI request body for endpoints accepting any of the media types above.
+def request_body_schema(model) -> Dict:
+    binary = {"schema": {"type": "string", "format": "binary"}}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                JSON_MEDIA_TYPE: {"schema": model.schema()},
+                BSON_MEDIA_TYPE: binary,
+                MSGPACK_MEDIA_TYPE: binary,
+            },
+        },
+    }
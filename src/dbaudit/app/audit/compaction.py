@@ -0,0 +1,379 @@
+import asyncio
+import logging
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+import pymongo
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ExecutionTimeout
+
+from app.audit import metrics
+from app.audit.archive import write_archive
+from app.audit.config import AppConfig
+from app.audit.database import get_audit_db_client, get_collections, load_registry
+from app.audit.diff import apply_changes, diff_documents
+from app.audit.enums import OperationType
+from app.audit.executor import ExecutorSaturatedException, get_diff_executor
+from app.audit.state import get_state_cache
+from app.audit.utils import get_current_datetime
+
+
+logger = logging.getLogger(__name__)
+
+# Background task running compaction passes over every audit collection.
+_compaction_task: Optional[asyncio.Task] = None
+
+
+# Writes needed to compact the audit trail of a single entity.
+class CompactionPlan(NamedTuple):
+    updates: List[UpdateOne]
+    rewritten: List[ObjectId]
+    expired: List[Dict]
+    merged: List[ObjectId]
+    tombstones: List[Dict]
+
+
+# Method to rebuild the entity state after every log of its version chain.
+# Returns None if the chain does not start with a snapshot.
+def _rebuild_states(logs: List[Dict]) -> Optional[List[Dict]]:
+    states: List[Dict] = []
+    state = None
+
+    for log in logs:
+        if log.get("document") is not None:
+            state = log["document"]
+        elif state is None:
+            return None
+        else:
+            state = apply_changes(state, log.get("changes") or {})
+        states.append(state)
+
+    return states
+
+
+# Method to check whether a log can be merged into the log that follows it.
+def _is_mergeable(log: Dict, following: Dict, run_start: Dict, window: timedelta) -> bool:
+    return (
+        following["operation_type"] == OperationType.UPDATE.value
+        and following["executed_by"] == log["executed_by"]
+        and following["executed_at"] - run_start["executed_at"] <= window
+    )
+
+
+# Method to plan the compaction of one entity, given all its versioned logs in version order.
+# Runs off the event loop, as merging rediffs entity states.
+def plan_entity(logs: List[Dict], cutoff: Optional[datetime], window: Optional[timedelta]) -> Optional[CompactionPlan]:
+    states = _rebuild_states(logs)
+    if states is None:
+        return None
+
+    now = get_current_datetime()
+
+    # Expired logs form a prefix of the chain, so what remains is still a valid chain.
+    # The latest log of the entity is always kept.
+    first = 0
+    if cutoff is not None:
+        while first < len(logs) - 1 and logs[first]["executed_at"] < cutoff:
+            first += 1
+
+    sets: Dict[int, Dict] = {}
+    merged: List[ObjectId] = []
+    tombstones: List[Dict] = []
+
+    # Runs of consecutive UPDATE logs by the same user within the window are merged into the last
+    # log of the run, whose changes are rediffed against the state before the run. Merged logs
+    # become snapshots, so a state rebuilt while the run is being deleted is never wrong.
+    # Runs that could still grow with new changes are left for a later pass.
+    i = max(first, 1)
+    while window is not None and i < len(logs):
+        j = i
+        if logs[i]["operation_type"] == OperationType.UPDATE.value:
+            while (
+                j + 1 < len(logs)
+                and _is_mergeable(logs[j], logs[j + 1], logs[i], window)
+                and logs[j + 1]["executed_at"] < now - window
+            ):
+                j += 1
+
+        if j > i:
+            changes, changed_fields = diff_documents(states[j], states[i - 1])
+            sets[j] = {"changes": changes, "changed_fields": changed_fields}
+            if logs[j].get("document") is None:
+                sets[j]["document"] = states[j]
+            merged.extend(log["_id"] for log in logs[i:j])
+
+            # Replays of merged events resolve to the log they were merged into.
+            tombstones.extend(
+                {
+                    "_id": log["event_id"],
+                    "collection": log["collection"],
+                    "entity_id": log["entity_id"],
+                    "auditlog_id": logs[j]["_id"],
+                    "created_at": now,
+                }
+                for log in logs[i:j] if log.get("event_id")
+            )
+
+        i = j + 1
+
+    # The earliest remaining log is rebased into a snapshot if it only held changes.
+    merged_ids = set(merged)
+    earliest = next(k for k in range(first, len(logs)) if logs[k]["_id"] not in merged_ids)
+    if logs[earliest].get("document") is None:
+        sets.setdefault(earliest, {})["document"] = states[earliest]
+
+    return CompactionPlan(
+        updates=[UpdateOne({"_id": logs[k]["_id"]}, {"$set": fields}) for k, fields in sets.items()],
+        rewritten=[logs[k]["_id"] for k in sets],
+        expired=logs[:first],
+        merged=merged,
+        tombstones=tombstones,
+    )
+
+
+# Method to apply the compaction plans of a batch of entities. Rebased and merged logs are written
+# before anything is deleted, so chains can be rebuilt at any point in between. Expired logs of the
+# whole batch are archived together, so the cold tier gets one part per date rather than per entity.
+async def apply_plans(collection: AsyncIOMotorCollection, plans: List[CompactionPlan], cutoff: Optional[datetime]):
+    updates = [update for plan in plans for update in plan.updates]
+    expired = [log for plan in plans for log in plan.expired]
+    merged = [log_id for plan in plans for log_id in plan.merged]
+    tombstones = [tombstone for plan in plans for tombstone in plan.tombstones]
+    rewritten = [log_id for plan in plans for log_id in plan.rewritten]
+
+    if updates:
+        await collection.bulk_write(updates, ordered=False)
+
+    if tombstones:
+        try:
+            await collection.database[AppConfig.COMPACTION_TOMBSTONE_COLLECTION].insert_many(tombstones, ordered=False)
+
+        # Tombstones written by an interrupted pass are already there.
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    if expired and AppConfig.RETENTION_MODE == "archive":
+        archive = collection.database[f"_archive_{collection.name}"]
+        try:
+            await archive.insert_many(expired, ordered=False)
+
+        # Logs archived by an interrupted pass are already there.
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+    if expired and AppConfig.RETENTION_MODE == "cold":
+        await asyncio.to_thread(write_archive, collection.name, expired, cutoff)
+
+    ids = [log["_id"] for log in expired] + merged
+    if ids:
+        await collection.delete_many({"_id": {"$in": ids}})
+
+    # Cached states of logs rebuilt from the old chain are dropped, in this worker at least.
+    get_state_cache().invalidate(ids + rewritten)
+
+    metrics.counter("compaction_expired_logs").inc(len(expired))
+    metrics.counter("compaction_merged_logs").inc(len(merged))
+
+
+# Method to create the TTL index of the tombstones left by merged logs.
+async def create_compaction_indexes(db: AsyncIOMotorDatabase):
+    await db[AppConfig.COMPACTION_TOMBSTONE_COLLECTION].create_index(
+        "created_at",
+        name="tombstone_ttl",
+        expireAfterSeconds=AppConfig.COMPACTION_TOMBSTONE_TTL_SECONDS,
+    )
+
+
+# Method to find the tombstone of a merged event, None if the event was not merged away.
+async def find_tombstone(db: AsyncIOMotorDatabase, collection: str, event_id: str, max_time_ms: int) -> Optional[Dict]:
+    return await db[AppConfig.COMPACTION_TOMBSTONE_COLLECTION].find_one(
+        {"_id": event_id, "collection": collection},
+        max_time_ms=max_time_ms,
+    )
+
+
+# Method to plan the compaction of one entity. Logs written before versioning are left alone.
+# Only the start of long chains is read, within the compaction query budget.
+async def compact_entity(
+    collection: AsyncIOMotorCollection,
+    entity_id: ObjectId,
+    cutoff: Optional[datetime],
+    window: Optional[timedelta],
+) -> Optional[CompactionPlan]:
+    cursor = (
+        collection.find({"entity_id": entity_id, "version": {"$exists": True}})
+        .sort("version", pymongo.ASCENDING)
+        .limit(AppConfig.COMPACTION_MAX_ENTITY_LOGS)
+        .batch_size(AppConfig.COMPACTION_BATCH_SIZE)
+        .max_time_ms(AppConfig.QUERY_BUDGETS_MS["compaction"])
+    )
+
+    logs = []
+    try:
+        async for log in cursor:
+            logs.append(log)
+
+    except ExecutionTimeout:
+        logger.warning(f"Skipped compacting entity {str(entity_id)} in {collection.name}, reading its logs ran out of budget.")
+        return None
+
+    finally:
+        await cursor.close()
+
+    # Planning is CPU bound, so it goes through the diff executor like any other diff. Entities
+    # that cannot be planned right now are picked up again by the next pass.
+    try:
+        plan = await get_diff_executor().run(
+            AppConfig.DIFF_INLINE_THRESHOLD,
+            plan_entity,
+            logs,
+            cutoff,
+            window,
+        )
+
+    except (ExecutorSaturatedException, asyncio.TimeoutError):
+        logger.warning(f"Skipped compacting entity {str(entity_id)} in {collection.name}, the diff executor is busy.")
+        return None
+
+    if plan is None:
+        logger.warning(f"Skipped compacting entity {str(entity_id)} in {collection.name}, its chain has no snapshot.")
+
+    return plan
+
+
+# Method to get the next batch of entities to compact, walking the entity ID index.
+async def _next_entity_ids(collection: AsyncIOMotorCollection, after: Optional[ObjectId], limit: int) -> List[ObjectId]:
+    entity_ids: List[ObjectId] = []
+
+    while len(entity_ids) < limit:
+        criteria: Dict = {"version": {"$exists": True}}
+        if after is not None:
+            criteria["entity_id"] = {"$gt": after}
+
+        log = await collection.find_one(criteria, projection={"entity_id": 1}, sort=[("entity_id", pymongo.ASCENDING)])
+        if log is None:
+            break
+
+        after = log["entity_id"]
+        entity_ids.append(after)
+
+    return entity_ids
+
+
+# Method to take the compaction lease of a collection, returns False if another worker holds it.
+async def _acquire_lease(checkpoints: AsyncIOMotorCollection, collection: str) -> bool:
+    now = get_current_datetime()
+    try:
+        await checkpoints.update_one(
+            {"_id": collection, "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]},
+            {"$set": {"lease_until": now + timedelta(seconds=AppConfig.COMPACTION_LEASE_SECONDS)}},
+            upsert=True,
+        )
+
+    # The checkpoint exists but its lease is held, so the upsert collided with it.
+    except DuplicateKeyError:
+        return False
+
+    return True
+
+
+# Method to run a compaction pass over an audit collection, resuming from its checkpoint.
+async def compact_collection(db: AsyncIOMotorDatabase, collection: str):
+    checkpoints = db[AppConfig.COMPACTION_CHECKPOINT_COLLECTION]
+
+    if not await _acquire_lease(checkpoints, collection):
+        logger.info(f"Compaction of {collection} is already running elsewhere.")
+        return
+
+    cutoff = (
+        get_current_datetime() - timedelta(days=AppConfig.RETENTION_DAYS)
+        if AppConfig.RETENTION_DAYS > 0 else None
+    )
+    window = (
+        timedelta(seconds=AppConfig.COMPACTION_MERGE_WINDOW_SECONDS)
+        if AppConfig.COMPACTION_MERGE_WINDOW_SECONDS > 0 else None
+    )
+
+    try:
+        checkpoint = await checkpoints.find_one({"_id": collection})
+        after = checkpoint.get("entity_id")
+        compacted = 0
+
+        while entity_ids := await _next_entity_ids(db[collection], after, AppConfig.COMPACTION_BATCH_SIZE):
+            plans = [await compact_entity(db[collection], entity_id, cutoff, window) for entity_id in entity_ids]
+            await apply_plans(db[collection], [plan for plan in plans if plan is not None], cutoff)
+
+            after = entity_ids[-1]
+            compacted += len(entity_ids)
+
+            now = get_current_datetime()
+            await checkpoints.update_one(
+                {"_id": collection},
+                {"$set": {
+                    "entity_id": after,
+                    "lease_until": now + timedelta(seconds=AppConfig.COMPACTION_LEASE_SECONDS),
+                    "updated_at": now,
+                }},
+            )
+
+            # Throttling, so compaction does not compete with live ingestion.
+            await asyncio.sleep(AppConfig.COMPACTION_BATCH_DELAY_MS / 1000)
+
+        # The next pass starts over from the first entity.
+        await checkpoints.update_one(
+            {"_id": collection},
+            {"$unset": {"entity_id": ""}, "$set": {"completed_at": get_current_datetime()}},
+        )
+        logger.info(f"Compaction of {collection} completed over {compacted} entities.")
+
+    finally:
+        await checkpoints.update_one({"_id": collection}, {"$set": {"lease_until": get_current_datetime()}})
+
+
+# Method to periodically compact every audit collection in the background.
+async def run_compaction():
+    while True:
+        await asyncio.sleep(AppConfig.COMPACTION_INTERVAL_SECONDS)
+
+        db: AsyncIOMotorDatabase = get_audit_db_client()[AppConfig.AUDIT_DB_NAME]
+        for collection in sorted(get_collections()):
+            try:
+                await compact_collection(db, collection)
+            except Exception:
+                logger.exception(f"Failed to compact collection {collection}.")
+
+
+# Method to start the background compaction job at router startup, if enabled.
+def start_compaction():
+    global _compaction_task
+
+    if AppConfig.COMPACTION_INTERVAL_SECONDS > 0:
+        _compaction_task = asyncio.create_task(run_compaction())
+
+
+# Method to stop the background compaction job at shutdown.
+def stop_compaction():
+    if _compaction_task is not None and not _compaction_task.done():
+        _compaction_task.cancel()
+
+
+# Compaction command, defaulting to every collection in the registry.
+# Command syntax --> python -m app.audit.compaction [<collection> ...]
+async def main(collections: List[str]):
+    if not collections:
+        await load_registry()
+        collections = sorted(get_collections())
+
+    db: AsyncIOMotorDatabase = get_audit_db_client()[AppConfig.AUDIT_DB_NAME]
+    for collection in collections:
+        await compact_collection(db, collection)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(sys.argv[1:]))
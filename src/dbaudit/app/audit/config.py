@@ -19,4 +19,138 @@ class AppConfig:
     # can extract the required details from incoming requests.
     EXECUTED_AT_FIELD_NAME = os.environ.get("EXECUTED_AT_FIELD_NAME", "last_updated_at")
     EXECUTED_BY_FIELD_NAME = os.environ.get("EXECUTED_BY_FIELD_NAME", "last_updated_by")
-    
\ No newline at end of file
+
+    # Streaming exports read the audit trail in cursor batches of this size and flush
+    # NDJSON to the client once the buffered output reaches the chunk size (bytes).
+    EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 500))
+    EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 64 * 1024))
+
+    # Limits for the structural diff engine. The size budget caps the number of nodes visited
+    # per diff, past which changed subtrees are reported whole. The list match budget caps the
+    # (new x old) element pairs considered when aligning arrays, past which items are compared
+    # by position instead.
+    DIFF_SIZE_BUDGET = int(os.environ.get("DIFF_SIZE_BUDGET", 100_000))
+    DIFF_LIST_MATCH_BUDGET = int(os.environ.get("DIFF_LIST_MATCH_BUDGET", 250_000))
+
+    # Diffing is CPU bound, so it runs off the event loop. Documents below the inline threshold
+    # (bytes) are diffed directly, those above the process threshold go to the process pool and
+    # the rest go to the thread pool. Set DIFF_PROCESS_WORKERS to 0 to disable the process pool.
+    # NOTE Thread pool diffs still hold the GIL, so they only keep the event loop responsive
+    # and do not add diff throughput, which only the process pool does. Past the process
+    # threshold a diff with many changes costs several times more than pickling the documents.
+    DIFF_INLINE_THRESHOLD = int(os.environ.get("DIFF_INLINE_THRESHOLD", 16 * 1024))
+    DIFF_PROCESS_THRESHOLD = int(os.environ.get("DIFF_PROCESS_THRESHOLD", 64 * 1024))
+    DIFF_THREAD_WORKERS = int(os.environ.get("DIFF_THREAD_WORKERS", 4))
+    DIFF_PROCESS_WORKERS = int(os.environ.get("DIFF_PROCESS_WORKERS", 2))
+
+    # Max diffs waiting on or running in the pools before new ones are rejected, and the
+    # time allowed for a diff before the request gives up on it.
+    DIFF_MAX_PENDING = int(os.environ.get("DIFF_MAX_PENDING", 64))
+    DIFF_TIMEOUT_SECONDS = float(os.environ.get("DIFF_TIMEOUT_SECONDS", 10))
+
+    # Storage mode for auditlog documents. In "full" mode every log keeps the entity snapshot,
+    # in "delta" mode only every SNAPSHOT_INTERVAL-th version does and the logs in between
+    # only keep their changes. Rebuilt entity states are kept in an LRU of STATE_CACHE_SIZE.
+    AUDIT_STORAGE_MODE = os.environ.get("AUDIT_STORAGE_MODE", "full")
+    SNAPSHOT_INTERVAL = int(os.environ.get("SNAPSHOT_INTERVAL", 20))
+    STATE_CACHE_SIZE = int(os.environ.get("STATE_CACHE_SIZE", 1000))
+
+    # Group commit for auditlog inserts. Concurrent inserts into the same collection are
+    # buffered and written with a single insert_many once the buffer holds GROUP_COMMIT_MAX_DOCS
+    # documents or GROUP_COMMIT_MAX_DELAY_MS has passed since the first one was buffered.
+    GROUP_COMMIT_ENABLED = os.environ.get("GROUP_COMMIT_ENABLED", "false").lower() == "true"
+    GROUP_COMMIT_MAX_DOCS = int(os.environ.get("GROUP_COMMIT_MAX_DOCS", 100))
+    GROUP_COMMIT_MAX_DELAY_MS = float(os.environ.get("GROUP_COMMIT_MAX_DELAY_MS", 5))
+
+    # Attempts to record a change when concurrent changes to the same entity keep claiming the next version.
+    VERSION_CONFLICT_RETRIES = int(os.environ.get("VERSION_CONFLICT_RETRIES", 5))
+
+    # The list of audited collections is kept in a registry in audit DB, so workers do not need
+    # to go to source DB on boot. Each worker reloads it every REGISTRY_RELOAD_SECONDS (0 disables),
+    # and at most INDEX_CONCURRENCY index builds run at once during a refresh.
+    # NOTE Internal collections of the audit service are prefixed with "_" so they are not
+    # mistaken for audit collections, eg by the changestream supervisor.
+    REGISTRY_COLLECTION = os.environ.get("REGISTRY_COLLECTION", "_registry")
+    REGISTRY_RELOAD_SECONDS = int(os.environ.get("REGISTRY_RELOAD_SECONDS", 60))
+    INDEX_CONCURRENCY = int(os.environ.get("INDEX_CONCURRENCY", 8))
+
+    # Writes and reads use separate client pools. Reads (search, export, entity state) go to the
+    # read preference below, with maxStalenessSeconds (>= 90, -1 for no limit) bounding how far
+    # behind a secondary may be. Pool sizes are per client, route limits cap the concurrent
+    # requests of a read route so one heavy route cannot take the whole read pool.
+    AUDIT_WRITE_POOL_SIZE = int(os.environ.get("AUDIT_WRITE_POOL_SIZE", 100))
+    AUDIT_READ_POOL_SIZE = int(os.environ.get("AUDIT_READ_POOL_SIZE", 100))
+    AUDIT_READ_PREFERENCE = os.environ.get("AUDIT_READ_PREFERENCE", "secondaryPreferred")
+    AUDIT_READ_MAX_STALENESS_SECONDS = int(os.environ.get("AUDIT_READ_MAX_STALENESS_SECONDS", -1))
+    ROUTE_POOL_LIMITS = {
+        "search": int(os.environ.get("SEARCH_POOL_LIMIT", 50)),
+        "export": int(os.environ.get("EXPORT_POOL_LIMIT", 4)),
+        "state": int(os.environ.get("STATE_POOL_LIMIT", 20)),
+        "analytics": int(os.environ.get("ANALYTICS_POOL_LIMIT", 20)),
+        "auditlog": int(os.environ.get("AUDITLOG_POOL_LIMIT", 50)),
+    }
+
+    # Time budgets (maxTimeMS) applied to every query made on behalf of an endpoint, so a
+    # query without selective filters cannot hold a connection indefinitely. The export
+    # budget covers the whole stream. Disconnected clients are checked for at the poll interval.
+    QUERY_BUDGETS_MS = {
+        "create": int(os.environ.get("CREATE_QUERY_BUDGET_MS", 2000)),
+        "search": int(os.environ.get("SEARCH_QUERY_BUDGET_MS", 5000)),
+        "count": int(os.environ.get("COUNT_QUERY_BUDGET_MS", 2000)),
+        "export": int(os.environ.get("EXPORT_QUERY_BUDGET_MS", 30 * 60 * 1000)),
+        "state": int(os.environ.get("STATE_QUERY_BUDGET_MS", 5000)),
+        "analytics": int(os.environ.get("ANALYTICS_QUERY_BUDGET_MS", 5000)),
+        "auditlog": int(os.environ.get("AUDITLOG_QUERY_BUDGET_MS", 2000)),
+        "compaction": int(os.environ.get("COMPACTION_QUERY_BUDGET_MS", 10_000)),
+    }
+    DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", 0.25))
+
+    # Sampling profiler, off until switched on at runtime via POST /metrics/profiler. It keeps the
+    # top stacks of requests among the slowest PROFILER_SLOWEST_PERCENT, for the last PROFILER_HISTORY ones.
+    PROFILER_INTERVAL_MS = float(os.environ.get("PROFILER_INTERVAL_MS", 5))
+    PROFILER_SLOWEST_PERCENT = float(os.environ.get("PROFILER_SLOWEST_PERCENT", 1))
+    PROFILER_HISTORY = int(os.environ.get("PROFILER_HISTORY", 50))
+    PROFILER_TOP_STACKS = int(os.environ.get("PROFILER_TOP_STACKS", 20))
+
+    # Time-bucketed rollups for audit analytics, maintained on every insert.
+    ROLLUP_COLLECTION = os.environ.get("ROLLUP_COLLECTION", "_rollups")
+    ROLLUP_MAX_PENDING_UPDATES = int(os.environ.get("ROLLUP_MAX_PENDING_UPDATES", 1000))
+
+    # Retention and compaction of audit collections. Versioned logs older than RETENTION_DAYS
+    # are deleted, moved to an "_archive_<collection>" collection in "archive" mode or moved to
+    # the Parquet cold tier in "cold" mode, always keeping the latest log of each entity.
+    # Set RETENTION_DAYS to 0 to keep logs forever.
+    RETENTION_DAYS = int(os.environ.get("RETENTION_DAYS", 0))
+    RETENTION_MODE = os.environ.get("RETENTION_MODE", "delete")
+
+    # Consecutive UPDATE logs by the same user within the merge window are merged into one.
+    # Set COMPACTION_MERGE_WINDOW_SECONDS to 0 to disable merging.
+    COMPACTION_MERGE_WINDOW_SECONDS = int(os.environ.get("COMPACTION_MERGE_WINDOW_SECONDS", 0))
+
+    # Event IDs of merged logs are kept as tombstones, so replays of those events are still recognised.
+    # They only need to outlive the change stream resume window, set by the oplog size.
+    COMPACTION_TOMBSTONE_COLLECTION = os.environ.get("COMPACTION_TOMBSTONE_COLLECTION", "_event_tombstones")
+    COMPACTION_TOMBSTONE_TTL_SECONDS = int(os.environ.get("COMPACTION_TOMBSTONE_TTL_SECONDS", 7 * 24 * 60 * 60))
+
+    # Compaction runs over COMPACTION_BATCH_SIZE entities at a time, pausing between batches and
+    # saving its progress so an interrupted pass resumes where it stopped. Only one worker may
+    # compact a collection at a time, under a lease renewed with every batch. The background job
+    # runs every COMPACTION_INTERVAL_SECONDS, set it to 0 to only compact through the command.
+    COMPACTION_CHECKPOINT_COLLECTION = os.environ.get("COMPACTION_CHECKPOINT_COLLECTION", "_compaction_checkpoints")
+    COMPACTION_BATCH_SIZE = int(os.environ.get("COMPACTION_BATCH_SIZE", 100))
+    # At most COMPACTION_MAX_ENTITY_LOGS logs of an entity are compacted per pass, oldest first. The
+    # rest of longer chains is reached by later passes, as older logs are expired or merged away.
+    COMPACTION_MAX_ENTITY_LOGS = int(os.environ.get("COMPACTION_MAX_ENTITY_LOGS", 1000))
+    COMPACTION_BATCH_DELAY_MS = float(os.environ.get("COMPACTION_BATCH_DELAY_MS", 500))
+    COMPACTION_LEASE_SECONDS = int(os.environ.get("COMPACTION_LEASE_SECONDS", 300))
+    COMPACTION_INTERVAL_SECONDS = int(os.environ.get("COMPACTION_INTERVAL_SECONDS", 0))
+
+    # Cold tier for logs expired in "cold" retention mode, as zstd compressed Parquet files
+    # partitioned by collection and date under ARCHIVE_PATH (a local or mounted path).
+    # Searches and exports reaching back past the archive watermark are served from both tiers.
+    ARCHIVE_PATH = os.environ.get("ARCHIVE_PATH", "archive")
+    ARCHIVE_COMPRESSION_LEVEL = int(os.environ.get("ARCHIVE_COMPRESSION_LEVEL", 3))
+    ARCHIVE_ROW_GROUP_SIZE = int(os.environ.get("ARCHIVE_ROW_GROUP_SIZE", 10_000))
+    # Pages of searches served from both tiers are cut from the merged results, so both tiers are read
+    # up to the end of the page. Deeper pages are refused, exports are meant for those.
+    ARCHIVE_MAX_SEARCH_OFFSET = int(os.environ.get("ARCHIVE_MAX_SEARCH_OFFSET", 10_000))
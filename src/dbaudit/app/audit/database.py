@@ -1,4 +1,7 @@
+import asyncio
+import logging
 import os
+from typing import FrozenSet, Optional
 
 import pymongo
 from motor.motor_asyncio import (
@@ -8,19 +11,58 @@ from motor.motor_asyncio import (
 )
 
 from app.audit.config import AppConfig
+from app.audit.monitoring import PoolMetricsListener
+from app.audit.utils import get_current_datetime
 
 
-# Global var with audit DB client used for API operations.
+# Global vars with audit DB clients used for API operations, one for writes and one for reads.
 _audit_db_client: AsyncIOMotorClient = None
-
-# Fields to index for each audit collection.
-_index_list = ["entity_id", "executed_at", "executed_by"]
-
-# List of collections found in source DB.
-_collections_list = []
-
-
-# Method to reuse Audit DB client as a singleton.
+_audit_db_read_client: AsyncIOMotorClient = None
+
+# Concurrency limits for the read routes.
+_route_limits = {route: asyncio.Semaphore(limit) for route, limit in AppConfig.ROUTE_POOL_LIMITS.items()}
+
+# Indexes for each audit collection.
+_index_list = [
+    pymongo.IndexModel([("entity_id", pymongo.ASCENDING)]),
+    pymongo.IndexModel([("executed_at", pymongo.ASCENDING)]),
+    pymongo.IndexModel([("executed_by", pymongo.ASCENDING)]),
+    # Version chain of an entity, used to find the latest log and rebuild delta states.
+    pymongo.IndexModel([
+        ("entity_id", pymongo.ASCENDING),
+        ("version", pymongo.ASCENDING),
+        ("executed_at", pymongo.ASCENDING),
+    ]),
+    # Each version of an entity can only be written once, which makes concurrent writes conditional.
+    # Logs written before versioning was introduced are left out.
+    pymongo.IndexModel(
+        [("entity_id", pymongo.ASCENDING), ("version", pymongo.ASCENDING)],
+        name="entity_id_version_unique",
+        unique=True,
+        partialFilterExpression={"version": {"$exists": True}},
+    ),
+    # Multikey index on the changed field paths, for "who changed field F (and when)" queries.
+    pymongo.IndexModel([("changed_fields", pymongo.ASCENDING), ("executed_at", pymongo.DESCENDING)]),
+    # Idempotency key of the change event behind each log, if the producer sent one.
+    pymongo.IndexModel(
+        [("event_id", pymongo.ASCENDING)],
+        name="event_id_unique",
+        unique=True,
+        partialFilterExpression={"event_id": {"$type": "string"}},
+    ),
+]
+
+# Collections found in source DB, swapped as a whole whenever the registry changes.
+_collections_list: FrozenSet[str] = frozenset()
+
+# Background tasks for refreshing the registry from source DB and reloading it from audit DB.
+_refresh_task: Optional[asyncio.Task] = None
+_reload_task: Optional[asyncio.Task] = None
+
+logger = logging.getLogger(__name__)
+
+
+# Method to reuse Audit DB client as a singleton. This client reads from and writes to the primary.
 def get_audit_db_client():
     global _audit_db_client
     
@@ -31,39 +73,180 @@ def get_audit_db_client():
                 AppConfig.DB_DEV,
             ),
             tz_aware=True,
+            maxPoolSize=AppConfig.AUDIT_WRITE_POOL_SIZE,
+            event_listeners=[PoolMetricsListener("write")],
         )
 
     return _audit_db_client
 
 
-# Method to close Audit DB client.
+# Method to reuse the read-only Audit DB client as a singleton, used for search and export
+# so that heavy reads can be served by secondaries rather than compete with inserts.
+def get_audit_db_read_client():
+    global _audit_db_read_client
+
+    if _audit_db_read_client is None:
+        options = {}
+        if AppConfig.AUDIT_READ_PREFERENCE != "primary":
+            options["maxStalenessSeconds"] = AppConfig.AUDIT_READ_MAX_STALENESS_SECONDS
+
+        _audit_db_read_client = AsyncIOMotorClient(
+            os.environ.get(
+                AppConfig.AUDIT_DB_CONNECTION_STRING,
+                AppConfig.DB_DEV,
+            ),
+            tz_aware=True,
+            maxPoolSize=AppConfig.AUDIT_READ_POOL_SIZE,
+            readPreference=AppConfig.AUDIT_READ_PREFERENCE,
+            event_listeners=[PoolMetricsListener("read")],
+            **options,
+        )
+
+    return _audit_db_read_client
+
+
+# Method to close Audit DB clients.
 async def close_audit_db_client():
-    global _audit_db_client
-    await _audit_db_client.close()
-    _audit_db_client = None
+    global _audit_db_client, _audit_db_read_client
+
+    if _audit_db_client is not None:
+        _audit_db_client.close()
+        _audit_db_client = None
+
+    if _audit_db_read_client is not None:
+        _audit_db_read_client.close()
+        _audit_db_read_client = None
+
+
+# Method to build a dependency that caps the concurrent requests of a read route.
+# The slot is held until the response is fully sent, which matters for streamed exports.
+def route_limit(route: str):
+    async def acquire():
+        async with _route_limits[route]:
+            yield
+
+    return acquire
 
 
-# Method to create a collection in audit DB with required indexes.
+# Method to create the required indexes of an audit collection, skipping those already present.
 async def create_collection(collection: AsyncIOMotorCollection):
-    await collection.create_indexes([
-        pymongo.IndexModel([(index, pymongo.ASCENDING)]) for index in _index_list
-    ])
+    existing = await collection.index_information()
+    missing = [index for index in _index_list if index.document["name"] not in existing]
 
+    if missing:
+        await collection.create_indexes(missing)
 
-# Method to set up audit DB at router startup.
-async def setup_collections():
+
+# Names of the indexes every audit collection should have, saved with the registry so that
+# index changes in a new release are rolled out to existing collections.
+def _index_names():
+    return sorted(index.document["name"] for index in _index_list)
+
+
+# Method to load the collection registry kept in audit DB, returns False if there is none yet.
+async def load_registry() -> bool:
+    global _collections_list
+
+    audit_db: AsyncIOMotorDatabase = get_audit_db_client()[AppConfig.AUDIT_DB_NAME]
+    registry = await audit_db[AppConfig.REGISTRY_COLLECTION].find_one({"_id": AppConfig.API_DB_NAME})
+    if registry is None:
+        return False
+
+    _collections_list = frozenset(registry["collections"])
+
+    if registry.get("indexes") != _index_names():
+        refresh_collections()
+
+    return True
+
+
+# Method to discover the collections of source DB, index them in audit DB and save the registry.
+async def discover_collections():
     global _collections_list
 
     source_db_client = AsyncIOMotorClient(AppConfig.API_DB_CONNECTION_STRING)
-    source_db: AsyncIOMotorDatabase = source_db_client[AppConfig.API_DB_NAME]
-    _collections_list = await source_db.list_collection_names()
-    source_db_client.close()
+    try:
+        source_db: AsyncIOMotorDatabase = source_db_client[AppConfig.API_DB_NAME]
+        collections = await source_db.list_collection_names()
+    finally:
+        source_db_client.close()
 
+    # Indexes are set up concurrently, with a cap on how many builds run at once.
     audit_db: AsyncIOMotorDatabase = get_audit_db_client()[AppConfig.AUDIT_DB_NAME]
-    for collection in _collections_list:
-        await create_collection(audit_db[collection])
+    semaphore = asyncio.Semaphore(AppConfig.INDEX_CONCURRENCY)
+
+    async def setup(collection: str):
+        async with semaphore:
+            await create_collection(audit_db[collection])
+
+    await asyncio.gather(*(setup(collection) for collection in collections))
+
+    await audit_db[AppConfig.REGISTRY_COLLECTION].update_one(
+        {"_id": AppConfig.API_DB_NAME},
+        {"$set": {
+            "collections": sorted(collections),
+            "indexes": _index_names(),
+            "updated_at": get_current_datetime(),
+        }},
+        upsert=True,
+    )
+
+    # Requests only ever see the old or the new set, never a partially built one.
+    _collections_list = frozenset(collections)
+    logger.info(f"Collection registry refreshed with {len(collections)} collections.")
+
+
+# Method to periodically reload the registry, so refreshes made by other workers are picked up.
+async def reload_registry():
+    while True:
+        await asyncio.sleep(AppConfig.REGISTRY_RELOAD_SECONDS)
+        try:
+            await load_registry()
+        except Exception:
+            logger.exception("Failed to reload the collection registry.")
+
+
+# Method to set up audit DB at router startup. Only the first boot against an empty
+# registry needs to go to source DB, every other boot just loads the registry.
+async def setup_collections():
+    global _reload_task
+
+    if not await load_registry():
+        await discover_collections()
+
+    if AppConfig.REGISTRY_RELOAD_SECONDS > 0:
+        _reload_task = asyncio.create_task(reload_registry())
+
+
+# Method to refresh the registry in the background, returns False if a refresh is already running.
+def refresh_collections() -> bool:
+    global _refresh_task
+
+    if _refresh_task is not None and not _refresh_task.done():
+        return False
+
+    _refresh_task = asyncio.create_task(discover_collections())
+    _refresh_task.add_done_callback(_log_refresh_failure)
+    return True
+
+
+def _log_refresh_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error("Failed to refresh the collection registry.", exc_info=task.exception())
+
+
+# Method to stop the background registry tasks at shutdown.
+async def stop_registry_tasks():
+    for task in (_refresh_task, _reload_task):
+        if task is not None and not task.done():
+            task.cancel()
+
+
+# Method to get the collections currently in the registry.
+def get_collections() -> FrozenSet[str]:
+    return _collections_list
 
 
 # Method to check if a collection type is supported by audit app.
 def validate_collection(collection: str):
-    return True if collection in _collections_list else False
+    return collection in _collections_list
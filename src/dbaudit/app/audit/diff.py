@@ -0,0 +1,313 @@
+import json
+from datetime import datetime, timezone
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+from bson.objectid import ObjectId
+
+from app.audit.config import AppConfig
+
+
+# Types that can be compared directly without any recursion.
+_SCALAR_TYPES = frozenset([str, int, float, bool, type(None)])
+
+
+# Result of a diff, the changes plus the dotted paths of every changed field. List indexes
+# are left out of the paths, eg -> a change to 'items.3.price' is recorded as 'items.price'.
+class DocumentDiff(NamedTuple):
+    changes: Dict
+    changed_fields: List[str]
+
+
+# State of a single diff. Tracks the changed field paths and how many nodes may still be
+# visited before falling back to whole-subtree changes.
+class _DiffState:
+    __slots__ = ("remaining", "changed_fields")
+
+    def __init__(self, size: int):
+        self.remaining = size
+        self.changed_fields: Set[str] = set()
+
+    def spend(self, cost: int) -> bool:
+        self.remaining -= cost
+        return self.remaining >= 0
+
+
+# Changes are built as plain dicts matching the encoded FieldChange and ListChange schemas.
+def _field_change(new_value, old_value) -> Dict:
+    return {"new_value": new_value, "old_value": old_value}
+
+
+def _list_change(index, item) -> Dict:
+    return {"index": index, "item": item}
+
+
+def _join(path: str, key) -> str:
+    return f"{path}.{key}" if path else str(key)
+
+
+# Changes to fields share their dict with the inserts and deletes of that dict, and a patch of a
+# dict must not read as a field change. Fields named like any of these are escaped with a leading
+# '~', as are fields that already start with one.
+_ESCAPE = "~"
+_RESERVED_KEYS = frozenset(["inserts", "deletes", "new_value", "old_value"])
+
+
+def _escape(key) -> str:
+    key = str(key)
+    return _ESCAPE + key if key in _RESERVED_KEYS or key.startswith(_ESCAPE) else key
+
+
+def _unescape(key: str) -> str:
+    return key[len(_ESCAPE):] if key.startswith(_ESCAPE) else key
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+# Binary bodies keep ObjectId and datetime types, JSON bodies carry them as strings. Both forms of
+# the same value are normalized alike, so entities are not reported as changed when producers switch.
+def _normalize(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return _as_utc(value).replace(tzinfo=None).isoformat()
+    return value
+
+
+# Python equality treats 1, 1.0 and True alike, which would hide changes of type. Values that are
+# equal are only the same if their scalars also share their types, containers aside.
+def _same_types(new_value, old_value) -> bool:
+    if isinstance(new_value, dict):
+        return isinstance(old_value, dict) and all(_same_types(value, old_value[key]) for key, value in new_value.items())
+    if isinstance(new_value, list):
+        return isinstance(old_value, list) and all(map(_same_types, new_value, old_value))
+    return type(new_value) is type(old_value)
+
+
+def _equal(new_value, old_value) -> bool:
+    return new_value == old_value and _same_types(new_value, old_value)
+
+
+def _equivalent(new_value, old_value) -> bool:
+    if isinstance(new_value, str):
+        new_value, old_value = old_value, new_value
+
+    if isinstance(old_value, str):
+        if isinstance(new_value, ObjectId):
+            return str(new_value) == old_value
+
+        if isinstance(new_value, datetime):
+            try:
+                return _as_utc(new_value) == _as_utc(datetime.fromisoformat(old_value))
+            except ValueError:
+                return False
+
+    return False
+
+
+# Hashable key for an array item, used to align arrays. Containers are keyed by their canonical JSON,
+# which tells 1, 1.0 and true apart, scalars by their normalized value and its type.
+def _fingerprint(value):
+    if isinstance(value, (dict, list)):
+        return (1, json.dumps(value, sort_keys=True, default=lambda o: str(_normalize(o))))
+    value = _normalize(value)
+    return (0, type(value), value)
+
+
+# Method to compare any two values at a path, returns None if they are equal.
+def _diff_value(new_value, old_value, path: str, state: _DiffState) -> Optional[Any]:
+    if new_value is old_value:
+        return None
+
+    if isinstance(new_value, dict) and isinstance(old_value, dict):
+        if state.spend(len(new_value) + len(old_value)):
+            return _diff_dicts(new_value, old_value, path, state) or None
+
+    elif isinstance(new_value, list) and isinstance(old_value, list):
+        if state.spend(len(new_value) + len(old_value)):
+            return _diff_lists(new_value, old_value, path, state) or None
+
+    # Scalars, type changes and subtrees beyond the budget are compared as a whole.
+    if _equal(new_value, old_value) or _equivalent(new_value, old_value):
+        return None
+
+    state.changed_fields.add(path)
+    return _field_change(new_value, old_value)
+
+
+# Method to compare two dicts key by key.
+# Eg -> {'price': {'new_value': 299.99, 'old_value': 349.99}, 'inserts': [{'index': 'discount', 'item': 0.1}]}
+def _diff_dicts(new: Dict, old: Dict, path: str, state: _DiffState) -> Dict:
+    changes: Dict[str, Any] = {}
+    inserts: List[Dict] = []
+
+    for key, new_value in new.items():
+        if key not in old:
+            inserts.append(_list_change(key, new_value))
+            state.changed_fields.add(_join(path, key))
+            continue
+
+        old_value = old[key]
+        if new_value is old_value:
+            continue
+
+        # Fast path for flat scalar fields, which make up most of a typical document.
+        new_type, old_type = type(new_value), type(old_value)
+        if new_type in _SCALAR_TYPES and old_type in _SCALAR_TYPES:
+            if new_value != old_value or new_type is not old_type:
+                changes[_escape(key)] = _field_change(new_value, old_value)
+                state.changed_fields.add(_join(path, key))
+            continue
+
+        change = _diff_value(new_value, old_value, _join(path, key), state)
+        if change is not None:
+            changes[_escape(key)] = change
+
+    deletes = []
+    for key, value in old.items():
+        if key not in new:
+            deletes.append(_list_change(key, value))
+            state.changed_fields.add(_join(path, key))
+
+    if inserts:
+        changes["inserts"] = inserts
+    if deletes:
+        changes["deletes"] = deletes
+
+    return changes
+
+
+# Method to compare two lists. Changed items are keyed by their index in the new list, inserts
+# are indexed by their position in the new list and deletes by their position in the old list.
+# Eg -> 'tags': {'1': {'new_value': 'sale', 'old_value': 'new'}, 'deletes': [{'index': 2, 'item': 'discount'}]}
+def _diff_lists(new: List, old: List, path: str, state: _DiffState) -> Dict:
+    changes: Dict[str, Any] = {}
+    inserts: List[Dict] = []
+    deletes: List[Dict] = []
+
+    # Common prefix and suffix are skipped using the builtin (C level) equality check, which
+    # covers unchanged subtrees without diffing them, only their scalar types are checked.
+    start, new_end, old_end = 0, len(new), len(old)
+    while start < new_end and start < old_end and _equal(new[start], old[start]):
+        start += 1
+    while new_end > start and old_end > start and _equal(new[new_end - 1], old[old_end - 1]):
+        new_end -= 1
+        old_end -= 1
+
+    # Items share the path of their list.
+    def pair(new_index: int, old_index: int):
+        change = _diff_value(new[new_index], old[old_index], path, state)
+        if change is not None:
+            changes[str(new_index)] = change
+
+    new_size, old_size = new_end - start, old_end - start
+
+    # Align the remaining items by their fingerprints if the cost is within budget.
+    if new_size and old_size and new_size * old_size <= AppConfig.DIFF_LIST_MATCH_BUDGET:
+        matcher = SequenceMatcher(
+            None,
+            [_fingerprint(item) for item in old[start:old_end]],
+            [_fingerprint(item) for item in new[start:new_end]],
+            autojunk=False,
+        )
+        opcodes = matcher.get_opcodes()
+
+    # Otherwise fall back to comparing the items by position.
+    else:
+        opcodes = [("replace", 0, old_size, 0, new_size)]
+
+    for tag, old_from, old_to, new_from, new_to in opcodes:
+        if tag == "equal":
+            continue
+
+        # Replaced ranges are paired up by position, any excess becomes inserts or deletes.
+        common = min(old_to - old_from, new_to - new_from)
+        for offset in range(common):
+            pair(start + new_from + offset, start + old_from + offset)
+
+        for index in range(start + old_from + common, start + old_to):
+            deletes.append(_list_change(index, old[index]))
+        for index in range(start + new_from + common, start + new_to):
+            inserts.append(_list_change(index, new[index]))
+
+    if inserts:
+        changes["inserts"] = inserts
+    if deletes:
+        changes["deletes"] = deletes
+    if inserts or deletes:
+        state.changed_fields.add(path)
+
+    return changes
+
+
+# Method to identify the changes between two versions of a document.
+def diff_documents(new: Dict, old: Dict, size_budget: Optional[int] = None) -> DocumentDiff:
+    state = _DiffState(AppConfig.DIFF_SIZE_BUDGET if size_budget is None else size_budget)
+    changes = _diff_dicts(new, old, "", state)
+    return DocumentDiff(changes, sorted(state.changed_fields))
+
+
+# A field change is the leaf of a changes structure, anything else is a nested dict or list patch.
+def _is_field_change(change) -> bool:
+    return isinstance(change, dict) and len(change) == 2 and "new_value" in change and "old_value" in change
+
+
+# Inserts and deletes are always lists, which also distinguishes them from changes to fields with the
+# same name in logs written before such fields were escaped.
+def _is_list_op(key: str, change) -> bool:
+    return key in ("inserts", "deletes") and isinstance(change, list)
+
+
+def _apply_value(old_value, change):
+    if _is_field_change(change):
+        return change["new_value"]
+    return apply_changes(old_value, change)
+
+
+def _apply_dict(old: Dict, changes: Dict) -> Dict:
+    new = dict(old)
+
+    for key, change in changes.items():
+        if key == "deletes" and _is_list_op(key, change):
+            for item in change:
+                new.pop(item["index"], None)
+
+        elif key == "inserts" and _is_list_op(key, change):
+            for item in change:
+                new[item["index"]] = item["item"]
+
+        else:
+            field = _unescape(key)
+            new[field] = _apply_value(old.get(field), change)
+
+    return new
+
+
+def _apply_list(old: List, changes: Dict) -> List:
+    deletes = changes.get("deletes") if _is_list_op("deletes", changes.get("deletes")) else []
+    inserts = changes.get("inserts") if _is_list_op("inserts", changes.get("inserts")) else []
+
+    # The diff aligns the lists in order, so the surviving old items fill every slot of the
+    # new list that is not an insert.
+    deleted = {item["index"] for item in deletes}
+    inserted = {item["index"]: item["item"] for item in inserts}
+    kept = iter([value for index, value in enumerate(old) if index not in deleted])
+    new = [inserted[index] if index in inserted else next(kept) for index in range(len(old) - len(deleted) + len(inserted))]
+
+    # Changed items are keyed by their index in the new list.
+    for key, change in changes.items():
+        if not _is_list_op(key, change):
+            index = int(key)
+            new[index] = _apply_value(new[index], change)
+
+    return new
+
+
+# Method to apply the changes identified by diff_documents to the old version of a document,
+# returning the new version. Unchanged subtrees are shared with the old version, not copied.
+def apply_changes(old, changes: Dict):
+    if isinstance(old, list):
+        return _apply_list(old, changes)
+    return _apply_dict(old or {}, changes)
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from app.audit import metrics
+from app.audit.config import AppConfig
+
+
+logger = logging.getLogger(__name__)
+
+
+# Exception raised when too many diffs are already queued, the caller should retry later.
+class ExecutorSaturatedException(Exception):
+    pass
+
+
+# Runs a function in a pool worker, reporting how long the task waited in the queue.
+# Wall clock time is used as the task may start in a different process.
+def _timed_call(submitted_at: float, fn: Callable, *args):
+    return time.time() - submitted_at, fn(*args)
+
+
+# Runs CPU bound work such as diffing off the event loop, picking a pool based on input size.
+# Threads share the GIL with the event loop, so the thread pool bounds how long a diff blocks
+# the loop but runs diffs one at a time. Large documents go to the process pool to run in parallel.
+class DiffExecutor:
+    def __init__(self):
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+
+        metrics.gauge("diff_pending", lambda: self._pending)
+
+    def start(self):
+        self._thread_pool = ThreadPoolExecutor(
+            max_workers=AppConfig.DIFF_THREAD_WORKERS,
+            thread_name_prefix="diff",
+        )
+
+        # Forking an event loop process with live DB client threads is unsafe, so process
+        # pool workers are started from a clean forkserver instead.
+        if AppConfig.DIFF_PROCESS_WORKERS > 0:
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=AppConfig.DIFF_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        else:
+            logger.warning("Diff process pool disabled, large diffs will run one at a time under the GIL.")
+
+    def shutdown(self):
+        if self._thread_pool:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
+
+        if self._process_pool:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+    def _select_pool(self, size: int) -> Executor:
+        if self._process_pool and size >= AppConfig.DIFF_PROCESS_THRESHOLD:
+            return self._process_pool
+        return self._thread_pool
+
+    def _release(self, _):
+        self._pending -= 1
+
+    async def run(self, size: int, fn: Callable, *args):
+        # Small inputs are cheaper to handle inline than to hand off to a pool.
+        if size < AppConfig.DIFF_INLINE_THRESHOLD or not self._thread_pool:
+            return fn(*args)
+
+        if self._pending >= AppConfig.DIFF_MAX_PENDING:
+            metrics.counter("diff_rejected").inc()
+            raise ExecutorSaturatedException
+
+        # The slot is only freed when the pool finishes the task, even if the caller times out,
+        # so the queue depth reflects the actual backlog of the pools.
+        self._pending += 1
+        future = asyncio.get_running_loop().run_in_executor(
+            self._select_pool(size), _timed_call, time.time(), fn, *args
+        )
+        future.add_done_callback(self._release)
+
+        start = time.perf_counter()
+        try:
+            queue_wait, result = await asyncio.wait_for(
+                asyncio.shield(future),
+                timeout=AppConfig.DIFF_TIMEOUT_SECONDS,
+            )
+
+        except asyncio.TimeoutError:
+            metrics.counter("diff_timeouts").inc()
+            raise
+
+        metrics.histogram("diff_queue_wait_ms").observe(queue_wait * 1000)
+        metrics.histogram("diff_total_ms").observe((time.perf_counter() - start) * 1000)
+        return result
+
+
+# Global executor shared by requests in this worker.
+_diff_executor: Optional[DiffExecutor] = None
+
+
+# Method to reuse the diff executor as a singleton.
+def get_diff_executor() -> DiffExecutor:
+    global _diff_executor
+
+    if _diff_executor is None:
+        _diff_executor = DiffExecutor()
+
+    return _diff_executor
@@ -19,11 +19,19 @@ class Auditlog(BaseModel):
     operation_type: OperationType = Field(...)
     executed_at: datetime = Field(...)
     executed_by: PyObjectId = Field(...)
-    document: Dict = Field(...)
+    version: Optional[int] = None
+    event_id: Optional[str] = None
+    document: Optional[Dict] = None
     changes: Optional[Dict] = Field(default_factory=dict)
+    changed_fields: List[str] = Field(default_factory=list)
     warnings: Optional[List] = Field(default_factory=list)
     created_at: datetime = Field(...)
 
+    # Builds a model from a document read from the audit DB without validating it again.
+    @classmethod
+    def from_db(cls, document: Dict) -> "Auditlog":
+        return cls.construct(**document)
+
     class Config:
         allow_population_by_field_name = True
         arbitrary_types_allowed = True
@@ -36,6 +44,7 @@ class Auditlog(BaseModel):
                 "operation_type": OperationType.UPDATE,
                 "executed_at": "2024-08-08T10:00:40.250000",
                 "executed_by": "66c20e5e5fca873b5e31a51d",
+                "version": 2,
                 "document": {
                     "_id": "66c20e3c694961369471f149",
                     "name": "Alienware m18 R2 Gaming Laptop",
@@ -50,6 +59,7 @@ class Auditlog(BaseModel):
                         "2023-08-08T10:00:40.250000",
                     ],
                 },
+                "changed_fields": ["last_updated_at", "price"],
                 "warnings": [],
                 "created_at": "2024-08-08T10:01:40.250000",
             }
@@ -61,6 +71,10 @@ class AuditlogCreateRequest(BaseModel):
     collection: str = Field(...)
     document: Dict = Field(...)
 
+    # ID of the change event that produced the request, used as an idempotency key so that
+    # redelivered events return the original auditlog instead of creating a duplicate.
+    event_id: Optional[str] = None
+
     @root_validator
     def validate_document(cls, v):
         collection = v.get("collection")
@@ -102,9 +116,8 @@ class AuditlogCreateRequest(BaseModel):
         }
 
 
-# Request schema to for an audit search.
-class AuditlogSearchRequest(BaseModel):
-    # Query parameters.
+# Filters shared by the audit search and export requests.
+class AuditlogFilter(BaseModel):
     collection: str = Field(...)
     entity_id: Optional[str]
     user_id: Optional[str]
@@ -112,11 +125,12 @@ class AuditlogSearchRequest(BaseModel):
     start_date: Optional[datetime]
     end_date: Optional[datetime]
 
-    # Query options.
-    offset: int = 0
-    sort_by: Literal["executed_at"] = "executed_at"
-    order: Literal["asc", "desc"] = "desc"
-    limit: int = Query(default=100, le=1000, ge=0)
+    # Dotted path of a field, eg -> price or items.price
+    changed_field: Optional[str]
+
+    # Logs archived to the cold tier are only searched if asked for, or if start_date is before
+    # the archive watermark.
+    include_archive: bool = False
 
     def get_criteria(self):
         criteria: Dict[str, Any] = {}
@@ -132,21 +146,96 @@ class AuditlogSearchRequest(BaseModel):
         # Filter by operation type.
         if self.operation_type:
             criteria["operation_type"] = self.operation_type.value
+
+        # Filter by a field that was changed, served by the multikey changed_fields index.
+        if self.changed_field:
+            criteria["changed_fields"] = self.changed_field
         
-        # Filter by date range.
+        # Filter by date range, both bounds can be combined.
+        if self.start_date or self.end_date:
+            criteria["executed_at"] = {}
+
         if self.start_date:
-            criteria["executed_at"] = {"$gte": self.start_date}
+            criteria["executed_at"]["$gte"] = self.start_date
 
         if self.end_date:
-            criteria["executed_at"] = {"$lte": self.end_date}
+            criteria["executed_at"]["$lte"] = self.end_date
 
         return criteria
 
 
+# Request schema to for an audit search.
+class AuditlogSearchRequest(AuditlogFilter):
+    # Query options.
+    offset: int = 0
+    sort_by: Literal["executed_at"] = "executed_at"
+    order: Literal["asc", "desc"] = "desc"
+    limit: int = Query(default=100, le=1000, ge=0)
+
+    # Optional sparse fieldset, eg -> fields=entity_id,executed_at,changes
+    fields: Optional[str] = None
+
+    def get_projection(self):
+        if not self.fields:
+            return None
+        return {field.strip(): 1 for field in self.fields.split(",") if field.strip()}
+
+
+# Request schema for a streaming export of the audit trail.
+class AuditlogExportRequest(AuditlogFilter):
+    # Export options.
+    sort_by: Literal["executed_at"] = "executed_at"
+    order: Literal["asc", "desc"] = "asc"
+    include_document: bool = True
+    compress: bool = False
+
+    # The entity snapshot is by far the largest field of a log, so compliance exports
+    # that only need the change history can leave it out at the DB level.
+    def get_projection(self):
+        return None if self.include_document else {"document": 0}
+
+
+# Request schema for audit analytics, served from the rollups.
+class RollupRequest(BaseModel):
+    collection: str = Field(...)
+    start_date: Optional[datetime]
+    end_date: Optional[datetime]
+    limit: int = Query(default=10, le=1000, ge=1)
+
+    def get_criteria(self):
+        criteria: Dict[str, Any] = {}
+
+        if self.start_date or self.end_date:
+            criteria["bucket"] = {}
+
+        if self.start_date:
+            criteria["bucket"]["$gte"] = self.start_date
+
+        if self.end_date:
+            criteria["bucket"]["$lte"] = self.end_date
+
+        return criteria
+
+
+# Response model for the state of an entity at a point in time.
+class AuditlogState(BaseModel):
+    collection: str = Field(...)
+    entity_id: PyObjectId = Field(...)
+    version: Optional[int] = None
+    executed_at: datetime = Field(...)
+    document: Dict = Field(...)
+
+    class Config:
+        arbitrary_types_allowed = True
+        json_encoders = {ObjectId: str}
+
+
 # Response model for audit trail search queries.
 class AuditlogSearchResult(BaseModel):
     logs: List[Auditlog] = Field(...)
-    total_count: int = Field(...)
+    # Left out if counting the matches ran out of its time budget, the logs are still returned.
+    total_count: Optional[int] = None
+    budget_exhausted: bool = False
 
     class Config:
         json_encoders = {ObjectId: str}
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from pymongo import monitoring
+
+from app.audit import metrics
+
+
+# Records connection pool metrics for one DB client, prefixed with the pool name.
+# Pool events are published from the driver's threads, so the checkout start time is
+# tracked per thread, where each checkout starts and completes, and metrics are only
+# updated under a lock as the event loop thread is not the only one writing them.
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    def __init__(self, name: str):
+        self.name = name
+        self.checked_out = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        metrics.gauge(f"pool_{name}_checked_out", lambda: self.checked_out)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._inc("cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._inc("connections_created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc("connections_closed")
+
+    def connection_check_out_started(self, event):
+        self._local.started_at = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._inc("check_out_failed")
+
+    def connection_checked_out(self, event):
+        started_at = getattr(self._local, "started_at", None)
+        with self._lock:
+            self.checked_out += 1
+            if started_at is not None:
+                wait_ms = (time.perf_counter() - started_at) * 1000
+                metrics.histogram(f"pool_{self.name}_check_out_wait_ms").observe(wait_ms)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def _inc(self, name: str):
+        with self._lock:
+            metrics.counter(f"pool_{self.name}_{name}").inc()
@@ -0,0 +1,181 @@
+import bisect
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from starlette.datastructures import MutableHeaders
+
+from app.audit import metrics
+from app.audit.config import AppConfig
+
+
+# Timings of the stages of a single request, in milliseconds.
+class StageTimer:
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, duration_ms: float):
+        self.stages[name] = self.stages.get(name, 0.0) + duration_ms
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def header(self) -> str:
+        timings = [f"{name};dur={duration:.2f}" for name, duration in self.stages.items()]
+        timings.append(f"total;dur={self.elapsed_ms():.2f}")
+        return ", ".join(timings)
+
+
+_current_timer: ContextVar[Optional[StageTimer]] = ContextVar("stage_timer", default=None)
+
+
+# Context manager to time a stage of the current request. Repeated stages are added up.
+@contextmanager
+def stage(name: str):
+    timer = _current_timer.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(name, (time.perf_counter() - start) * 1000)
+
+
+# Method to record the time from the start of the request until now as a stage. Called at the
+# top of a route, this covers body parsing, validation and dependencies.
+def stage_since_start(name: str):
+    if (timer := _current_timer.get()) is not None:
+        timer.add(name, timer.elapsed_ms())
+
+
+# Sampling profiler that can be switched on at runtime. A background thread samples the stack of
+# the event loop thread at a fixed interval, and the samples taken while a request was running are
+# kept if the request turns out to be among the slowest X% seen recently.
+# NOTE Requests run concurrently on the same thread, so a profile can include samples of others.
+class SamplingProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.slowest_percent = AppConfig.PROFILER_SLOWEST_PERCENT
+        self.interval_ms = AppConfig.PROFILER_INTERVAL_MS
+        self.profiles = deque(maxlen=AppConfig.PROFILER_HISTORY)
+
+        self._durations = deque(maxlen=1000)
+        self._active: Dict[int, Counter] = {}
+        self._target_thread: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop: Optional[threading.Event] = None
+        self._lock = threading.Lock()
+
+    # Method to switch the profiler on or off. Every sampling thread gets its own stop event and
+    # only this method replaces it, so switching quickly can neither leave the profiler enabled
+    # without a thread nor running two.
+    def configure(self, enabled: bool, slowest_percent: float = None, interval_ms: float = None):
+        with self._lock:
+            if slowest_percent is not None:
+                self.slowest_percent = slowest_percent
+            if interval_ms is not None:
+                self.interval_ms = interval_ms
+            self.enabled = enabled
+
+            if not enabled and self._thread is not None:
+                self._stop.set()
+                self._thread, self._stop = None, None
+
+            elif enabled and self._thread is None:
+                self._target_thread = threading.get_ident()
+                self._stop = threading.Event()
+                self._thread = threading.Thread(target=self._run, args=(self._stop,), name="profiler", daemon=True)
+                self._thread.start()
+
+    def begin(self) -> Optional[Counter]:
+        if not self.enabled:
+            return None
+        samples = Counter()
+        self._active[id(samples)] = samples
+        return samples
+
+    def end(self, samples: Counter, path: str, duration_ms: float):
+        self._active.pop(id(samples), None)
+
+        durations = sorted(self._durations)
+        self._durations.append(duration_ms)
+        if not durations or not samples:
+            return
+
+        # Keep the profile if the request is slower than (100 - X)% of the recent ones.
+        rank = bisect.bisect_left(durations, duration_ms) / len(durations)
+        if rank >= 1 - self.slowest_percent / 100:
+            self.profiles.append({
+                "path": path,
+                "duration_ms": round(duration_ms, 2),
+                "samples": sum(samples.values()),
+                "stacks": dict(samples.most_common(AppConfig.PROFILER_TOP_STACKS)),
+            })
+
+    def _run(self, stop: threading.Event):
+        while not stop.wait(self.interval_ms / 1000):
+            frame = sys._current_frames().get(self._target_thread)
+            if frame is None or not self._active:
+                continue
+
+            # Stacks are collapsed root first, eg -> main.py:run;router.py:create_auditlog;diff.py:_diff_dicts
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_filename.rsplit('/', 1)[-1]}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            collapsed = ";".join(reversed(stack))
+
+            for samples in list(self._active.values()):
+                samples[collapsed] += 1
+
+
+_profiler = SamplingProfiler()
+
+
+# Method to get the sampling profiler of this worker.
+def get_profiler() -> SamplingProfiler:
+    return _profiler
+
+
+# ASGI middleware that times every request and its stages. Stage timings recorded up to the
+# start of the response are returned in a Server-Timing header, and all of them are aggregated
+# into histograms. Implemented as plain ASGI so streamed responses are not buffered.
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timer = StageTimer()
+        token = _current_timer.set(timer)
+        samples = _profiler.begin()
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("Server-Timing", timer.header())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+
+        finally:
+            _current_timer.reset(token)
+            duration_ms = timer.elapsed_ms()
+
+            # The endpoint is set on the scope by the router once the request is matched.
+            endpoint = scope.get("endpoint")
+            name = endpoint.__name__ if endpoint else "unmatched"
+
+            metrics.histogram(f"request_{name}_ms").observe(duration_ms)
+            for stage_name, stage_ms in timer.stages.items():
+                metrics.histogram(f"stage_{name}_{stage_name}_ms").observe(stage_ms)
+
+            if samples is not None:
+                _profiler.end(samples, scope["path"], duration_ms)
@@ -0,0 +1,22 @@
+import json
+from typing import Any
+
+from fastapi.responses import Response
+
+from app.audit.utils import json_default
+
+
+# Response class that renders raw DB documents straight to JSON bytes. Data read from the DB
+# is trusted, so this skips the response_model validation and jsonable_encoder passes that
+# FastAPI would otherwise run on every document. Routes keep response_model for the docs.
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return json.dumps(
+            content,
+            default=json_default,
+            ensure_ascii=False,
+            allow_nan=False,
+            separators=(",", ":"),
+        ).encode("utf-8")
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import sys
+from datetime import datetime
+from typing import Dict, List, Set
+
+import pymongo
+import pytz
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+from app.audit.config import AppConfig
+
+
+logger = logging.getLogger(__name__)
+
+# Rollups are kept per kind, collection, time bucket and key (user or entity ID, if any).
+#   changes  -> Changes per collection per hour, by operation type.
+#   editors  -> Changes per user per collection per day.
+#   entities -> Changes per entity per collection per day.
+# The key is part of the unique index and of the backfill $merge, which rejects null keys,
+# so collection wide rollups use CHANGES_KEY instead of leaving the key out.
+CHANGES_KEY = "*"
+
+_rollup_index = pymongo.IndexModel(
+    [
+        ("kind", pymongo.ASCENDING),
+        ("collection", pymongo.ASCENDING),
+        ("bucket", pymongo.ASCENDING),
+        ("key", pymongo.ASCENDING),
+    ],
+    name="rollup_unique",
+    unique=True,
+)
+
+
+# Rollup updates still in flight, kept so they are not garbage collected and can be drained at shutdown.
+_pending_updates: Set[asyncio.Task] = set()
+
+
+# Buckets are always UTC hours and days, whatever the timezone of the auditlog. Naive datetimes are UTC already.
+def _as_utc(at: datetime) -> datetime:
+    return at.astimezone(pytz.utc) if at.tzinfo else pytz.utc.localize(at)
+
+
+def _hour(at: datetime) -> datetime:
+    return _as_utc(at).replace(minute=0, second=0, microsecond=0)
+
+
+def _day(at: datetime) -> datetime:
+    return _as_utc(at).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# Method to create the index the rollup upserts and reads rely on.
+async def create_rollup_indexes(db: AsyncIOMotorDatabase):
+    await db[AppConfig.ROLLUP_COLLECTION].create_indexes([_rollup_index])
+
+
+# Method to build the $inc upserts that account for a new auditlog in every rollup.
+def rollup_updates(auditlog: Dict) -> List[UpdateOne]:
+    collection, executed_at = auditlog["collection"], auditlog["executed_at"]
+
+    return [
+        UpdateOne(
+            {"kind": "changes", "collection": collection, "bucket": _hour(executed_at), "key": CHANGES_KEY},
+            {"$inc": {"count": 1, f"operations.{auditlog['operation_type']}": 1}},
+            upsert=True,
+        ),
+        UpdateOne(
+            {"kind": "editors", "collection": collection, "bucket": _day(executed_at), "key": auditlog["executed_by"]},
+            {"$inc": {"count": 1}},
+            upsert=True,
+        ),
+        UpdateOne(
+            {"kind": "entities", "collection": collection, "bucket": _day(executed_at), "key": auditlog["entity_id"]},
+            {"$inc": {"count": 1}},
+            upsert=True,
+        ),
+    ]
+
+
+# Method to account for a new auditlog in the rollups, in a single round trip.
+# Rollups are a best effort view, so a failure here never fails the auditlog itself.
+async def update_rollups(db: AsyncIOMotorDatabase, auditlog: Dict):
+    try:
+        await db[AppConfig.ROLLUP_COLLECTION].bulk_write(rollup_updates(auditlog), ordered=False)
+
+    except Exception:
+        logger.exception(f"Failed to update rollups for auditlog {str(auditlog['_id'])}.")
+
+
+# Method to update the rollups without holding up the auditlog response. Updates are only
+# awaited in line if too many are in flight already, so a slow DB cannot pile them up.
+async def schedule_rollup_update(db: AsyncIOMotorDatabase, auditlog: Dict):
+    if len(_pending_updates) >= AppConfig.ROLLUP_MAX_PENDING_UPDATES:
+        await update_rollups(db, auditlog)
+        return
+
+    task = asyncio.create_task(update_rollups(db, auditlog))
+    _pending_updates.add(task)
+    task.add_done_callback(_pending_updates.discard)
+
+
+# Method to wait for the rollup updates in flight at shutdown.
+async def drain_rollup_updates():
+    if _pending_updates:
+        await asyncio.gather(*_pending_updates, return_exceptions=True)
+
+
+# Method to read the hourly change counts of a collection.
+async def query_change_rollups(db: AsyncIOMotorDatabase, collection: str, criteria: Dict, max_time_ms: int):
+    return await (
+        db[AppConfig.ROLLUP_COLLECTION]
+        .find({"kind": "changes", "collection": collection, **criteria}, projection={"_id": 0, "kind": 0, "key": 0})
+        .sort("bucket", pymongo.ASCENDING)
+        .max_time_ms(max_time_ms)
+        .to_list(length=None)
+    )
+
+
+# Method to read the keys (users or entities) with the most changes in a collection over a period.
+async def query_top_rollups(
+    db: AsyncIOMotorDatabase,
+    kind: str,
+    collection: str,
+    criteria: Dict,
+    limit: int,
+    max_time_ms: int,
+):
+    pipeline = [
+        {"$match": {"kind": kind, "collection": collection, **criteria}},
+        {"$group": {"_id": "$key", "count": {"$sum": "$count"}}},
+        {"$sort": {"count": pymongo.DESCENDING}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "key": "$_id", "count": 1}},
+    ]
+    return await (
+        db[AppConfig.ROLLUP_COLLECTION]
+        .aggregate(pipeline, maxTimeMS=max_time_ms)
+        .to_list(length=None)
+    )
+
+
+# Method to rebuild all rollups of a collection from its raw auditlogs, server side via $merge.
+# NOTE Buckets are replaced as a whole, so live increments landing in a bucket while it is
+# being rebuilt can be lost. Run the backfill before enabling ingestion, or in a quiet period.
+async def backfill_rollups(db: AsyncIOMotorDatabase, collection: str):
+    merge = {
+        "$merge": {
+            "into": AppConfig.ROLLUP_COLLECTION,
+            "on": ["kind", "collection", "bucket", "key"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert",
+        }
+    }
+
+    def trunc(unit: str):
+        return {"$dateTrunc": {"date": "$executed_at", "unit": unit}}
+
+    changes = [
+        {"$group": {"_id": {"bucket": trunc("hour"), "op": "$operation_type"}, "count": {"$sum": 1}}},
+        {"$group": {
+            "_id": "$_id.bucket",
+            "count": {"$sum": "$count"},
+            "operations": {"$push": {"k": "$_id.op", "v": "$count"}},
+        }},
+        {"$project": {
+            "_id": 0,
+            "kind": {"$literal": "changes"},
+            "collection": {"$literal": collection},
+            "bucket": "$_id",
+            "key": {"$literal": CHANGES_KEY},
+            "count": 1,
+            "operations": {"$arrayToObject": "$operations"},
+        }},
+        merge,
+    ]
+
+    def top(kind: str, field: str):
+        return [
+            {"$group": {"_id": {"bucket": trunc("day"), "key": f"${field}"}, "count": {"$sum": 1}}},
+            {"$project": {
+                "_id": 0,
+                "kind": {"$literal": kind},
+                "collection": {"$literal": collection},
+                "bucket": "$_id.bucket",
+                "key": "$_id.key",
+                "count": 1,
+            }},
+            merge,
+        ]
+
+    await db[AppConfig.ROLLUP_COLLECTION].delete_many({"collection": collection})
+    for pipeline in (changes, top("editors", "executed_by"), top("entities", "entity_id")):
+        await db[collection].aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+
+    logger.info(f"Rollups backfilled for collection {collection}.")
+
+
+# Backfill command for existing data.
+# Command syntax --> python -m app.audit.rollups <collection> [<collection> ...]
+async def main(collections: List[str]):
+    from app.audit.database import get_audit_db_client
+
+    db: AsyncIOMotorDatabase = get_audit_db_client()[AppConfig.AUDIT_DB_NAME]
+    await create_rollup_indexes(db)
+
+    for collection in collections:
+        await backfill_rollups(db, collection)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(sys.argv[1:]))
@@ -1,32 +1,67 @@
+import asyncio
 import logging
+from datetime import datetime
+from typing import AsyncIterator, Dict, Optional
 
-import jsondiff
-from fastapi import APIRouter, Body, Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
-from motor.motor_asyncio import AsyncIOMotorDatabase
-from pymongo.errors import OperationFailure
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pydantic import ValidationError
+from pydantic.datetime_parse import parse_datetime
+from pymongo.errors import DuplicateKeyError, ExecutionTimeout, OperationFailure
 
+from app.audit import metrics
+from app.audit.archive import get_watermark, iter_archive, merge_logs, needs_archive, project, query_archive
+from app.audit.codecs import UnsupportedMediaTypeException, decode_body, request_body_schema
+from app.audit.compaction import create_compaction_indexes, find_tombstone, start_compaction, stop_compaction
 from app.audit.config import AppConfig
 from app.audit.database import (
     close_audit_db_client,
     get_audit_db_client,
+    get_audit_db_read_client,
+    refresh_collections,
+    route_limit,
     setup_collections,
+    stop_registry_tasks,
     validate_collection,
 )
+from app.audit.diff import diff_documents
 from app.audit.enums import OperationType
+from app.audit.executor import ExecutorSaturatedException, get_diff_executor
 from app.audit.models import (
     Auditlog,
     AuditlogCreateRequest,
+    AuditlogExportRequest,
     AuditlogSearchRequest,
     AuditlogSearchResult,
+    AuditlogState,
+    RollupRequest,
+)
+from app.audit.profiling import stage, stage_since_start
+from app.audit.responses import FastJSONResponse
+from app.audit.rollups import (
+    create_rollup_indexes,
+    drain_rollup_updates,
+    query_change_rollups,
+    query_top_rollups,
+    schedule_rollup_update,
 )
 from app.audit.service import (
     insert_new_auditlog,
     query_latest_log,
     run_inspection,
-    structure_changes,
+    stream_auditlogs,
+)
+from app.audit.state import (
+    StateReconstructionException,
+    get_log_state,
+    get_state_cache,
+    is_snapshot_version,
 )
-from app.audit.utils import get_current_datetime, oid
+from app.audit.utils import cancel_on_disconnect, get_current_datetime, oid, with_id_field
+from app.audit.writer import get_auditlog_writer
 
 
 router = APIRouter(prefix="/auditlogs", tags=["auditlogs"])
@@ -37,7 +72,22 @@ logger = logging.getLogger(__name__)
 # Startup event to set up the audit DB before making the service live.
 @router.on_event("startup")
 async def startup():
+    get_diff_executor().start()
     await setup_collections()
+    await create_rollup_indexes(get_db())
+    await create_compaction_indexes(get_db())
+    start_compaction()
+
+
+# Shutdown event to flush pending auditlogs and release the worker pools and DB client.
+@router.on_event("shutdown")
+async def shutdown():
+    await stop_registry_tasks()
+    stop_compaction()
+    await get_auditlog_writer().close()
+    await drain_rollup_updates()
+    get_diff_executor().shutdown()
+    await close_audit_db_client()
 
 
 # Method to inject the audit database as a dependency for incoming requests.
@@ -45,32 +95,72 @@ def get_db() -> AsyncIOMotorDatabase:
     return get_audit_db_client()[AppConfig.AUDIT_DB_NAME]
 
 
-@router.post(
-    "",
-    summary="Create an audit log for a tracked entity.",
-    response_description="The newly created auditlog document.",
-    response_model=Auditlog,
-    response_model_by_alias=False,
-)
-async def create_auditlog(
-    request: AuditlogCreateRequest = Body(...),
-    db: AsyncIOMotorDatabase = Depends(get_db),
-):
-    # Only documents from valid collections in source DB will be audited.
-    if not validate_collection(request.collection):
-        raise HTTPException(status_code=400, detail=f"Collection type {request.collection} is not supported.")
+# Method to inject the audit database for read-only requests, served by the read client.
+def get_read_db() -> AsyncIOMotorDatabase:
+    return get_audit_db_read_client()[AppConfig.AUDIT_DB_NAME]
+
+
+# Method to run the queries of a read request in a session of its own, so they can be killed
+# on the server if the client disconnects.
+async def get_read_session() -> AsyncIterator[AsyncIOMotorClientSession]:
+    async with await get_audit_db_read_client().start_session(causal_consistency=False) as session:
+        yield session
+
+
+# Method to parse an auditlog creation request from a JSON, BSON or MessagePack body.
+async def parse_create_request(http_request: Request) -> AuditlogCreateRequest:
+    try:
+        data = decode_body(http_request.headers.get("content-type", ""), await http_request.body())
+
+    except UnsupportedMediaTypeException as e:
+        raise HTTPException(status_code=415, detail=f"Media type {str(e)} is not supported.") from e
 
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="The request body could not be decoded.") from e
+
+    try:
+        return AuditlogCreateRequest.parse_obj(data)
+
+    except ValidationError as e:
+        raise RequestValidationError(e.raw_errors) from e
+
+
+# Method to check whether a duplicate key error was raised by the event ID index.
+def is_event_id_conflict(e: DuplicateKeyError) -> bool:
+    details = e.details or {}
+    return "event_id" in details.get("keyPattern", {}) or "event_id_unique" in details.get("errmsg", "")
+
+
+# Method to diff an incoming change against the latest log of the entity and write the next
+# version of its audit trail. Raises DuplicateKeyError if another write claimed that version first.
+async def record_change(
+    collection: AsyncIOMotorCollection,
+    request: AuditlogCreateRequest,
+    size: int,
+) -> Dict:
     # Extracting the mandatory auditlog fields.
     entity_id = oid(request.document["_id"])
     executed_at = request.document[AppConfig.EXECUTED_AT_FIELD_NAME]
     executed_by = oid(request.document[AppConfig.EXECUTED_BY_FIELD_NAME])
 
-    # Determining the collection to insert into.
-    collection = db[request.collection]
-
-    # Determining the change type and what was modified using JsonDiff.
+    # Determining the change type and what was modified using the diff engine.
+    # Replays of events merged away by compaction are only found through their tombstone, which
+    # is looked up alongside the latest log so it costs no extra round trip.
     try:
-        latest_auditlog = await query_latest_log(collection, entity_id)
+        with stage("query_latest_log"):
+            latest_auditlog, tombstone = await asyncio.gather(
+                query_latest_log(collection, entity_id),
+                find_tombstone(
+                    collection.database,
+                    collection.name,
+                    request.event_id,
+                    AppConfig.QUERY_BUDGETS_MS["create"],
+                ) if request.event_id else asyncio.sleep(0),
+            )
+
+    # Running out of the time budget is answered with a 503 by the ExecutionTimeout handler.
+    except ExecutionTimeout:
+        raise
 
     except OperationFailure as e:
         raise HTTPException(
@@ -78,20 +168,70 @@ async def create_auditlog(
             detail="Failed to query the latest log due to a DB issue, retrying may resolve the problem.",
         ) from e
 
+    # Redelivered events are almost always the latest one recorded for the entity, so
+    # replays are caught here without any extra query.
+    if request.event_id and latest_auditlog and latest_auditlog.get("event_id") == request.event_id:
+        metrics.counter("replayed_events").inc()
+        return latest_auditlog
+
+    if tombstone:
+        metrics.counter("replayed_events").inc()
+        merged_into = await collection.find_one(
+            {"_id": tombstone["auditlog_id"]},
+            max_time_ms=AppConfig.QUERY_BUDGETS_MS["create"],
+        )
+        # The log merged into may have expired since, the entity is then answered with its latest log.
+        return merged_into or latest_auditlog
+
     if not latest_auditlog:
         operation_type = OperationType.INSERT
         changes = None
+        changed_fields = []
+        version = 1
     
     else:
-        raw_changes = jsondiff.diff(
-            request.document,
-            latest_auditlog["document"],
-            syntax="symmetric",
-        )
+        # Logs written before versioning was introduced start a new version chain.
+        version = (latest_auditlog.get("version") or 0) + 1
 
+        # In delta mode the latest log may only hold changes, so its state is rebuilt if needed.
         try:
-            changes = structure_changes(raw_changes)
-            operation_type = OperationType.UPDATE if not changes else OperationType.DELETE
+            with stage("rebuild_state"):
+                latest_document = await get_log_state(
+                    collection,
+                    latest_auditlog,
+                    AppConfig.QUERY_BUDGETS_MS["create"],
+                )
+
+        except (OperationFailure, StateReconstructionException) as e:
+            logger.exception(f"Failed to rebuild the latest state of entity {str(entity_id)}.")
+            raise HTTPException(
+                status_code=500,
+                detail="Failed to rebuild the latest state of the entity, retrying may resolve the problem.",
+            ) from e
+
+        try:
+            with stage("diff"):
+                changes, changed_fields = await get_diff_executor().run(
+                    size,
+                    diff_documents,
+                    request.document,
+                    latest_document,
+                )
+            # Change events always carry the full document, so a change to a known entity is an
+            # update, even one that changed nothing tracked.
+            operation_type = OperationType.UPDATE
+
+        except ExecutorSaturatedException as e:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many changes are being processed, retrying may resolve the problem.",
+            ) from e
+
+        except asyncio.TimeoutError as e:
+            raise HTTPException(
+                status_code=503,
+                detail="Timed out while identifying changes, retrying may resolve the problem.",
+            ) from e
 
         except Exception as e:
             logger.exception(
@@ -100,21 +240,39 @@ async def create_auditlog(
             )
             raise HTTPException(status_code=500, detail="Internal Server Error") from e
 
-    # Configuring new record to be inserted into audit trail.
-    auditlog: Auditlog = Auditlog(
-        collection=request.collection,
-        entity_id=entity_id,
-        operation_type=operation_type,
-        executed_at=executed_at,
-        executed_by=executed_by,
-        document=request.document,
-        changes=jsonable_encoder(changes),
-        warnings=run_inspection(Auditlog.parse_obj(latest_auditlog)),
-        created_at=get_current_datetime(),
-    )
+    # Configuring new record to be inserted into audit trail. The request was validated already,
+    # so the record is built as a plain document rather than revalidated through the model.
+    auditlog = {
+        "_id": ObjectId(),
+        "collection": request.collection,
+        "entity_id": entity_id,
+        "operation_type": operation_type.value,
+        "executed_at": parse_datetime(executed_at),
+        "executed_by": executed_by,
+        "version": version,
+        "event_id": request.event_id,
+        "document": request.document if is_snapshot_version(version) else None,
+        "changes": changes,
+        "changed_fields": changed_fields,
+        "warnings": run_inspection(Auditlog.from_db(latest_auditlog) if latest_auditlog else None),
+        "created_at": get_current_datetime(),
+    }
 
+    # The unique (entity_id, version) index makes this insert conditional on the latest log
+    # still being the one the changes were computed against.
     try:
-        await insert_new_auditlog(collection, auditlog)
+        with stage("insert_new_auditlog"):
+            await insert_new_auditlog(collection, auditlog)
+
+    # Older replays only surface here, through the unique event ID index.
+    except DuplicateKeyError as e:
+        if request.event_id and is_event_id_conflict(e):
+            metrics.counter("replayed_events").inc()
+            return await collection.find_one(
+                {"event_id": request.event_id},
+                max_time_ms=AppConfig.QUERY_BUDGETS_MS["create"],
+            )
+        raise
 
     except OperationFailure as e:
         raise HTTPException(
@@ -122,9 +280,59 @@ async def create_auditlog(
             detail="Failed to insert the auditlog due to a DB issue, retrying may resolve the problem.",
         ) from e
 
+    # The next change to this entity will be diffed against this state.
+    get_state_cache().put(auditlog["_id"], request.document)
+
+    # Rollups are updated in the background, their round trip is not paid by the response.
+    with stage("schedule_rollup_update"):
+        await schedule_rollup_update(collection.database, auditlog)
+
     return auditlog
 
 
+@router.post(
+    "",
+    summary="Create an audit log for a tracked entity.",
+    response_description="The newly created auditlog document.",
+    response_model=Auditlog,
+    response_model_by_alias=False,
+    openapi_extra=request_body_schema(AuditlogCreateRequest),
+)
+async def create_auditlog(
+    http_request: Request,
+    request: AuditlogCreateRequest = Depends(parse_create_request),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+):
+    stage_since_start("validation")
+
+    # Only documents from valid collections in source DB will be audited.
+    if not validate_collection(request.collection):
+        raise HTTPException(status_code=400, detail=f"Collection type {request.collection} is not supported.")
+
+    # Determining the collection to insert into.
+    collection = db[request.collection]
+
+    # The request body size is a cheap proxy for how expensive the diff will be.
+    size = int(http_request.headers.get("content-length", AppConfig.DIFF_INLINE_THRESHOLD))
+
+    # If a concurrent change to the same entity claimed the next version first, the change
+    # is diffed again against that one. No lock is needed, even across workers.
+    for _ in range(AppConfig.VERSION_CONFLICT_RETRIES):
+        try:
+            auditlog = await record_change(collection, request, size)
+
+            with stage("encode"):
+                return FastJSONResponse(with_id_field(auditlog))
+
+        except DuplicateKeyError:
+            metrics.counter("version_conflicts").inc()
+
+    raise HTTPException(
+        status_code=503,
+        detail="Too many concurrent changes to the entity, retrying may resolve the problem.",
+    )
+
+
 @router.get(
     "",
     summary="Search for auditlogs.",
@@ -132,9 +340,14 @@ async def create_auditlog(
     response_model=AuditlogSearchResult,
 )
 async def search_auditlogs(
+    http_request: Request,
     request: AuditlogSearchRequest = Depends(AuditlogSearchRequest),
-    db: AsyncIOMotorDatabase = Depends(get_db),
+    db: AsyncIOMotorDatabase = Depends(get_read_db),
+    session: AsyncIOMotorClientSession = Depends(get_read_session),
+    _=Depends(route_limit("search")),
 ):
+    stage_since_start("validation")
+
     # Validating target collection.
     if not validate_collection(request.collection):
         raise HTTPException(
@@ -142,32 +355,342 @@ async def search_auditlogs(
             detail=f"Collection type {request.collection} is not supported",
         )
     
-    # One of resource ID or user ID must be provided.
-    if not request.entity_id and not request.user_id:
+    # One of resource ID, user ID or changed field must be provided.
+    if not request.entity_id and not request.user_id and not request.changed_field:
         raise HTTPException(
-            status_code=400, detail="Entity ID or user ID must be provided."
+            status_code=400, detail="Entity ID, user ID or changed field must be provided."
         )
 
     criteria = request.get_criteria()
     sort_order = -1 if request.order == "desc" else 1
+    projection = request.get_projection()
+
+    # Searches reaching back past the archive watermark are served from both tiers. The page is
+    # then cut from the merged results, so each tier is asked for everything up to its end.
+    archived = needs_archive(request.collection, request.start_date, request.include_archive)
+    if archived and request.offset > AppConfig.ARCHIVE_MAX_SEARCH_OFFSET:
+        raise HTTPException(
+            status_code=400,
+            detail=(
+                f"Searches including archived logs are limited to an offset of {AppConfig.ARCHIVE_MAX_SEARCH_OFFSET}, "
+                "narrow the date range or use the export instead."
+            ),
+        )
+
+    if archived and projection:
+        projection = {**projection, "executed_at": 1}
+
+    cursor = (
+        db[request.collection]
+        .find(criteria, projection=projection, session=session)
+        .skip(0 if archived else request.offset)
+        .sort(request.sort_by, sort_order)
+        .max_time_ms(AppConfig.QUERY_BUDGETS_MS["search"])
+    )
+    length = request.offset + request.limit if archived else request.limit
+
+    # If the search itself runs out of budget, the ExecutionTimeout handler reports it.
+    try:
+        with stage("query"):
+            logs = await cancel_on_disconnect(http_request, cursor.to_list(length=length), session)
+    finally:
+        await cursor.close()
+
+    archived_count = 0
+    if archived:
+        # Logs being archived right now are in both tiers. They are left out of the archive, so
+        # they are only counted once. Few logs before the watermark stay hot, so this is cheap.
+        with stage("query_archive"):
+            watermark = get_watermark(request.collection)
+            hot_range = {**criteria.get("executed_at", {}), "$lt": watermark}
+            hot_ids = await cancel_on_disconnect(
+                http_request,
+                db[request.collection].distinct(
+                    "_id",
+                    {**criteria, "executed_at": hot_range},
+                    maxTimeMS=AppConfig.QUERY_BUDGETS_MS["count"],
+                    session=session,
+                ),
+                session,
+            )
+
+            archived_logs, archived_count = await asyncio.to_thread(
+                query_archive,
+                request,
+                length,
+                sort_order == -1,
+                {str(log_id) for log_id in hot_ids},
+                projection,
+            )
+
+        logs = merge_logs(logs, archived_logs, sort_order == -1)[request.offset:length]
+        logs = [project(log, request.get_projection()) for log in logs]
+
+    # Counting every match can cost far more than fetching one page of them, so the logs
+    # are still returned if only the count runs out of budget.
+    try:
+        with stage("count"):
+            total_count = await cancel_on_disconnect(
+                http_request,
+                db[request.collection].count_documents(
+                    criteria,
+                    maxTimeMS=AppConfig.QUERY_BUDGETS_MS["count"],
+                    session=session,
+                ),
+                session,
+            )
+        total_count += archived_count
+        budget_exhausted = False
+
+    except ExecutionTimeout:
+        logger.warning(f"Counting matches in {request.collection} ran out of its time budget.")
+        total_count = None
+        budget_exhausted = True
+
+    with stage("encode"):
+        return FastJSONResponse({
+            "logs": logs,
+            "total_count": total_count,
+            "budget_exhausted": budget_exhausted,
+        })
+
+
+@router.get(
+    "/export",
+    summary="Stream the audit trail of a collection as NDJSON.",
+    response_description="One auditlog per line, gzip compressed if requested.",
+    response_class=StreamingResponse,
+)
+async def export_auditlogs(
+    request: AuditlogExportRequest = Depends(AuditlogExportRequest),
+    db: AsyncIOMotorDatabase = Depends(get_read_db),
+    _=Depends(route_limit("export")),
+):
+    # Validating target collection.
+    if not validate_collection(request.collection):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Collection type {request.collection} is not supported",
+        )
+
+    sort_order = -1 if request.order == "desc" else 1
 
-    logs = (
-        await db[request.collection]
-        .find(criteria)
-        .skip(request.offset)
+    # Unlike search, there is no limit here. The cursor is consumed lazily while streaming.
+    cursor = (
+        db[request.collection]
+        .find(request.get_criteria(), projection=request.get_projection())
         .sort(request.sort_by, sort_order)
-        .to_list(length=request.limit)
+        .batch_size(AppConfig.EXPORT_BATCH_SIZE)
+        .max_time_ms(AppConfig.QUERY_BUDGETS_MS["export"])
     )
 
-    total_count = await db[request.collection].count_documents(criteria)
+    # Exports reaching back past the archive watermark stream both tiers merged in order.
+    archived = None
+    if needs_archive(request.collection, request.start_date, request.include_archive):
+        archived = iter_archive(request, request.get_projection(), sort_order == -1)
 
-    return AuditlogSearchResult(logs=logs, total_count=total_count)
+    filename = f"{request.collection}_auditlogs.ndjson" + (".gz" if request.compress else "")
+
+    return StreamingResponse(
+        stream_auditlogs(cursor, request.compress, archived, sort_order == -1),
+        media_type="application/gzip" if request.compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get(
+    "/analytics/changes",
+    summary="Get the hourly change counts of a collection.",
+    response_description="One bucket per hour with changes, with counts by operation type.",
+)
+async def get_change_analytics(
+    request: RollupRequest = Depends(RollupRequest),
+    db: AsyncIOMotorDatabase = Depends(get_read_db),
+    _=Depends(route_limit("analytics")),
+):
+    # Validating target collection.
+    if not validate_collection(request.collection):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Collection type {request.collection} is not supported",
+        )
+
+    buckets = await query_change_rollups(
+        db,
+        request.collection,
+        request.get_criteria(),
+        AppConfig.QUERY_BUDGETS_MS["analytics"],
+    )
+    return FastJSONResponse({"collection": request.collection, "buckets": buckets})
+
+
+@router.get(
+    "/analytics/editors",
+    summary="Get the users with the most changes to a collection.",
+    response_description="User IDs with their change counts, most active first.",
+)
+async def get_editor_analytics(
+    request: RollupRequest = Depends(RollupRequest),
+    db: AsyncIOMotorDatabase = Depends(get_read_db),
+    _=Depends(route_limit("analytics")),
+):
+    return await get_top_analytics("editors", request, db)
+
+
+@router.get(
+    "/analytics/entities",
+    summary="Get the most frequently changed entities of a collection.",
+    response_description="Entity IDs with their change counts, most changed first.",
+)
+async def get_entity_analytics(
+    request: RollupRequest = Depends(RollupRequest),
+    db: AsyncIOMotorDatabase = Depends(get_read_db),
+    _=Depends(route_limit("analytics")),
+):
+    return await get_top_analytics("entities", request, db)
+
+
+# Method to serve the top keys of a daily rollup over the requested period.
+async def get_top_analytics(kind: str, request: RollupRequest, db: AsyncIOMotorDatabase):
+    # Validating target collection.
+    if not validate_collection(request.collection):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Collection type {request.collection} is not supported",
+        )
+
+    top = await query_top_rollups(
+        db,
+        kind,
+        request.collection,
+        request.get_criteria(),
+        request.limit,
+        AppConfig.QUERY_BUDGETS_MS["analytics"],
+    )
+    return FastJSONResponse({"collection": request.collection, "top": top})
+
+
+# Claim-check lookup for slim change events, which only carry the collection and ID of their auditlog.
+# NOTE Registered after the analytics routes, as it would match them otherwise.
+@router.get(
+    "/{collection}/{auditlog_id}",
+    summary="Get a single auditlog by its ID.",
+    response_description="The auditlog, along with the full entity document.",
+    response_model=Auditlog,
+    response_model_by_alias=False,
+)
+async def get_auditlog(
+    http_request: Request,
+    collection: str,
+    auditlog_id: str,
+    db: AsyncIOMotorDatabase = Depends(get_read_db),
+    session: AsyncIOMotorClientSession = Depends(get_read_session),
+    _=Depends(route_limit("auditlog")),
+):
+    # Validating target collection.
+    if not validate_collection(collection):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Collection type {collection} is not supported",
+        )
+
+    budget = AppConfig.QUERY_BUDGETS_MS["auditlog"]
+    criteria = {"_id": oid(auditlog_id)}
+
+    log = await cancel_on_disconnect(
+        http_request,
+        db[collection].find_one(criteria, max_time_ms=budget, session=session),
+        session,
+    )
+
+    # Events are published as soon as the log is written, so the read client may not have it yet.
+    # The session belongs to the read client, so the primary is queried without it.
+    if log is None:
+        db, session = get_db(), None
+        log = await cancel_on_disconnect(http_request, db[collection].find_one(criteria, max_time_ms=budget))
+
+    if log is None:
+        raise HTTPException(status_code=404, detail="Auditlog not found.")
+
+    # Delta logs get their document rebuilt, so subscribers always get the full entity.
+    if log.get("document") is None and log.get("version") is not None:
+        try:
+            log["document"] = await cancel_on_disconnect(
+                http_request,
+                get_log_state(db[collection], log, budget, session),
+                session,
+            )
+
+        except StateReconstructionException as e:
+            raise HTTPException(status_code=500, detail=str(e)) from e
+
+    return FastJSONResponse(with_id_field(log))
+
+
+@router.get(
+    "/{collection}/{entity_id}/state",
+    summary="Get the state of an entity at a point in time.",
+    response_description="The entity as it was after the latest change at or before the given time.",
+    response_model=AuditlogState,
+)
+async def get_entity_state(
+    http_request: Request,
+    collection: str,
+    entity_id: str,
+    at: Optional[datetime] = Query(default=None, description="Defaults to the current time."),
+    db: AsyncIOMotorDatabase = Depends(get_read_db),
+    session: AsyncIOMotorClientSession = Depends(get_read_session),
+    _=Depends(route_limit("state")),
+):
+    # Validating target collection.
+    if not validate_collection(collection):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Collection type {collection} is not supported",
+        )
+
+    criteria = {"entity_id": oid(entity_id)}
+    if at:
+        criteria["executed_at"] = {"$lte": at}
+
+    budget = AppConfig.QUERY_BUDGETS_MS["state"]
+
+    log = await cancel_on_disconnect(
+        http_request,
+        db[collection].find_one(
+            criteria,
+            projection={"changes": 0, "warnings": 0},
+            sort=[("executed_at", -1), ("version", -1)],
+            max_time_ms=budget,
+            session=session,
+        ),
+        session,
+    )
+    if log is None:
+        raise HTTPException(status_code=404, detail="No auditlogs found for the entity at the given time.")
+
+    try:
+        document = await cancel_on_disconnect(http_request, get_log_state(db[collection], log, budget, session), session)
+
+    except StateReconstructionException as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+    return FastJSONResponse({
+        "collection": collection,
+        "entity_id": log["entity_id"],
+        "version": log.get("version"),
+        "executed_at": log["executed_at"],
+        "document": document,
+    })
 
 
 @router.post(
     "/refresh",
     summary="Refresh the service to account for any changes in source API DB being monitored.",
+    status_code=202,
 )
 async def refresh_service():
-    await close_audit_db_client()
-    await setup_collections()
+    # The refresh runs in the background and swaps the registry in once it is done,
+    # so in-flight requests keep using the shared DB client undisturbed.
+    started = refresh_collections()
+    return {"status": "started" if started else "in_progress"}
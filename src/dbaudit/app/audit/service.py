@@ -1,15 +1,24 @@
 import logging
-from typing import List
-
-import jsondiff
-from fastapi import HTTPException
-from motor.motor_asyncio import AsyncIOMotorCollection
-from pymongo.errors import OperationFailure
-from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_fixed
+import zlib
+from typing import AsyncIterator, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorCursor
+from pymongo.errors import DuplicateKeyError, ExecutionTimeout, OperationFailure
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    retry_if_not_exception_type,
+    stop_after_attempt,
+    wait_fixed,
+)
 
+from app.audit.archive import merge_log_streams
+from app.audit.config import AppConfig
 from app.audit.enums import OperationType, WarningType
 from app.audit.models import Auditlog
-from app.audit.schemas import FieldChange, ListChange, PyObjectId
+from app.audit.schemas import PyObjectId
+from app.audit.utils import to_ndjson_line
+from app.audit.writer import get_auditlog_writer
 
 
 logger = logging.getLogger(__name__)
@@ -19,7 +28,8 @@ logger = logging.getLogger(__name__)
 @retry(
     reraise=True,
     stop=stop_after_attempt(3),
-    retry=retry_if_exception_type(OperationFailure),
+    # A query that ran out of its time budget would only run out of it again.
+    retry=retry_if_exception_type(OperationFailure) & retry_if_not_exception_type(ExecutionTimeout),
     wait=wait_fixed(1),
 )
 async def query_latest_log(
@@ -30,7 +40,8 @@ async def query_latest_log(
     try:
         result = (
             await collection.find({"entity_id": entity_id})
-            .sort("executed_at", -1)
+            .sort([("version", -1), ("executed_at", -1)])
+            .max_time_ms(AppConfig.QUERY_BUDGETS_MS["create"])
             .to_list(length=1)
         )
 
@@ -42,50 +53,16 @@ async def query_latest_log(
     return result[0] if result else None
 
 
-# Method to structure changes identified by Jsondiff into a consistent format.
-def structure_changes(raw_data):
-    changes = {}
-
-    for key, value in raw_data.items():
-        # Insertion & Deletion of non-dictionary items into a list field.
-        # Eg -> 'tags': {insert: [(1, 'unavailable')], delete: [(1, 'discount')]}
-        if key == jsondiff.symbols.insert:
-            changes["deletes"] = [
-                ListChange(index=list_value[0], item=list_value[1])
-                for list_value in value
-            ]
-
-        elif key == jsondiff.symbols.delete:
-            changes["inserts"] = [
-                ListChange(index=list_value[0], item=list_value[1])
-                for list_value in value
-            ]
-
-        elif isinstance(value, list):
-            # Value change for a standard field.
-            # Eg -> 'price': [299.99, 349.99]
-            changes[str(key)] = FieldChange(new_value=value[0], old_value=value[1])
-
-        elif isinstance(value, dict):
-            # Using recursion to handle nested fields.
-            changes[str(key)] = structure_changes(value)
-
-        else:
-            raise HTTPException(status_code=500, detail="Unknown change type.")
-
-    return changes
-
-
 # Method to inspect the auditlog for any custom warnings we want to document.
 # Keeping this in a separate file to avoid cluttering models.py. The number of
 # checks could be extensive, especially if we have a large number of collections.
 
-def run_inspection(latest_log: Auditlog) -> List[WarningType]:
-    warnings: List[WarningType] = []
+def run_inspection(latest_log: Optional[Auditlog]) -> List[Dict]:
+    warnings: List[Dict] = []
     
     # In case a resource that was previously marked as deleted is reintroduced in the DB.
     if latest_log and latest_log.operation_type == OperationType.DELETE:
-        warnings.append(WarningType.RESOURCE_ACCESS_AFTER_DELETE.format())
+        warnings.append(WarningType.RESOURCE_ACCESS_AFTER_DELETE.format().dict())
     
     # Like above, we can add any standard checks here that are applicable to all collections.
 
@@ -117,17 +94,69 @@ def run_inspection(latest_log: Auditlog) -> List[WarningType]:
 
 
 # Method to insert an auditlog into collection.
+# Duplicate keys are not retried here, they mean another write claimed the same version.
 @retry(
     reraise=True,
     stop=stop_after_attempt(3),
-    retry=retry_if_exception_type(OperationFailure),
+    retry=retry_if_exception_type(OperationFailure) & retry_if_not_exception_type(DuplicateKeyError),
     wait=wait_fixed(1),
 )
-async def insert_new_auditlog(collection: AsyncIOMotorCollection, auditlog: Auditlog):
+async def insert_new_auditlog(collection: AsyncIOMotorCollection, auditlog: Dict):
     try:
-        await collection.insert_one(auditlog.__dict__)
+        # With group commit enabled, the insert is batched with concurrent ones into the same collection.
+        if AppConfig.GROUP_COMMIT_ENABLED:
+            await get_auditlog_writer().insert(collection, auditlog)
+        else:
+            await collection.insert_one(auditlog)
 
     # Retry logic kicks in if we encounter DB operation exceptions.
+    except DuplicateKeyError:
+        raise
+
     except OperationFailure:
-        logger.exception(f"Failed to insert auditlog for entity {auditlog.entity_id}.", exc_info=True)
+        logger.exception(f"Failed to insert auditlog for entity {auditlog['entity_id']}.", exc_info=True)
         raise
+
+
+# Method to stream the documents of a cursor as NDJSON chunks, optionally gzip compressed.
+# Motor fetches the cursor in batches and output is flushed once it reaches the chunk size,
+# so memory stays constant regardless of how many logs the export covers.
+async def stream_auditlogs(
+    cursor: AsyncIOMotorCursor,
+    compress: bool = False,
+    archived: Optional[AsyncIterator[Dict]] = None,
+    descending: bool = False,
+) -> AsyncIterator[bytes]:
+    # wbits=31 -> zlib stream with gzip header and trailer.
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    buffer = bytearray()
+    exported = 0
+
+    try:
+        try:
+            logs = merge_log_streams(cursor, archived, descending) if archived else cursor
+            async for log in logs:
+                buffer += to_ndjson_line(log)
+                exported += 1
+
+                if len(buffer) >= AppConfig.EXPORT_CHUNK_SIZE:
+                    chunk = compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+                    buffer.clear()
+
+                    # The compressor may hold on to small inputs until it has a full block.
+                    if chunk:
+                        yield chunk
+
+        # The response has started already, so running out of time budget is reported
+        # with a trailing status line instead of an error status.
+        except ExecutionTimeout:
+            logger.warning(f"Export ran out of its time budget after {exported} auditlogs.")
+            buffer += to_ndjson_line({"_export_status": "budget_exhausted", "exported": exported})
+
+        chunk = compressor.compress(bytes(buffer)) + compressor.flush() if compressor else bytes(buffer)
+        if chunk:
+            yield chunk
+
+    # Kill the server side cursor if the client disconnects midway through the export.
+    finally:
+        await cursor.close()
@@ -0,0 +1,101 @@
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorCollection
+
+from app.audit.config import AppConfig
+from app.audit.diff import apply_changes
+
+
+logger = logging.getLogger(__name__)
+
+
+# Exception raised when the snapshot needed to rebuild an entity state cannot be found.
+class StateReconstructionException(Exception):
+    pass
+
+
+# Bounded LRU of rebuilt entity states keyed by auditlog ID, one per worker process. Logs are only
+# rewritten or deleted by compaction, which keeps the state after every surviving log unchanged and
+# invalidates the logs it touches in its own worker. Entries of deleted logs left in other workers
+# are never looked up again, as lookups start from logs read from the DB.
+class StateCache:
+    def __init__(self, size: int):
+        self.size = size
+        self._states: "OrderedDict[ObjectId, Dict]" = OrderedDict()
+
+    def get(self, log_id: ObjectId) -> Optional[Dict]:
+        state = self._states.get(log_id)
+        if state is not None:
+            self._states.move_to_end(log_id)
+        return state
+
+    def invalidate(self, log_ids: Iterable[ObjectId]):
+        for log_id in log_ids:
+            self._states.pop(log_id, None)
+
+    def put(self, log_id: ObjectId, state: Dict):
+        self._states[log_id] = state
+        self._states.move_to_end(log_id)
+        while len(self._states) > self.size:
+            self._states.popitem(last=False)
+
+
+_state_cache = StateCache(AppConfig.STATE_CACHE_SIZE)
+
+
+# Method to get the state cache shared by requests in this worker.
+def get_state_cache() -> StateCache:
+    return _state_cache
+
+
+# Method to check whether a version should store a full snapshot of the entity.
+def is_snapshot_version(version: int) -> bool:
+    if AppConfig.AUDIT_STORAGE_MODE != "delta":
+        return True
+    return (version - 1) % AppConfig.SNAPSHOT_INTERVAL == 0
+
+
+# Method to get the state of the entity as of a given auditlog. Snapshot logs carry it directly,
+# delta logs are rebuilt from the nearest earlier snapshot plus the deltas in between.
+# NOTE States may be shared with the cache, so they must be treated as read-only.
+async def get_log_state(
+    collection: AsyncIOMotorCollection,
+    log: Dict,
+    max_time_ms: int,
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> Dict:
+    if log.get("document") is not None:
+        return log["document"]
+
+    if (state := _state_cache.get(log["_id"])) is not None:
+        return state
+
+    entity_id, version = log["entity_id"], log["version"]
+
+    snapshot = await collection.find_one(
+        {"entity_id": entity_id, "version": {"$lt": version}, "document": {"$ne": None}},
+        projection={"document": 1, "version": 1},
+        sort=[("version", -1)],
+        max_time_ms=max_time_ms,
+        session=session,
+    )
+    if snapshot is None:
+        raise StateReconstructionException(
+            f"No snapshot found for version {version} of entity {str(entity_id)}."
+        )
+
+    state = snapshot["document"]
+    deltas = collection.find(
+        {"entity_id": entity_id, "version": {"$gt": snapshot["version"], "$lte": version}},
+        projection={"changes": 1, "version": 1},
+        session=session,
+    ).sort("version", 1).max_time_ms(max_time_ms)
+
+    async for delta in deltas:
+        state = apply_changes(state, delta.get("changes") or {})
+
+    _state_cache.put(log["_id"], state)
+    return state
@@ -1,9 +1,20 @@
+import asyncio
+import json
+import logging
 from datetime import datetime
+from typing import Awaitable, Optional, TypeVar
 
 import pytz
 from bson.errors import InvalidId
 from bson.objectid import ObjectId
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
+from motor.motor_asyncio import AsyncIOMotorClientSession
+from pymongo.errors import PyMongoError
+
+from app.audit.config import AppConfig
+
+
+T = TypeVar("T")
 
 
 def oid(x):
@@ -17,4 +28,54 @@ def get_current_datetime():
     current_time = datetime.now(pytz.utc)
     milliseconds = (int(current_time.microsecond / 1000)) * 1000
     current_time = current_time.replace(microsecond=milliseconds)
-    return current_time
\ No newline at end of file
+    return current_time
+
+
+# Custom handling of ObjectID and Datetime type values when serializing raw DB documents.
+def json_default(o):
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, datetime):
+        return o.isoformat()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+# Serializes a raw DB document into a single NDJSON line.
+def to_ndjson_line(document: dict) -> bytes:
+    return (json.dumps(document, default=json_default, separators=(",", ":")) + "\n").encode()
+
+
+# Renames the _id key of a raw DB document to id, matching responses built with by_alias=False.
+def with_id_field(document: dict) -> dict:
+    return {("id" if key == "_id" else key): value for key, value in document.items()}
+
+
+# Method to kill the operations of a session on the server, eg -> once their results are no longer wanted.
+async def kill_session(session: AsyncIOMotorClientSession):
+    try:
+        await session.client.admin.command("killSessions", [session.session_id])
+    except PyMongoError:
+        logging.getLogger(__name__).warning("Failed to kill the operations of a disconnected client.", exc_info=True)
+
+
+# Method to await a DB operation, cancelling it if the client disconnects in the meantime.
+# If the operation runs in the given session, it is killed on the server too. Otherwise it
+# stays bounded by its maxTimeMS.
+async def cancel_on_disconnect(
+    request: Request,
+    operation: Awaitable[T],
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> T:
+    task = asyncio.ensure_future(operation)
+
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=AppConfig.DISCONNECT_POLL_SECONDS)
+        if done:
+            return task.result()
+
+        if await request.is_disconnected():
+            task.cancel()
+            if session is not None:
+                await kill_session(session)
+            # 499 -> Client closed request, nobody will read the response anyway.
+            raise HTTPException(status_code=499, detail="Client disconnected.")
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, WriteError
+
+from app.audit import metrics
+from app.audit.config import AppConfig
+
+
+logger = logging.getLogger(__name__)
+
+# Error codes reported by Mongo for unique index violations.
+_DUPLICATE_KEY_CODES = (11000, 11001, 12582)
+
+# Histogram buckets for the number of documents per flush.
+_BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+
+
+# Maps a write error reported for one document of a bulk insert to the exception insert_one would raise.
+def _write_exception(error: Dict) -> OperationFailure:
+    if error.get("code") in _DUPLICATE_KEY_CODES:
+        return DuplicateKeyError(error.get("errmsg"), error.get("code"), error)
+    return WriteError(error.get("errmsg"), error.get("code"), error)
+
+
+# In-process group commit writer. Concurrent callers hand over their documents and each one
+# waits on a future that only resolves once its own document was acknowledged by the DB.
+class GroupCommitWriter:
+    def __init__(self):
+        self._buffers: Dict[str, List[Tuple[Dict, asyncio.Future]]] = {}
+        self._collections: Dict[str, AsyncIOMotorCollection] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._flushes: Set[asyncio.Task] = set()
+
+    async def insert(self, collection: AsyncIOMotorCollection, document: Dict):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        key = collection.full_name
+        self._collections[key] = collection
+        buffer = self._buffers.setdefault(key, [])
+        buffer.append((document, future))
+
+        if len(buffer) >= AppConfig.GROUP_COMMIT_MAX_DOCS:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(
+                AppConfig.GROUP_COMMIT_MAX_DELAY_MS / 1000,
+                self._flush,
+                key,
+            )
+
+        return await future
+
+    def _flush(self, key: str):
+        if timer := self._timers.pop(key, None):
+            timer.cancel()
+
+        batch = self._buffers.pop(key, None)
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._write(self._collections[key], batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _write(self, collection: AsyncIOMotorCollection, batch: List[Tuple[Dict, asyncio.Future]]):
+        start = time.perf_counter()
+        errors: Dict[int, OperationFailure] = {}
+
+        try:
+            # Unordered, so one failing document does not hold back the rest of the batch.
+            await collection.insert_many([document for document, _ in batch], ordered=False)
+
+        except BulkWriteError as e:
+            # A write concern error means none of the writes can be considered acknowledged.
+            if e.details.get("writeConcernErrors"):
+                errors = {index: e for index in range(len(batch))}
+            else:
+                errors = {error["index"]: _write_exception(error) for error in e.details.get("writeErrors", [])}
+
+        except Exception as e:
+            logger.exception(f"Failed to flush {len(batch)} auditlogs into {collection.name}.")
+            errors = {index: e for index in range(len(batch))}
+
+        metrics.histogram("group_commit_batch_size", _BATCH_SIZE_BUCKETS).observe(len(batch))
+        metrics.histogram("group_commit_flush_ms").observe((time.perf_counter() - start) * 1000)
+
+        # Callers that went away in the meantime have their futures cancelled already.
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
+
+    # Method to write out whatever is still buffered, used at shutdown.
+    async def close(self):
+        for key in list(self._buffers):
+            self._flush(key)
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+
+# Global writer shared by requests in this worker.
+_auditlog_writer: Optional[GroupCommitWriter] = None
+
+
+# Method to reuse the group commit writer as a singleton.
+def get_auditlog_writer() -> GroupCommitWriter:
+    global _auditlog_writer
+
+    if _auditlog_writer is None:
+        _auditlog_writer = GroupCommitWriter()
+
+    return _auditlog_writer
@@ -9,6 +9,8 @@ from pydantic.fields import ModelField
 from pymongo.errors import ConnectionFailure, ExecutionTimeout
 
 from app import audit
+from app.audit import metrics
+from app.audit.profiling import ProfilingMiddleware, get_profiler
 
 
 def field_schema(field: ModelField, **kwargs: Any) -> Any:
@@ -33,6 +35,7 @@ app = FastAPI(
 
 
 app.include_router(audit.audit_router)
+app.add_middleware(ProfilingMiddleware)
 
 
 @app.exception_handler(ConnectionFailure)
@@ -49,8 +52,11 @@ async def connection_failure_exception_handler(request, exc):
 async def exceution_timeout_exception_handler(request, exc):
     logging.exception("The request timed out.")
     return JSONResponse(
-        status_code=500,
-        content="The request taking longer than usual, please try again later.",
+        status_code=503,
+        content={
+            "detail": "The query exceeded its time budget, narrowing the search filters may resolve the problem.",
+            "budget_exhausted": True,
+        },
     )
 
 
@@ -75,3 +81,24 @@ async def catchall_exception_handler(request, exc):
 @app.get("/")
 async def root():
     return {"message": "Hello! Navigate to /docs to check out the endpoints."}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
+
+@app.post("/metrics/profiler")
+async def configure_profiler(enabled: bool, slowest_percent: float = None, interval_ms: float = None):
+    profiler = get_profiler()
+    profiler.configure(enabled, slowest_percent, interval_ms)
+    return {
+        "enabled": profiler.enabled,
+        "slowest_percent": profiler.slowest_percent,
+        "interval_ms": profiler.interval_ms,
+    }
+
+
+@app.get("/metrics/profiles")
+async def get_profiles():
+    return list(get_profiler().profiles)
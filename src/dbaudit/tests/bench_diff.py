@@ -0,0 +1,62 @@
+import random
+import timeit
+from functools import partial
+
+import jsondiff
+
+from app.audit.diff import diff_documents
+
+
+# Benchmark of the diff engine against jsondiff, which it replaced.
+# Command syntax --> python -m tests.bench_diff (from src/dbaudit)
+
+
+def _flat(size: int):
+    old = {f"field_{i}": i for i in range(size)}
+    new = {**old, **{f"field_{i}": -i for i in range(0, size, 50)}}
+    return new, old
+
+
+def _long_list(size: int):
+    old = {"_id": 1, "items": list(range(size))}
+    new = {"_id": 1, "items": old["items"][:size // 2] + [-1] + old["items"][size // 2 + 1:] + [size]}
+    return new, old
+
+
+def _nested(size: int):
+    rng = random.Random(0)
+    old = {
+        "_id": 1,
+        "variants": [{"sku": f"sku-{i}", "stock": rng.randint(0, 100), "tags": ["a", "b"]} for i in range(size)],
+    }
+    variants = [dict(variant) for variant in old["variants"]]
+    for variant in rng.sample(variants, size // 20):
+        variant["stock"] += 1
+    del variants[size // 3]
+    return {"_id": 1, "variants": variants}, old
+
+
+CASES = {
+    "flat, 1k fields": _flat(1_000),
+    "long list, 1k scalars": _long_list(1_000),
+    "nested, 500 dicts": _nested(500),
+}
+
+
+# Best time of a few runs, in ms.
+def _time_ms(function) -> float:
+    runs, seconds = timeit.Timer(function).autorange()
+    return min([seconds] + timeit.repeat(function, number=runs, repeat=3)) / runs * 1000
+
+
+def main():
+    print(f"{'case':<24}{'jsondiff ms':>14}{'diff ms':>12}{'speedup':>10}")
+
+    for name, (new, old) in CASES.items():
+        baseline = _time_ms(partial(jsondiff.diff, new, old, syntax="symmetric"))
+        current = _time_ms(partial(diff_documents, new, old))
+        print(f"{name:<24}{baseline:>14.2f}{current:>12.2f}{baseline / current:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import json
+import timeit
+from datetime import timedelta
+from functools import partial
+
+from bson.objectid import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.utils import create_response_field
+
+from app.audit.models import AuditlogSearchResult
+from app.audit.responses import FastJSONResponse
+from app.audit.utils import get_current_datetime
+
+
+# Benchmark of FastJSONResponse against the response_model path FastAPI runs otherwise, ie ->
+# validation against the model, jsonable_encoder and JSONResponse.
+# Command syntax --> python -m tests.bench_responses (from src/dbaudit)
+
+
+def _auditlog(version: int, fields: int):
+    now = get_current_datetime()
+    entity_id = ObjectId()
+    document = {"_id": entity_id, **{f"field_{i}": f"value {i}" for i in range(fields)}}
+    return {
+        "_id": ObjectId(),
+        "collection": "products",
+        "entity_id": entity_id,
+        "operation_type": "update",
+        "executed_at": now - timedelta(seconds=version),
+        "executed_by": ObjectId(),
+        "version": version,
+        "event_id": None,
+        "document": document,
+        "changes": {f"field_{i}": {"new_value": f"value {i}", "old_value": None} for i in range(0, fields, 10)},
+        "changed_fields": [f"field_{i}" for i in range(0, fields, 10)],
+        "warnings": [],
+        "created_at": now,
+    }
+
+
+def _page(size: int, fields: int):
+    return {
+        "logs": [_auditlog(version, fields) for version in range(size)],
+        "total_count": size,
+        "budget_exhausted": False,
+    }
+
+
+CASES = {
+    "10 logs, 20 fields": _page(10, 20),
+    "100 logs, 20 fields": _page(100, 20),
+    "1k logs, 20 fields": _page(1_000, 20),
+    "100 logs, 200 fields": _page(100, 200),
+}
+
+_FIELD = create_response_field(name="response", type_=AuditlogSearchResult)
+
+
+# Method to render a response the way FastAPI's serialize_response does for a response_model.
+def _pydantic_response(content) -> JSONResponse:
+    value, errors = _FIELD.validate(content, {}, loc=("response",))
+    assert not errors
+    return JSONResponse(jsonable_encoder(value))
+
+
+# Best time of a few runs, in ms.
+def _time_ms(function) -> float:
+    runs, seconds = timeit.Timer(function).autorange()
+    return min([seconds] + timeit.repeat(function, number=runs, repeat=3)) / runs * 1000
+
+
+def main():
+    print(f"{'case':<24}{'pydantic ms':>14}{'fast ms':>12}{'speedup':>10}")
+
+    for name, content in CASES.items():
+        # Both paths must render the same JSON for the timings to be comparable.
+        assert json.loads(_pydantic_response(content).body) == json.loads(FastJSONResponse(content).body)
+
+        baseline = _time_ms(partial(_pydantic_response, content))
+        current = _time_ms(partial(FastJSONResponse, content))
+        print(f"{name:<24}{baseline:>14.2f}{current:>12.2f}{baseline / current:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+from typing import Dict, List, Tuple
+
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.audit import router
+
+
+# Unique indexes of the auditlog collections, as (name, fields). Documents missing any of the
+# fields are left out of an index, like the partial event ID index.
+_AUDITLOG_INDEXES = [("entity_version_unique", ("entity_id", "version")), ("event_id_unique", ("event_id",))]
+
+
+def _matches_value(document: Dict, key: str, value) -> bool:
+    if isinstance(value, dict) and "$exists" in value:
+        return (key in document) == value["$exists"]
+    return document.get(key) == value
+
+
+def _matches(document: Dict, criteria: Dict) -> bool:
+    return all(_matches_value(document, key, value) for key, value in criteria.items())
+
+
+# Cursor over the documents of a fake collection, supporting the calls the audit service makes.
+class FakeCursor:
+    def __init__(self, documents: List[Dict]):
+        self.documents = documents
+
+    def sort(self, keys, direction=None):
+        keys = [(keys, direction)] if isinstance(keys, str) else keys
+        for key, direction in reversed(keys):
+            self.documents.sort(key=lambda document: document.get(key) or 0, reverse=direction == -1)
+        return self
+
+    def limit(self, limit: int):
+        self.documents = self.documents[:limit]
+        return self
+
+    def batch_size(self, batch_size: int):
+        return self
+
+    def max_time_ms(self, max_time_ms):
+        return self
+
+    async def to_list(self, length=None):
+        return self.documents[:length] if length else self.documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+    async def close(self):
+        pass
+
+
+# In-memory stand-in for a motor collection, enforcing the unique auditlog indexes.
+class FakeCollection:
+    def __init__(self, database: "FakeDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"audit.{name}"
+        self.documents: List[Dict] = []
+        self.unique_indexes: List[Tuple[str, Tuple[str, ...]]] = []
+
+    def find(self, criteria: Dict, projection=None, session=None, **kwargs):
+        return FakeCursor([document for document in self.documents if _matches(document, criteria)])
+
+    async def find_one(self, criteria: Dict, projection=None, sort=None, max_time_ms=None, session=None):
+        documents = await self.find(criteria).sort(sort or []).to_list(length=1)
+        return documents[0] if documents else None
+
+    async def insert_one(self, document: Dict):
+        self.check_unique(document)
+        self.documents.append(document)
+
+    # Unordered bulk insert, failed documents are reported by their index like Mongo does.
+    async def insert_many(self, documents: List[Dict], ordered: bool = True):
+        errors = []
+        for index, document in enumerate(documents):
+            try:
+                self.check_unique(document, index)
+                self.documents.append(document)
+            except DuplicateKeyError as e:
+                errors.append(e.details)
+
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nInserted": len(documents) - len(errors)})
+
+    def check_unique(self, document: Dict, index: int = 0):
+        for name, fields in self.unique_indexes:
+            if any(document.get(field) is None for field in fields):
+                continue
+
+            key = {field: document[field] for field in fields}
+            if any(_matches(existing, key) for existing in self.documents):
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error index: {name}",
+                    11000,
+                    {"index": index, "code": 11000, "keyPattern": dict.fromkeys(fields, 1), "errmsg": name},
+                )
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(self, name)
+        return self.collections[name]
+
+
+# Diff executor that runs the diff inline.
+class InlineExecutor:
+    async def run(self, size, function, *args):
+        return function(*args)
+
+
+@pytest.fixture
+def audit_db(monkeypatch) -> FakeDatabase:
+    db = FakeDatabase()
+    db["products"].unique_indexes = list(_AUDITLOG_INDEXES)
+
+    monkeypatch.setattr(router.AppConfig, "GROUP_COMMIT_ENABLED", False)
+    monkeypatch.setattr(router.AppConfig, "AUDIT_STORAGE_MODE", "full")
+    monkeypatch.setattr(router, "get_diff_executor", lambda: InlineExecutor())
+    monkeypatch.setattr(router, "validate_collection", lambda collection: collection == "products")
+
+    # Rollups are covered by test_rollups, here they are left out.
+    async def schedule_rollup_update(db, auditlog):
+        pass
+
+    monkeypatch.setattr(router, "schedule_rollup_update", schedule_rollup_update)
+    return db
@@ -0,0 +1,199 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+from bson.objectid import ObjectId
+from fastapi import HTTPException
+
+from app.audit import archive
+from app.audit.archive import merge_log_streams, merge_logs, needs_archive, query_archive, write_archive
+from app.audit.config import AppConfig
+from app.audit.models import AuditlogFilter, AuditlogSearchRequest
+from app.audit.router import search_auditlogs
+
+
+START = datetime(2024, 5, 1, tzinfo=pytz.utc)
+WATERMARK = START + timedelta(days=2)
+ENTITY_ID, USER_ID = ObjectId(), ObjectId()
+
+
+@pytest.fixture(autouse=True)
+def archive_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive.AppConfig, "ARCHIVE_PATH", str(tmp_path))
+    monkeypatch.setattr(archive, "_manifests", {})
+    return tmp_path
+
+
+def _log(executed_at: datetime, **fields):
+    return {
+        "_id": ObjectId.from_datetime(executed_at),
+        "collection": "products",
+        "entity_id": ENTITY_ID,
+        "operation_type": "update",
+        "executed_at": executed_at,
+        "executed_by": USER_ID,
+        "version": 1,
+        "event_id": None,
+        "document": {"_id": ENTITY_ID, "price": 1},
+        "changes": {"price": {"new_value": 1, "old_value": 0}},
+        "changed_fields": ["price"],
+        "warnings": [],
+        "created_at": executed_at,
+        **fields,
+    }
+
+
+# Six hourly logs a day over the two days before the watermark, oldest first.
+@pytest.fixture
+def logs():
+    logs = [_log(START + timedelta(days=day, hours=hour)) for day in range(2) for hour in range(0, 12, 2)]
+    logs[1]["changed_fields"] = ["name"]
+    write_archive("products", logs, WATERMARK)
+    return logs
+
+
+def _filter(**fields) -> AuditlogFilter:
+    return AuditlogFilter(collection="products", entity_id=str(ENTITY_ID), **fields)
+
+
+def test_nothing_archived_needs_no_archive():
+    assert not needs_archive("products", START, include_archive=True)
+
+
+@pytest.mark.parametrize(
+    "start_date, include_archive, expected",
+    [
+        (None, False, False),
+        (None, True, True),
+        (WATERMARK, False, False),
+        (WATERMARK + timedelta(days=1), True, True),
+        (WATERMARK - timedelta(milliseconds=1), False, True),
+        # Naive datetimes are UTC.
+        (WATERMARK.replace(tzinfo=None), False, False),
+        (WATERMARK.replace(tzinfo=None) - timedelta(seconds=1), False, True),
+        # Aware datetimes are compared as instants, whatever their timezone.
+        (WATERMARK.astimezone(pytz.timezone("America/New_York")), False, False),
+    ],
+)
+def test_needs_archive_before_the_watermark_or_if_asked(logs, start_date, include_archive, expected):
+    assert needs_archive("products", start_date, include_archive) is expected
+
+
+def test_query_archive_pages_across_partitions(logs):
+    page, count = query_archive(_filter(), limit=8, descending=True)
+
+    assert count == len(logs)
+    assert [log["_id"] for log in page] == [log["_id"] for log in reversed(logs)][:8]
+    assert page[0] == logs[-1]
+
+
+def test_query_archive_in_ascending_order(logs):
+    page, count = query_archive(_filter(), limit=3, descending=False)
+
+    assert count == len(logs)
+    assert page == logs[:3]
+
+
+def test_query_archive_skips_hot_logs(logs):
+    hot_ids = {str(logs[-1]["_id"]), str(logs[0]["_id"])}
+
+    page, count = query_archive(_filter(), limit=100, descending=True, exclude_ids=hot_ids)
+
+    assert count == len(logs) - 2
+    assert {str(log["_id"]) for log in page}.isdisjoint(hot_ids)
+
+
+def test_query_archive_filters(logs):
+    page, count = query_archive(_filter(changed_field="name"), limit=100, descending=True)
+    assert (page, count) == ([logs[1]], 1)
+
+    page, count = query_archive(_filter(start_date=START + timedelta(days=1, hours=5)), limit=100, descending=False)
+    assert (page, count) == (logs[9:], 3)
+
+
+def test_query_archive_reads_only_projected_columns(logs):
+    page, _ = query_archive(_filter(), limit=2, descending=True, projection={"entity_id": 1, "executed_at": 1})
+
+    assert page == [
+        {
+            "_id": log["_id"],
+            "collection": "products",
+            "entity_id": ENTITY_ID,
+            "executed_at": log["executed_at"],
+            "changed_fields": log["changed_fields"],
+        }
+        for log in reversed(logs[-2:])
+    ]
+
+
+def _at(hour: int, name: str):
+    return {"_id": name, "executed_at": START + timedelta(hours=hour)}
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_merge_logs_interleaves_tiers_in_order(descending):
+    hot = [_at(1, "a"), _at(4, "d"), _at(5, "e")]
+    cold = [_at(2, "b"), _at(3, "c"), _at(6, "f")]
+    if descending:
+        hot, cold = hot[::-1], cold[::-1]
+
+    names = [log["_id"] for log in merge_logs(hot, cold, descending)]
+
+    assert names == (list("fedcba") if descending else list("abcdef"))
+
+
+def test_merge_logs_keeps_logs_in_both_tiers_once():
+    merged = merge_logs([_at(1, "a"), _at(2, "b")], [_at(2, "b"), _at(3, "c")], descending=False)
+
+    assert [log["_id"] for log in merged] == ["a", "b", "c"]
+
+
+async def _stream(logs):
+    for log in logs:
+        yield log
+
+
+async def _merge_streams(hot, cold, descending):
+    return [log["_id"] async for log in merge_log_streams(_stream(hot), _stream(cold), descending)]
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_merge_log_streams_interleaves_tiers_in_order(descending):
+    hot = [_at(1, "a"), _at(4, "d"), _at(5, "e"), _at(7, "g")]
+    cold = [_at(2, "b"), _at(3, "c"), _at(6, "f")]
+    if descending:
+        hot, cold = hot[::-1], cold[::-1]
+
+    names = asyncio.run(_merge_streams(hot, cold, descending))
+
+    assert names == (list("gfedcba") if descending else list("abcdefg"))
+
+
+def test_merge_log_streams_keeps_logs_in_both_tiers_once():
+    hot = [_at(1, "a"), _at(2, "b"), _at(2, "c"), _at(3, "d")]
+    cold = [_at(2, "c"), _at(2, "b"), _at(3, "e")]
+
+    names = asyncio.run(_merge_streams(hot, cold, descending=False))
+
+    assert names == ["a", "b", "c", "d", "e"]
+
+
+def test_merge_log_streams_with_an_empty_tier():
+    assert asyncio.run(_merge_streams([], [_at(1, "a")], descending=False)) == ["a"]
+    assert asyncio.run(_merge_streams([_at(1, "a")], [], descending=True)) == ["a"]
+
+
+def test_deep_pages_including_the_archive_are_refused(logs, audit_db):
+    request = AuditlogSearchRequest(
+        collection="products",
+        entity_id=str(ENTITY_ID),
+        include_archive=True,
+        offset=AppConfig.ARCHIVE_MAX_SEARCH_OFFSET + 1,
+    )
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(search_auditlogs(http_request=None, request=request, db=audit_db, session=None))
+
+    assert e.value.status_code == 400
+    assert "offset" in e.value.detail
@@ -0,0 +1,169 @@
+import asyncio
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import pytest
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+from app.audit import compaction
+from app.audit.compaction import compact_entity, plan_entity
+from app.audit.diff import apply_changes, diff_documents
+from app.audit.utils import get_current_datetime
+
+from tests.conftest import InlineExecutor
+
+
+NOW = get_current_datetime()
+WINDOW = timedelta(minutes=10)
+ENTITY_ID, ALICE, BOB = ObjectId(), ObjectId(), ObjectId()
+
+
+# Method to build the version chain of an entity, one log per (minutes ago, user) step. Every
+# step sets the price to its version, only the versions listed in snapshots keep the document.
+def _chain(steps: List[tuple], snapshots=(1,)) -> List[Dict]:
+    logs, state = [], {}
+    for version, (minutes_ago, user) in enumerate(steps, start=1):
+        new_state = {"_id": ENTITY_ID, "price": version}
+        changes = diff_documents(new_state, state) if version > 1 else None
+        logs.append({
+            "_id": ObjectId(),
+            "collection": "products",
+            "entity_id": ENTITY_ID,
+            "operation_type": "insert" if version == 1 else "update",
+            "executed_at": NOW - timedelta(minutes=minutes_ago),
+            "executed_by": user,
+            "version": version,
+            "event_id": f"event-{version}",
+            "document": new_state if version in snapshots else None,
+            "changes": changes.changes if changes else None,
+            "changed_fields": changes.changed_fields if changes else [],
+        })
+        state = new_state
+    return logs
+
+
+def _ids(logs: List[Dict]) -> List[ObjectId]:
+    return [log["_id"] for log in logs]
+
+
+def _plan(logs, cutoff_minutes_ago: Optional[int] = None, window: Optional[timedelta] = WINDOW):
+    cutoff = NOW - timedelta(minutes=cutoff_minutes_ago) if cutoff_minutes_ago is not None else None
+    return plan_entity(logs, cutoff, window)
+
+
+def test_chains_without_a_snapshot_are_skipped():
+    assert _plan(_chain([(60, ALICE), (50, BOB)], snapshots=())) is None
+
+
+def test_nothing_to_compact():
+    plan = _plan(_chain([(600, ALICE), (500, BOB), (400, ALICE)]), cutoff_minutes_ago=1000)
+
+    assert plan == ([], [], [], [], [])
+
+
+def test_expired_logs_are_a_prefix_of_the_chain():
+    logs = _chain([(600, ALICE), (500, BOB), (400, ALICE), (300, BOB)], snapshots=(1, 2, 3, 4))
+
+    plan = _plan(logs, cutoff_minutes_ago=450)
+
+    assert plan.expired == logs[:2]
+    assert plan.updates == []
+
+
+def test_the_latest_log_is_never_expired():
+    logs = _chain([(600, ALICE), (500, BOB)], snapshots=(1, 2))
+
+    plan = _plan(logs, cutoff_minutes_ago=0)
+
+    assert plan.expired == logs[:1]
+
+
+def test_the_earliest_remaining_delta_is_rebased_into_a_snapshot():
+    logs = _chain([(600, ALICE), (500, BOB), (400, ALICE), (300, BOB)])
+
+    plan = _plan(logs, cutoff_minutes_ago=450)
+
+    assert plan.expired == logs[:2]
+    assert plan.updates == [UpdateOne({"_id": logs[2]["_id"]}, {"$set": {"document": {"_id": ENTITY_ID, "price": 3}}})]
+    assert plan.rewritten == [logs[2]["_id"]]
+
+
+def test_runs_of_updates_by_one_user_are_merged_into_their_last_log():
+    logs = _chain([(600, ALICE), (100, BOB), (98, BOB), (95, BOB), (50, ALICE)])
+
+    plan = _plan(logs)
+
+    assert plan.merged == _ids(logs[1:3])
+    assert plan.rewritten == [logs[3]["_id"]]
+
+    # The last log of the run now holds every change of the run, and is a snapshot.
+    (update,) = plan.updates
+    fields = update._doc["$set"]
+    assert apply_changes(logs[0]["document"], fields["changes"]) == {"_id": ENTITY_ID, "price": 4}
+    assert fields["changed_fields"] == ["price"]
+    assert fields["document"] == {"_id": ENTITY_ID, "price": 4}
+
+
+def test_merged_events_leave_tombstones_pointing_to_their_log():
+    logs = _chain([(600, ALICE), (100, BOB), (98, BOB), (95, BOB), (50, ALICE)])
+    logs[2]["event_id"] = None
+
+    plan = _plan(logs)
+
+    assert plan.tombstones == [{
+        "_id": "event-2",
+        "collection": "products",
+        "entity_id": ENTITY_ID,
+        "auditlog_id": logs[3]["_id"],
+        "created_at": plan.tombstones[0]["created_at"],
+    }]
+
+
+@pytest.mark.parametrize(
+    "steps",
+    [
+        # Another user in between.
+        [(600, ALICE), (100, BOB), (98, ALICE), (95, BOB)],
+        # Too far apart.
+        [(600, ALICE), (100, BOB), (80, BOB)],
+        # Still within the window, the run could grow.
+        [(600, ALICE), (8, BOB), (5, BOB)],
+        # The insert is never merged.
+        [(600, BOB), (599, BOB)],
+    ],
+)
+def test_logs_that_are_not_merged(steps):
+    plan = _plan(_chain(steps, snapshots=range(1, len(steps) + 1)))
+
+    assert plan.merged == []
+    assert plan.updates == []
+
+
+def test_merging_is_disabled_without_a_window():
+    plan = _plan(_chain([(600, ALICE), (100, BOB), (98, BOB)]), window=None)
+
+    assert plan.merged == []
+
+
+def test_expired_logs_are_not_merged():
+    logs = _chain([(600, ALICE), (300, BOB), (298, BOB), (296, BOB), (100, ALICE)], snapshots=(1, 2, 3, 4, 5))
+
+    plan = _plan(logs, cutoff_minutes_ago=299)
+
+    assert plan.expired == logs[:2]
+    assert plan.merged == [logs[2]["_id"]]
+    assert plan.rewritten == [logs[3]["_id"]]
+
+
+def test_compact_entity_plans_the_start_of_long_chains(audit_db, monkeypatch):
+    monkeypatch.setattr(compaction, "get_diff_executor", lambda: InlineExecutor())
+    monkeypatch.setattr(compaction.AppConfig, "COMPACTION_MAX_ENTITY_LOGS", 3)
+
+    logs = _chain([(600, ALICE), (500, BOB), (400, ALICE), (300, BOB), (200, ALICE)], snapshots=(1, 2, 3, 4, 5))
+    audit_db["products"].documents.extend(reversed(logs))
+
+    plan = asyncio.run(compact_entity(audit_db["products"], ENTITY_ID, NOW, WINDOW))
+
+    # Only the first three logs are read, the third is kept as if it were the latest.
+    assert plan.expired == logs[:2]
@@ -0,0 +1,176 @@
+import json
+from datetime import datetime, timezone
+
+import jsondiff
+import pytest
+from bson.objectid import ObjectId
+
+from app.audit.diff import apply_changes, diff_documents
+
+
+OLD = {
+    "name": "Desk",
+    "price": 349.99,
+    "in_stock": True,
+    "rating": 4,
+    "tags": ["new", "office", "discount"],
+    "dimensions": {"width": 120, "depth": 60},
+    "variants": [{"color": "oak", "stock": 4}, {"color": "white", "stock": 0}],
+    "legacy_code": "D-12",
+}
+
+# New versions of OLD, shared by the round trip tests and the jsondiff corpus.
+NEW_VERSIONS = [
+    OLD,
+    {**OLD, "price": 299.99},
+    {**OLD, "discount": 0.1},
+    {key: value for key, value in OLD.items() if key != "legacy_code"},
+    {**OLD, "tags": ["sale", "office"]},
+    {**OLD, "tags": ["featured", "new", "office", "discount", "clearance"]},
+    {**OLD, "tags": list(reversed(OLD["tags"]))},
+    {**OLD, "dimensions": {"width": 140, "depth": 60, "height": 75}},
+    {**OLD, "variants": [{"color": "oak", "stock": 3}, {"color": "black", "stock": 9}, {"color": "white", "stock": 0}]},
+    {**OLD, "variants": OLD["variants"][1:]},
+    {**OLD, "dimensions": [120, 60]},
+    {**OLD, "tags": []},
+    {**OLD, "in_stock": False, "rating": 5, "name": None},
+    {"name": "Chair", "price": 49.99, "tags": ["new"]},
+]
+
+# Changes of type only, which jsondiff does not report as changes.
+TYPE_CHANGES = [
+    {**OLD, "in_stock": 1},
+    {**OLD, "rating": 4.0},
+    {**OLD, "in_stock": 1.0},
+    {**OLD, "variants": [{"color": "oak", "stock": 4.0}, {"color": "white", "stock": False}]},
+    {**OLD, "dimensions": {"width": 120.0, "depth": 60}},
+]
+
+
+# Canonical JSON of a document, which tells 1, 1.0 and true apart unlike ==.
+def _canonical(document) -> str:
+    return json.dumps(document, sort_keys=True)
+
+
+# Top level fields changed according to a symmetric jsondiff.
+def _jsondiff_fields(old, new):
+    raw = jsondiff.diff(old, new, syntax="symmetric")
+
+    # Documents that have little in common are diffed as a whole.
+    if isinstance(raw, list):
+        return {key for key in {*old, *new} if old.get(key, KeyError) != new.get(key, KeyError)}
+
+    fields = {key for key in raw if not isinstance(key, jsondiff.Symbol)}
+    for symbol in (jsondiff.symbols.insert, jsondiff.symbols.delete):
+        fields.update(raw.get(symbol, {}))
+    return fields
+
+
+@pytest.mark.parametrize("new", NEW_VERSIONS + TYPE_CHANGES)
+def test_apply_changes_rebuilds_the_new_document(new):
+    diff = diff_documents(new, OLD)
+
+    assert _canonical(apply_changes(OLD, diff.changes)) == _canonical(new)
+
+
+# Equivalence corpus against jsondiff, the diff engine this one replaced.
+@pytest.mark.parametrize("new", NEW_VERSIONS)
+def test_changed_fields_match_jsondiff(new):
+    diff = diff_documents(new, OLD)
+
+    assert {field.split(".")[0] for field in diff.changed_fields} == _jsondiff_fields(OLD, new)
+    assert bool(diff.changes) == bool(jsondiff.diff(OLD, new, syntax="symmetric"))
+
+
+@pytest.mark.parametrize("new", TYPE_CHANGES)
+def test_changes_of_type_are_changes(new):
+    diff = diff_documents(new, OLD)
+
+    assert diff.changes
+    assert not jsondiff.diff(OLD, new, syntax="symmetric")
+
+
+def test_unchanged_documents_have_no_changes():
+    diff = diff_documents(dict(OLD), OLD)
+
+    assert diff.changes == {}
+    assert diff.changed_fields == []
+
+
+def test_changes_and_changed_fields():
+    new = {**OLD, "price": 299.99, "discount": 0.1, "dimensions": {"width": 140, "depth": 60}}
+    del new["legacy_code"]
+
+    diff = diff_documents(new, OLD)
+
+    assert diff.changes["price"] == {"new_value": 299.99, "old_value": 349.99}
+    assert diff.changes["dimensions"] == {"width": {"new_value": 140, "old_value": 120}}
+    assert diff.changes["inserts"] == [{"index": "discount", "item": 0.1}]
+    assert diff.changes["deletes"] == [{"index": "legacy_code", "item": "D-12"}]
+    assert diff.changed_fields == ["dimensions.width", "discount", "legacy_code", "price"]
+
+
+def test_list_item_paths_leave_out_the_index():
+    new = {**OLD, "variants": [{"color": "oak", "stock": 3}, {"color": "white", "stock": 0}]}
+
+    diff = diff_documents(new, OLD)
+
+    assert diff.changes["variants"] == {"0": {"stock": {"new_value": 3, "old_value": 4}}}
+    assert diff.changed_fields == ["variants.stock"]
+
+
+def test_over_budget_subtrees_are_changed_as_a_whole():
+    new = {**OLD, "dimensions": {"width": 140, "depth": 60}}
+
+    diff = diff_documents(new, OLD, size_budget=0)
+
+    assert diff.changes["dimensions"] == {"new_value": new["dimensions"], "old_value": OLD["dimensions"]}
+    assert apply_changes(OLD, diff.changes) == new
+
+
+def test_json_and_binary_forms_of_a_value_are_equal():
+    entity_id = ObjectId()
+    updated_at = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+
+    diff = diff_documents(
+        {"owner": str(entity_id), "updated_at": "2024-05-01T12:30:00+00:00"},
+        {"owner": entity_id, "updated_at": updated_at},
+    )
+
+    assert diff.changes == {}
+
+
+def test_fields_named_like_list_operations_are_plain_changes():
+    old = {"inserts": 1, "deletes": {"count": 2}}
+    new = {"inserts": 2, "deletes": {"count": 3}}
+
+    diff = diff_documents(new, old)
+
+    assert apply_changes(old, diff.changes) == new
+
+
+@pytest.mark.parametrize(
+    "old, new",
+    [
+        ({"inserts": 1, "deletes": 2, "a": 1}, {"inserts": 2, "deletes": 3, "b": 1}),
+        ({"inserts": {"count": 1}}, {"inserts": {"count": 2}, "deletes": {"count": 0}}),
+        ({"~inserts": 1, "~": 2, "x": 1}, {"~inserts": 2, "~": 3}),
+        ({"meta": {"new_value": 1, "old_value": 2}}, {"meta": {"new_value": 3, "old_value": 4}}),
+        ({"tags": ["a"], "inserts": ["a"]}, {"tags": ["a", "b"], "inserts": ["b", "a"]}),
+    ],
+)
+def test_fields_named_like_change_keys_are_kept_apart(old, new):
+    diff = diff_documents(new, old)
+
+    assert apply_changes(old, diff.changes) == new
+
+
+def test_fields_named_like_list_operations_are_escaped():
+    diff = diff_documents({"inserts": 2, "b": 1}, {"inserts": 1, "a": 1})
+
+    assert diff.changes == {
+        "~inserts": {"new_value": 2, "old_value": 1},
+        "inserts": [{"index": "b", "item": 1}],
+        "deletes": [{"index": "a", "item": 1}],
+    }
+    assert diff.changed_fields == ["a", "b", "inserts"]
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.audit.config import AppConfig
+from app.audit.executor import DiffExecutor
+
+
+@pytest.fixture
+def executor():
+    executor = DiffExecutor()
+    executor._thread_pool, executor._process_pool = "threads", "processes"
+    return executor
+
+
+@pytest.mark.parametrize(
+    "size, pool",
+    [
+        (AppConfig.DIFF_INLINE_THRESHOLD, "threads"),
+        (AppConfig.DIFF_PROCESS_THRESHOLD - 1, "threads"),
+        (AppConfig.DIFF_PROCESS_THRESHOLD, "processes"),
+    ],
+)
+def test_large_documents_are_diffed_in_processes(executor, size, pool):
+    assert executor._select_pool(size) == pool
+
+
+def test_threads_are_used_without_a_process_pool(executor):
+    executor._process_pool = None
+
+    assert executor._select_pool(AppConfig.DIFF_PROCESS_THRESHOLD * 10) == "threads"
+
+
+def _thread_name():
+    return threading.current_thread().name
+
+
+def test_small_documents_are_diffed_inline(monkeypatch):
+    monkeypatch.setattr(AppConfig, "DIFF_PROCESS_WORKERS", 0)
+
+    async def run():
+        executor = DiffExecutor()
+        executor.start()
+        try:
+            return (
+                await executor.run(AppConfig.DIFF_INLINE_THRESHOLD - 1, _thread_name),
+                await executor.run(AppConfig.DIFF_INLINE_THRESHOLD, _thread_name),
+            )
+        finally:
+            executor.shutdown()
+
+    inline, pooled = asyncio.run(run())
+
+    assert inline == "MainThread"
+    assert pooled.startswith("diff")
@@ -0,0 +1,36 @@
+import sys
+import threading
+
+import pytest
+
+from app.audit import metrics
+from app.audit.monitoring import PoolMetricsListener
+
+
+@pytest.fixture
+def switch_often():
+    # Switching threads as often as possible makes unsynchronised updates lose increments.
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_checkouts_from_many_threads_are_all_counted(switch_often):
+    listener = PoolMetricsListener("test")
+
+    def check_out_and_in():
+        for _ in range(20_000):
+            listener.connection_check_out_started(None)
+            listener.connection_checked_out(None)
+            listener.connection_checked_in(None)
+        listener.connection_checked_out(None)
+
+    threads = [threading.Thread(target=check_out_and_in) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert metrics.snapshot()["gauges"]["pool_test_checked_out"] == 8
+    assert metrics.histogram("pool_test_check_out_wait_ms").count == 8 * 20_001
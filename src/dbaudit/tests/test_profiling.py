@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+
+from app.audit.profiling import SamplingProfiler
+
+
+def _profiler_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "profiler"]
+
+
+# Method to wait for stopped sampling threads to exit.
+def _wait_for_threads(count: int, timeout: float = 2.0):
+    deadline = time.monotonic() + timeout
+    while len(_profiler_threads()) != count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return _profiler_threads()
+
+
+@pytest.fixture
+def profiler():
+    profiler = SamplingProfiler()
+    yield profiler
+    profiler.configure(False)
+    _wait_for_threads(0)
+
+
+def test_the_profiler_samples_the_thread_it_was_enabled_from(profiler):
+    profiler.configure(True, interval_ms=1)
+    samples = profiler.begin()
+
+    deadline = time.monotonic() + 2
+    while not samples and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert any("test_profiling.py" in stack for stack in samples)
+
+
+def test_disabled_profilers_stop_sampling(profiler):
+    profiler.configure(True, interval_ms=1)
+    profiler.configure(False)
+
+    assert profiler.begin() is None
+    assert _wait_for_threads(0) == []
+
+
+def test_disabled_profilers_stop_without_waiting_for_the_interval(profiler):
+    profiler.configure(True, interval_ms=60_000)
+    profiler.configure(False)
+
+    assert _wait_for_threads(0, timeout=0.5) == []
+
+
+def test_switching_quickly_keeps_exactly_one_thread(profiler):
+    # Switched while sampling threads are starting, sleeping and exiting.
+    for i in range(300):
+        profiler.configure(True, interval_ms=1)
+        time.sleep(i % 3 / 1000)
+        profiler.configure(False)
+        time.sleep(i % 2 / 1000)
+    profiler.configure(True)
+
+    assert _wait_for_threads(1) == [profiler._thread]
+
+    profiler.configure(True)
+    assert _profiler_threads() == [profiler._thread]
@@ -0,0 +1,28 @@
+import json
+from datetime import datetime
+
+import pytz
+from bson.objectid import ObjectId
+
+from app.audit.responses import FastJSONResponse
+
+
+def test_renders_db_documents():
+    auditlog_id = ObjectId()
+    executed_at = datetime(2024, 5, 1, 12, 30, 15, 123000, tzinfo=pytz.utc)
+
+    response = FastJSONResponse({"_id": auditlog_id, "executed_at": executed_at, "name": "Bureau à café"})
+
+    assert response.media_type == "application/json"
+    assert response.headers["content-type"] == "application/json"
+    assert response.body == (
+        f'{{"_id":"{auditlog_id}","executed_at":"2024-05-01T12:30:15.123000+00:00","name":"Bureau à café"}}'
+    ).encode("utf-8")
+
+
+def test_renders_lists_of_documents():
+    ids = [ObjectId(), ObjectId()]
+
+    response = FastJSONResponse([{"_id": ids[0], "changes": None}, {"_id": ids[1], "changes": {"inserts": []}}])
+
+    assert json.loads(response.body) == [{"_id": str(ids[0]), "changes": None}, {"_id": str(ids[1]), "changes": {"inserts": []}}]
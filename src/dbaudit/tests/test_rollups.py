@@ -0,0 +1,113 @@
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import pytz
+from pymongo import UpdateOne
+
+from app.audit.config import AppConfig
+from app.audit.rollups import CHANGES_KEY, backfill_rollups, rollup_updates, update_rollups
+
+
+# Collections of a fake motor DB, created on first use.
+def _fake_db():
+    def collection():
+        mock = MagicMock()
+        mock.bulk_write = AsyncMock()
+        mock.delete_many = AsyncMock()
+        mock.aggregate.return_value.to_list = AsyncMock(return_value=[])
+        return mock
+
+    collections = defaultdict(collection)
+    db = MagicMock()
+    db.__getitem__.side_effect = collections.__getitem__
+    return db, collections
+
+
+def _auditlog(executed_at: datetime):
+    return {
+        "_id": "log",
+        "collection": "products",
+        "entity_id": "entity",
+        "executed_by": "user",
+        "operation_type": "UPDATE",
+        "executed_at": executed_at,
+    }
+
+
+def test_rollup_updates_bucket_in_utc():
+    # 00:30 in UTC+2 is still the previous day in UTC.
+    executed_at = datetime(2024, 5, 2, 0, 30, tzinfo=timezone(timedelta(hours=2)))
+
+    updates = rollup_updates(_auditlog(executed_at))
+
+    hour, day = datetime(2024, 5, 1, 22, tzinfo=pytz.utc), datetime(2024, 5, 1, tzinfo=pytz.utc)
+    assert updates == [
+        UpdateOne(
+            {"kind": "changes", "collection": "products", "bucket": hour, "key": CHANGES_KEY},
+            {"$inc": {"count": 1, "operations.UPDATE": 1}},
+            upsert=True,
+        ),
+        UpdateOne(
+            {"kind": "editors", "collection": "products", "bucket": day, "key": "user"},
+            {"$inc": {"count": 1}},
+            upsert=True,
+        ),
+        UpdateOne(
+            {"kind": "entities", "collection": "products", "bucket": day, "key": "entity"},
+            {"$inc": {"count": 1}},
+            upsert=True,
+        ),
+    ]
+
+
+def test_rollup_keys_are_never_null():
+    for update in rollup_updates(_auditlog(datetime(2024, 5, 1, 12, 30))):
+        assert update._filter["key"] is not None
+
+
+def test_update_rollups_is_a_single_unordered_bulk_write():
+    db, collections = _fake_db()
+    auditlog = _auditlog(datetime(2024, 5, 1, 12, 30, tzinfo=pytz.utc))
+
+    asyncio.run(update_rollups(db, auditlog))
+
+    collections[AppConfig.ROLLUP_COLLECTION].bulk_write.assert_awaited_once_with(rollup_updates(auditlog), ordered=False)
+
+
+def test_update_rollups_failures_do_not_fail_the_auditlog(caplog):
+    db, collections = _fake_db()
+    collections[AppConfig.ROLLUP_COLLECTION].bulk_write.side_effect = RuntimeError("DB down")
+
+    asyncio.run(update_rollups(db, _auditlog(datetime(2024, 5, 1, 12, 30))))
+
+    assert "Failed to update rollups for auditlog log" in caplog.text
+
+
+def test_backfill_rollups_merges_on_non_null_keys():
+    db, collections = _fake_db()
+
+    asyncio.run(backfill_rollups(db, "products"))
+
+    collections[AppConfig.ROLLUP_COLLECTION].delete_many.assert_awaited_once_with({"collection": "products"})
+
+    pipelines = [call.args[0] for call in collections["products"].aggregate.call_args_list]
+    assert len(pipelines) == 3
+
+    for pipeline in pipelines:
+        merge = pipeline[-1]["$merge"]
+        assert merge["into"] == AppConfig.ROLLUP_COLLECTION
+        assert merge["on"] == ["kind", "collection", "bucket", "key"]
+
+        # Every $merge key is projected, none of them as a bare (non literal) null.
+        project = pipeline[-2]["$project"]
+        for field in merge["on"]:
+            assert project[field] is not None
+
+    assert pipelines[0][-2]["$project"]["key"] == {"$literal": CHANGES_KEY}
+    assert [pipeline[-2]["$project"]["kind"] for pipeline in pipelines] == [
+        {"$literal": "changes"},
+        {"$literal": "editors"},
+        {"$literal": "entities"},
+    ]
@@ -0,0 +1,179 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from fastapi import HTTPException
+
+from app.audit import metrics
+from app.audit.config import AppConfig
+from app.audit.models import AuditlogCreateRequest
+from app.audit.router import create_auditlog, record_change
+
+
+ENTITY_ID, USER_ID = ObjectId(), ObjectId()
+
+
+def _request(event_id=None, **fields) -> AuditlogCreateRequest:
+    document = {
+        "_id": str(ENTITY_ID),
+        "name": "Desk",
+        "price": 349.99,
+        "last_updated_at": "2024-05-01T12:30:00",
+        "last_updated_by": str(USER_ID),
+        **fields,
+    }
+    return AuditlogCreateRequest(collection="products", document=document, event_id=event_id)
+
+
+def _record(db, request: AuditlogCreateRequest):
+    return asyncio.run(record_change(db["products"], request, 0))
+
+
+def test_first_change_is_an_insert(audit_db):
+    auditlog = _record(audit_db, _request())
+
+    assert auditlog["operation_type"] == "insert"
+    assert auditlog["version"] == 1
+    assert auditlog["changes"] is None
+
+
+def test_changes_are_updates(audit_db):
+    _record(audit_db, _request())
+    auditlog = _record(audit_db, _request(price=299.99))
+
+    assert auditlog["operation_type"] == "update"
+    assert auditlog["version"] == 2
+    assert auditlog["changed_fields"] == ["price"]
+    assert auditlog["warnings"] == []
+
+
+def test_changes_without_tracked_differences_are_updates(audit_db):
+    _record(audit_db, _request())
+    auditlog = _record(audit_db, _request())
+
+    assert auditlog["operation_type"] == "update"
+    assert auditlog["changes"] == {}
+
+    # The entity is still live, the next change is not flagged as following a delete.
+    auditlog = _record(audit_db, _request(price=299.99))
+    assert auditlog["warnings"] == []
+
+
+# Request with the headers create_auditlog reads.
+class _HttpRequest:
+    headers = {"content-length": "100"}
+
+
+def _create(db, request: AuditlogCreateRequest) -> dict:
+    response = asyncio.run(create_auditlog(http_request=_HttpRequest(), request=request, db=db))
+    return json.loads(response.body)
+
+
+# Makes the next inserts lose the race for their version to a concurrent change of the entity.
+def _race(db, times: int, **fields):
+    collection = db["products"]
+    insert_one = collection.insert_one
+    races = iter(range(times))
+
+    async def racing_insert_one(auditlog):
+        if next(races, None) is not None:
+            document = _request(**fields).document
+            await insert_one({**auditlog, "_id": ObjectId(), "document": document, "event_id": None})
+        await insert_one(auditlog)
+
+    collection.insert_one = racing_insert_one
+
+
+def test_version_conflicts_are_diffed_again_against_the_winner(audit_db):
+    _record(audit_db, _request())
+    conflicts = metrics.counter("version_conflicts").value
+    _race(audit_db, times=1, price=299.99)
+
+    auditlog = _create(audit_db, _request(price=249.99))
+
+    assert metrics.counter("version_conflicts").value == conflicts + 1
+    assert auditlog["version"] == 3
+    assert auditlog["changes"] == {"price": {"new_value": 249.99, "old_value": 299.99}}
+    assert [log["version"] for log in audit_db["products"].documents] == [1, 2, 3]
+
+
+def test_too_many_version_conflicts_are_answered_with_503(audit_db, monkeypatch):
+    monkeypatch.setattr(AppConfig, "VERSION_CONFLICT_RETRIES", 3)
+    _record(audit_db, _request())
+    _race(audit_db, times=3, price=299.99)
+
+    with pytest.raises(HTTPException) as e:
+        _create(audit_db, _request(price=249.99))
+
+    assert e.value.status_code == 503
+    assert len(audit_db["products"].documents) == 4
+
+
+def _legacy_log(minutes_ago: int, price: float) -> dict:
+    document = _request(price=price).document
+    return {
+        "_id": ObjectId(),
+        "collection": "products",
+        "entity_id": ENTITY_ID,
+        "operation_type": "update",
+        "executed_at": datetime(2024, 5, 1) - timedelta(minutes=minutes_ago),
+        "executed_by": USER_ID,
+        "document": document,
+        "changes": None,
+        "changed_fields": [],
+        "warnings": [],
+    }
+
+
+def test_legacy_entities_start_a_version_chain(audit_db):
+    audit_db["products"].documents.extend([_legacy_log(10, 349.99), _legacy_log(5, 299.99), _legacy_log(20, 399.99)])
+
+    auditlog = _create(audit_db, _request(price=249.99))
+
+    # Diffed against the latest legacy log, by execution time.
+    assert auditlog["version"] == 1
+    assert auditlog["changes"] == {"price": {"new_value": 249.99, "old_value": 299.99}}
+
+    auditlog = _create(audit_db, _request(price=199.99))
+
+    assert auditlog["version"] == 2
+    assert auditlog["changes"] == {"price": {"new_value": 199.99, "old_value": 249.99}}
+
+
+# Change stream events are identified by their resume token, replays carry the same one.
+def test_replays_of_the_latest_event_return_its_log(audit_db):
+    _record(audit_db, _request(event_id="token-1"))
+    original = _create(audit_db, _request(event_id="token-2", price=299.99))
+
+    replayed = _create(audit_db, _request(event_id="token-2", price=299.99))
+
+    assert replayed == original
+    assert len(audit_db["products"].documents) == 2
+
+
+def test_replays_of_older_events_return_their_log(audit_db):
+    original = _create(audit_db, _request(event_id="token-1"))
+    _record(audit_db, _request(event_id="token-2", price=299.99))
+    replays = metrics.counter("replayed_events").value
+
+    # Caught by the unique event ID index, as the event is no longer the latest of the entity.
+    replayed = _create(audit_db, _request(event_id="token-1"))
+
+    assert replayed == original
+    assert metrics.counter("replayed_events").value == replays + 1
+    assert [log["event_id"] for log in audit_db["products"].documents] == ["token-1", "token-2"]
+
+
+def test_replays_of_merged_events_return_the_log_they_were_merged_into(audit_db):
+    _record(audit_db, _request(event_id="token-1"))
+    merged_into = _record(audit_db, _request(event_id="token-3", price=299.99))
+    audit_db[AppConfig.COMPACTION_TOMBSTONE_COLLECTION].documents.append(
+        {"_id": "token-2", "collection": "products", "entity_id": ENTITY_ID, "auditlog_id": merged_into["_id"]}
+    )
+
+    replayed = _create(audit_db, _request(event_id="token-2", price=249.99))
+
+    assert replayed["id"] == str(merged_into["_id"])
+    assert len(audit_db["products"].documents) == 2
@@ -0,0 +1,141 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, WriteError
+
+from app.audit.config import AppConfig
+from app.audit.writer import GroupCommitWriter
+
+from tests.conftest import FakeDatabase
+
+
+@pytest.fixture
+def db(monkeypatch) -> FakeDatabase:
+    monkeypatch.setattr(AppConfig, "GROUP_COMMIT_MAX_DOCS", 100)
+    monkeypatch.setattr(AppConfig, "GROUP_COMMIT_MAX_DELAY_MS", 5)
+
+    db = FakeDatabase()
+    db["products"].unique_indexes = [("event_id_unique", ("event_id",))]
+    return db
+
+
+def _spy(collection):
+    collection.insert_many = AsyncMock(side_effect=collection.insert_many)
+    return collection.insert_many
+
+
+# Method to insert documents concurrently, returning what each caller got back.
+async def _insert_all(writer: GroupCommitWriter, collection, documents):
+    return await asyncio.gather(
+        *(writer.insert(collection, document) for document in documents),
+        return_exceptions=True,
+    )
+
+
+def test_concurrent_inserts_are_written_together_in_order(db):
+    insert_many = _spy(db["products"])
+    documents = [{"event_id": f"event-{i}"} for i in range(5)]
+
+    results = asyncio.run(_insert_all(GroupCommitWriter(), db["products"], documents))
+
+    assert results == [None] * 5
+    insert_many.assert_awaited_once_with(documents, ordered=False)
+    assert db["products"].documents == documents
+
+
+def test_full_buffers_are_flushed_right_away(db, monkeypatch):
+    monkeypatch.setattr(AppConfig, "GROUP_COMMIT_MAX_DOCS", 2)
+    insert_many = _spy(db["products"])
+    documents = [{"event_id": f"event-{i}"} for i in range(5)]
+
+    asyncio.run(_insert_all(GroupCommitWriter(), db["products"], documents))
+
+    assert [call.args[0] for call in insert_many.await_args_list] == [documents[:2], documents[2:4], documents[4:]]
+
+
+def test_collections_are_written_separately(db):
+    products, orders = _spy(db["products"]), _spy(db["orders"])
+
+    async def insert():
+        writer = GroupCommitWriter()
+        await asyncio.gather(
+            writer.insert(db["products"], {"event_id": "a"}),
+            writer.insert(db["orders"], {"event_id": "b"}),
+            writer.insert(db["products"], {"event_id": "c"}),
+        )
+
+    asyncio.run(insert())
+
+    products.assert_awaited_once_with([{"event_id": "a"}, {"event_id": "c"}], ordered=False)
+    orders.assert_awaited_once_with([{"event_id": "b"}], ordered=False)
+
+
+def test_write_errors_fail_only_their_own_caller(db):
+    db["products"].documents.append({"event_id": "event-1"})
+    documents = [{"event_id": "event-0"}, {"event_id": "event-1"}, {"event_id": "event-2"}, {"event_id": "event-2"}]
+
+    results = asyncio.run(_insert_all(GroupCommitWriter(), db["products"], documents))
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], DuplicateKeyError) and isinstance(results[3], DuplicateKeyError)
+    assert results[1].details["index"] == 1 and results[3].details["index"] == 3
+    assert db["products"].documents == [{"event_id": "event-1"}, documents[0], documents[2]]
+
+
+def test_other_write_errors_keep_their_type(db):
+    db["products"].insert_many = AsyncMock(side_effect=BulkWriteError({
+        "writeErrors": [{"index": 1, "code": 121, "errmsg": "Document failed validation"}],
+        "writeConcernErrors": [],
+    }))
+
+    results = asyncio.run(_insert_all(GroupCommitWriter(), db["products"], [{"a": 1}, {"a": 2}]))
+
+    assert results[0] is None
+    assert type(results[1]) is WriteError and results[1].code == 121
+
+
+def test_write_concern_errors_fail_every_caller(db):
+    db["products"].insert_many = AsyncMock(side_effect=BulkWriteError({
+        "writeErrors": [],
+        "writeConcernErrors": [{"code": 64, "errmsg": "waiting for replication timed out"}],
+    }))
+
+    results = asyncio.run(_insert_all(GroupCommitWriter(), db["products"], [{"a": 1}, {"a": 2}]))
+
+    assert all(isinstance(result, BulkWriteError) for result in results)
+
+
+def test_failed_flushes_fail_every_caller(db):
+    db["products"].insert_many = AsyncMock(side_effect=OperationFailure("not primary", 10107))
+
+    results = asyncio.run(_insert_all(GroupCommitWriter(), db["products"], [{"a": 1}, {"a": 2}]))
+
+    assert all(isinstance(result, OperationFailure) for result in results)
+
+
+def test_callers_that_went_away_do_not_fail_the_batch(db):
+    async def insert():
+        writer = GroupCommitWriter()
+        gone = asyncio.create_task(writer.insert(db["products"], {"event_id": "a"}))
+        staying = asyncio.create_task(writer.insert(db["products"], {"event_id": "b"}))
+        await asyncio.sleep(0)
+        gone.cancel()
+        return await staying
+
+    assert asyncio.run(insert()) is None
+    assert db["products"].documents == [{"event_id": "a"}, {"event_id": "b"}]
+
+
+def test_close_flushes_what_is_buffered(db, monkeypatch):
+    monkeypatch.setattr(AppConfig, "GROUP_COMMIT_MAX_DELAY_MS", 60_000)
+
+    async def insert():
+        writer = GroupCommitWriter()
+        pending = asyncio.create_task(writer.insert(db["products"], {"event_id": "a"}))
+        await asyncio.sleep(0)
+        await writer.close()
+        return await pending
+
+    assert asyncio.run(insert()) is None
+    assert db["products"].documents == [{"event_id": "a"}]
@@ -0,0 +1,40 @@
+import os
+
+
+class AppConfig:
+    # Topic subscriptions, in a file mirroring the subscriptions of infra/components/eventgrid-domain.bicep.
+    SUBSCRIPTIONS_FILE = os.environ.get(
+        "SUBSCRIPTIONS_FILE",
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), "subscriptions.json"),
+    )
+
+    # Publishers authenticate with the aeg-sas-key header, any key is accepted if ACCESS_KEY is not set.
+    ACCESS_KEY = os.environ.get("ACCESS_KEY")
+
+    # Publish requests are limited to 1 MB, like Event Grid.
+    MAX_REQUEST_BYTES = int(os.environ.get("MAX_REQUEST_BYTES", 1024 * 1024))
+
+    # Dead-lettered events and storage queue destinations are written to this directory, in a folder
+    # named after the blob container or the queue.
+    STORAGE_PATH = os.environ.get("STORAGE_PATH", "./storage")
+
+    # Batches are sent once maxEventsPerBatch or preferredBatchSizeInKilobytes of the subscription is
+    # reached, or BATCH_WINDOW_MS after their first event. Up to MAX_CONCURRENT_DELIVERIES batches are
+    # in flight per subscription.
+    BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", 50))
+    MAX_CONCURRENT_DELIVERIES = int(os.environ.get("MAX_CONCURRENT_DELIVERIES", 10))
+    DELIVERY_TIMEOUT_SECONDS = float(os.environ.get("DELIVERY_TIMEOUT_SECONDS", 30))
+
+    # Failed batches are retried with exponential backoff, or after the Retry-After delay of the endpoint,
+    # within the retryPolicy of the subscription. Event Grid starts at 10 seconds, which is too slow locally.
+    RETRY_INITIAL_DELAY_SECONDS = float(os.environ.get("RETRY_INITIAL_DELAY_SECONDS", 1))
+    RETRY_MAX_DELAY_SECONDS = float(os.environ.get("RETRY_MAX_DELAY_SECONDS", 60))
+
+    # Faults injected before every delivery attempt, unless a subscription overrides them in its
+    # "emulator" section. Injected failures are retried like any other failure.
+    INJECT_LATENCY_MS = float(os.environ.get("INJECT_LATENCY_MS", 0))
+    INJECT_LATENCY_JITTER_MS = float(os.environ.get("INJECT_LATENCY_JITTER_MS", 0))
+    INJECT_FAILURE_RATE = float(os.environ.get("INJECT_FAILURE_RATE", 0))
+
+    # Time given to pending deliveries at shutdown.
+    SHUTDOWN_DRAIN_SECONDS = float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", 10))
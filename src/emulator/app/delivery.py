@@ -0,0 +1,336 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import httpx
+
+from app import metrics
+from app.config import AppConfig
+from app.subscriptions import STORAGE_QUEUE, Subscription, load_subscriptions
+
+
+logger = logging.getLogger(__name__)
+
+# Webhook responses Event Grid dead-letters right away instead of retrying.
+_NON_RETRIABLE_STATUS_CODES = {400, 401, 403, 413}
+
+# Origin sent in the CloudEvents webhook validation handshake.
+_WEBHOOK_ORIGIN = "eventgrid.azure.net"
+
+
+# An event waiting to be delivered to a subscription.
+class PendingEvent(NamedTuple):
+    event: Dict
+    size: int
+    published_at: float
+    publish_time: datetime
+
+
+# Outcome of one delivery attempt of a batch.
+class Attempt(NamedTuple):
+    delivered: bool
+    retriable: bool
+    outcome: str
+    status_code: Optional[int] = None
+    retry_after: Optional[float] = None
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+# Method to write a JSON document to a new file in a directory, named so files list in time order.
+def _write_file(directory: str, document) -> str:
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex}.json")
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+
+    return path
+
+
+# Batches, delivers, retries and dead-letters the events of one subscription.
+class SubscriptionDispatcher:
+    def __init__(self, subscription: Subscription, client: httpx.AsyncClient):
+        self.subscription = subscription
+        self.client = client
+
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.in_flight = asyncio.Semaphore(AppConfig.MAX_CONCURRENT_DELIVERIES)
+        self.pending = 0
+
+        self._batcher: Optional[asyncio.Task] = None
+        self._deliveries: Set[asyncio.Task] = set()
+
+    def start(self):
+        self._batcher = asyncio.create_task(self._batch())
+
+    async def stop(self):
+        self._batcher.cancel()
+        for task in self._deliveries:
+            task.cancel()
+        await asyncio.gather(self._batcher, *self._deliveries, return_exceptions=True)
+
+    def submit(self, pending: PendingEvent):
+        self.pending += 1
+        self.queue.put_nowait(pending)
+
+    # Method to send the CloudEvents validation handshake, which Event Grid does when a webhook is subscribed.
+    async def handshake(self):
+        if self.subscription.endpoint_type == STORAGE_QUEUE:
+            return
+
+        try:
+            response = await self.client.options(
+                self.subscription.endpoint_url,
+                headers={"WebHook-Request-Origin": _WEBHOOK_ORIGIN},
+                timeout=AppConfig.DELIVERY_TIMEOUT_SECONDS,
+            )
+            allowed = response.headers.get("WebHook-Allowed-Origin")
+            if response.status_code == 200 and allowed in ("*", _WEBHOOK_ORIGIN):
+                return
+            reason = f"status {response.status_code}, allowed origin {allowed}"
+
+        except httpx.HTTPError as e:
+            reason = repr(e)
+
+        # Unlike Event Grid, the subscription is kept, the subscriber may just not be up yet.
+        logger.warning(f"Webhook validation of {self.subscription.name} failed ({reason}), delivering anyway.")
+
+    # Method to group queued events into batches, within the batch limits of the subscription.
+    async def _batch(self):
+        max_bytes = self.subscription.preferred_batch_size_kb * 1024
+
+        while True:
+            first = await self.queue.get()
+            batch, size = [first], first.size
+            deadline = time.monotonic() + AppConfig.BATCH_WINDOW_MS / 1000
+
+            while len(batch) < self.subscription.max_events_per_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+
+                try:
+                    pending = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+                # An event that would push the batch over its preferred size starts the next one.
+                if size + pending.size > max_bytes:
+                    self._spawn(batch)
+                    batch, size = [], 0
+                    deadline = time.monotonic() + AppConfig.BATCH_WINDOW_MS / 1000
+
+                batch.append(pending)
+                size += pending.size
+
+            self._spawn(batch)
+
+    def _spawn(self, batch: List[PendingEvent]):
+        task = asyncio.create_task(self._deliver(batch))
+        self._deliveries.add(task)
+        task.add_done_callback(self._deliveries.discard)
+
+    # Method to deliver a batch until it succeeds, runs out of attempts or expires.
+    async def _deliver(self, batch: List[PendingEvent]):
+        metrics.histogram("batch_size", buckets=[1, 2, 5, 10, 20, 50, 100, 500]).observe(len(batch))
+        expires_at = min(pending.published_at for pending in batch) + self.subscription.event_ttl_minutes * 60
+
+        delivery_count = 0
+        while True:
+            async with self.in_flight:
+                attempt = await self._attempt(batch, delivery_count)
+            delivery_count += 1
+
+            if attempt.delivered:
+                now = time.monotonic()
+                for pending in batch:
+                    metrics.histogram("end_to_end_ms").observe((now - pending.published_at) * 1000)
+                metrics.counter("events_delivered").inc(len(batch))
+                metrics.meter("events_delivered").mark(len(batch))
+                break
+
+            metrics.counter("delivery_failures").inc()
+
+            delay = attempt.retry_after or min(
+                AppConfig.RETRY_INITIAL_DELAY_SECONDS * 2 ** (delivery_count - 1),
+                AppConfig.RETRY_MAX_DELAY_SECONDS,
+            )
+            if (
+                not attempt.retriable
+                or delivery_count >= self.subscription.max_delivery_attempts
+                or time.monotonic() + delay > expires_at
+            ):
+                await self._deadletter(batch, attempt, delivery_count)
+                break
+
+            metrics.counter("events_retried").inc(len(batch))
+            await asyncio.sleep(delay)
+
+        self.pending -= len(batch)
+
+    # Method to make one delivery attempt, after any injected latency or failure.
+    async def _attempt(self, batch: List[PendingEvent], delivery_count: int) -> Attempt:
+        subscription = self.subscription
+
+        latency_ms = subscription.latency_ms + random.uniform(0, subscription.latency_jitter_ms)
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+
+        if subscription.failure_rate and random.random() < subscription.failure_rate:
+            metrics.counter("injected_failures").inc()
+            return Attempt(delivered=False, retriable=True, outcome="InjectedFailure")
+
+        events = [pending.event for pending in batch]
+        start = time.perf_counter()
+        try:
+            if subscription.endpoint_type == STORAGE_QUEUE:
+                directory = os.path.join(AppConfig.STORAGE_PATH, subscription.queue_name)
+                for event in events:
+                    await asyncio.to_thread(_write_file, directory, event)
+                return Attempt(delivered=True, retriable=False, outcome="Delivered")
+
+            response = await self.client.post(
+                subscription.endpoint_url,
+                content=json.dumps(events),
+                headers={
+                    "Content-Type": "application/cloudevents-batch+json; charset=utf-8",
+                    "aeg-subscription-name": subscription.name.upper(),
+                    "aeg-delivery-count": str(delivery_count),
+                },
+                timeout=AppConfig.DELIVERY_TIMEOUT_SECONDS,
+            )
+
+        except httpx.TimeoutException:
+            return Attempt(delivered=False, retriable=True, outcome="TimedOut")
+        except (httpx.HTTPError, OSError) as e:
+            return Attempt(delivered=False, retriable=True, outcome=f"Failed: {e!r}")
+        finally:
+            metrics.histogram("delivery_ms").observe((time.perf_counter() - start) * 1000)
+
+        if 200 <= response.status_code < 300:
+            return Attempt(delivered=True, retriable=False, outcome="Delivered", status_code=response.status_code)
+
+        return Attempt(
+            delivered=False,
+            retriable=response.status_code not in _NON_RETRIABLE_STATUS_CODES,
+            outcome=response.reason_phrase or "Failed",
+            status_code=response.status_code,
+            retry_after=_retry_after(response),
+        )
+
+    # Method to dead-letter a batch into the local blob container of the subscription, if it has one.
+    async def _deadletter(self, batch: List[PendingEvent], attempt: Attempt, delivery_count: int):
+        reason = "MaxDeliveryAttemptsExceeded" if attempt.retriable else "DeliveryFailed"
+
+        if self.subscription.deadletter_container is None:
+            metrics.counter("events_dropped").inc(len(batch))
+            logger.warning(f"Dropped {len(batch)} events of {self.subscription.name}, it has no dead-letter destination.")
+            return
+
+        now = datetime.now(timezone.utc)
+        document = [
+            {
+                **pending.event,
+                "deadletterreason": reason,
+                "deliveryattempts": delivery_count,
+                "lastdeliveryoutcome": attempt.outcome,
+                "lastHttpStatusCode": attempt.status_code,
+                "publishtime": pending.publish_time.isoformat(),
+                "lastdeliveryattempttime": now.isoformat(),
+            }
+            for pending in batch
+        ]
+
+        # Laid out like Event Grid does in blob storage, by topic, subscription and hour.
+        directory = os.path.join(
+            AppConfig.STORAGE_PATH,
+            self.subscription.deadletter_container,
+            self.subscription.topic,
+            self.subscription.name,
+            f"{now:%Y/%m/%d/%H}",
+        )
+        path = await asyncio.to_thread(_write_file, directory, document)
+
+        metrics.counter("events_deadlettered").inc(len(batch))
+        logger.warning(f"Dead-lettered {len(batch)} events of {self.subscription.name} to {path} ({attempt.outcome}).")
+
+
+# Routes published events to the dispatchers of their topic subscriptions.
+class DeliveryService:
+    def __init__(self):
+        self.client: Optional[httpx.AsyncClient] = None
+        self.dispatchers: Dict[str, List[SubscriptionDispatcher]] = {}
+
+        metrics.gauge("pending_events", lambda: sum(
+            dispatcher.pending for dispatchers in self.dispatchers.values() for dispatcher in dispatchers
+        ))
+
+    async def start(self):
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=AppConfig.MAX_CONCURRENT_DELIVERIES)
+        self.client = httpx.AsyncClient(limits=limits)
+
+        for topic, subscriptions in load_subscriptions(AppConfig.SUBSCRIPTIONS_FILE).items():
+            self.dispatchers[topic] = [SubscriptionDispatcher(subscription, self.client) for subscription in subscriptions]
+
+        dispatchers = [dispatcher for dispatchers in self.dispatchers.values() for dispatcher in dispatchers]
+        for dispatcher in dispatchers:
+            dispatcher.start()
+        await asyncio.gather(*(dispatcher.handshake() for dispatcher in dispatchers))
+
+        logger.info(f"Loaded {len(dispatchers)} subscriptions over {len(self.dispatchers)} topics.")
+
+    async def stop(self):
+        dispatchers = [dispatcher for dispatchers in self.dispatchers.values() for dispatcher in dispatchers]
+
+        deadline = time.monotonic() + AppConfig.SHUTDOWN_DRAIN_SECONDS
+        while any(dispatcher.pending for dispatcher in dispatchers) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        for dispatcher in dispatchers:
+            if dispatcher.pending:
+                logger.warning(f"Shutting down with {dispatcher.pending} events of {dispatcher.subscription.name} undelivered.")
+            await dispatcher.stop()
+
+        await self.client.aclose()
+
+    # Method to fan published events out to every subscription of their topic, which is the event source.
+    def publish(self, events: List[Tuple[Dict, int]]):
+        published_at, publish_time = time.monotonic(), datetime.now(timezone.utc)
+
+        for event, size in events:
+            dispatchers = self.dispatchers.get(event["source"])
+            if not dispatchers:
+                metrics.counter("events_unrouted").inc()
+                continue
+
+            for dispatcher in dispatchers:
+                dispatcher.submit(PendingEvent(event, size, published_at, publish_time))
+
+        metrics.counter("events_published").inc(len(events))
+        metrics.meter("events_published").mark(len(events))
+
+
+# Global delivery service of the emulator.
+_delivery: Optional[DeliveryService] = None
+
+
+# Method to reuse the delivery service as a singleton.
+def get_delivery() -> DeliveryService:
+    global _delivery
+
+    if _delivery is None:
+        _delivery = DeliveryService()
+
+    return _delivery
@@ -0,0 +1,32 @@
+from fastapi import FastAPI
+
+from app import metrics
+from app.router import router
+
+
+# Local stand-in for the Event Grid domain defined in infra/components/eventgrid-domain.bicep, for
+# exercising fan-out and delivery end to end without Azure. Point the changestreams publisher at it with
+# EVENT_DOMAIN_ENDPOINT=http://localhost:<port>/api/events and any EVENT_DOMAIN_KEY.
+
+app = FastAPI(
+    title="Event Grid Emulator",
+    description="""**Local Event Grid domain delivering change events to the subscriptions in subscriptions.json.**""",
+    version="1.0.0",
+    contact={
+        "name": "Event-driven architecture demo with Mongo, Changestreams, FastAPI & Azure",
+        "url": "https://github.com/sibie",
+    },
+)
+
+
+app.include_router(router)
+
+
+@app.get("/")
+async def root():
+    return {"message": "Hello! Navigate to /docs to check out the endpoints."}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
@@ -0,0 +1,113 @@
+import bisect
+import time
+from collections import deque
+from typing import Callable, Dict, List
+
+
+# Default histogram bucket upper bounds, in milliseconds.
+_DEFAULT_BUCKETS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+
+# Simple in-process histogram. The service runs on a single event loop per worker,
+# so no locking is needed and every worker exposes its own figures.
+class Histogram:
+    def __init__(self, buckets: List[float] = None):
+        self.buckets = buckets or _DEFAULT_BUCKETS
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def snapshot(self) -> Dict:
+        labels = [f"le_{bucket}" for bucket in self.buckets] + ["le_inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "avg": round(self.sum / self.count, 3) if self.count else 0.0,
+            "max": round(self.max, 3),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+# Monotonic counter.
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def snapshot(self) -> int:
+        return self.value
+
+
+# Throughput over a sliding window, kept as one bucket per second.
+class Meter:
+    def __init__(self, window_seconds: int = 10):
+        self.window_seconds = window_seconds
+        self.buckets: deque = deque()
+
+    def mark(self, amount: int = 1):
+        second = int(time.monotonic())
+        if self.buckets and self.buckets[-1][0] == second:
+            self.buckets[-1][1] += amount
+        else:
+            self.buckets.append([second, amount])
+
+    def snapshot(self) -> float:
+        # The current second is still filling up, so it is left out of the rate.
+        now = int(time.monotonic())
+        while self.buckets and self.buckets[0][0] < now - self.window_seconds:
+            self.buckets.popleft()
+
+        total = sum(amount for second, amount in self.buckets if second < now)
+        return round(total / self.window_seconds, 3)
+
+
+# Registries of metrics by name.
+_histograms: Dict[str, Histogram] = {}
+_counters: Dict[str, Counter] = {}
+_meters: Dict[str, Meter] = {}
+_gauges: Dict[str, Callable[[], float]] = {}
+
+
+# Method to get a histogram by name, creating it on first use.
+def histogram(name: str, buckets: List[float] = None) -> Histogram:
+    if name not in _histograms:
+        _histograms[name] = Histogram(buckets)
+    return _histograms[name]
+
+
+# Method to get a counter by name, creating it on first use.
+def counter(name: str) -> Counter:
+    if name not in _counters:
+        _counters[name] = Counter()
+    return _counters[name]
+
+
+# Method to get a meter by name, creating it on first use.
+def meter(name: str) -> Meter:
+    if name not in _meters:
+        _meters[name] = Meter()
+    return _meters[name]
+
+
+# Method to register a gauge, which is read from the callback whenever metrics are collected.
+def gauge(name: str, callback: Callable[[], float]):
+    _gauges[name] = callback
+
+
+# Method to collect the current value of every registered metric.
+def snapshot() -> Dict:
+    return {
+        "histograms": {name: metric.snapshot() for name, metric in sorted(_histograms.items())},
+        "counters": {name: metric.snapshot() for name, metric in sorted(_counters.items())},
+        "gauges": {name: callback() for name, callback in sorted(_gauges.items())},
+        "per_second": {name: metric.snapshot() for name, metric in sorted(_meters.items())},
+    }
@@ -0,0 +1,60 @@
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Header, Request
+from fastapi.responses import JSONResponse, Response
+
+from app.config import AppConfig
+from app.delivery import get_delivery
+
+
+router = APIRouter(prefix="/api", tags=["events"])
+
+# Attributes every CloudEvent must have.
+_REQUIRED_ATTRIBUTES = ("id", "source", "specversion", "type")
+
+
+# Startup event to load the subscriptions and start delivering.
+@router.on_event("startup")
+async def startup():
+    await get_delivery().start()
+
+
+# Shutdown event to give pending deliveries a chance to complete.
+@router.on_event("shutdown")
+async def shutdown():
+    await get_delivery().stop()
+
+
+def error(status_code: int, code: str, message: str) -> JSONResponse:
+    return JSONResponse(status_code=status_code, content={"error": {"code": code, "message": message}})
+
+
+# Publish endpoint of an Event Grid domain with the CloudEvents v1.0 input schema, as called by
+# publisher.publish_event. The topic of every event is its source, like in Event Grid domains.
+@router.post("/events")
+async def publish_events(request: Request, aeg_sas_key: Optional[str] = Header(None)):
+    if AppConfig.ACCESS_KEY and aeg_sas_key != AppConfig.ACCESS_KEY:
+        return error(401, "Unauthorized", "The aeg-sas-key header is missing or invalid.")
+
+    body = await request.body()
+    if len(body) > AppConfig.MAX_REQUEST_BYTES:
+        return error(413, "RequestEntityTooLarge", f"The request is larger than {AppConfig.MAX_REQUEST_BYTES} bytes.")
+
+    try:
+        events = json.loads(body)
+    except ValueError:
+        return error(400, "BadRequest", "The request body is not valid JSON.")
+
+    if isinstance(events, dict):
+        events = [events]
+
+    # Either the whole request is accepted or none of it is.
+    for event in events:
+        if not isinstance(event, dict) or any(attribute not in event for attribute in _REQUIRED_ATTRIBUTES):
+            return error(400, "BadRequest", f"Every event needs the {', '.join(_REQUIRED_ATTRIBUTES)} attributes.")
+        if event["specversion"] != "1.0":
+            return error(400, "BadRequest", f"Unsupported specversion {event['specversion']}.")
+
+    get_delivery().publish([(event, len(json.dumps(event))) for event in events])
+    return Response(status_code=200)
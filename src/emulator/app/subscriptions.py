@@ -0,0 +1,79 @@
+import json
+from typing import Dict, List, NamedTuple, Optional
+
+from app.config import AppConfig
+
+
+# Destination types supported by the emulator. Storage queues are emulated with a local directory.
+WEBHOOK = "WebHook"
+STORAGE_QUEUE = "StorageQueue"
+
+
+# Exception raised when the subscriptions file describes something the emulator cannot deliver to.
+class InvalidSubscriptionException(Exception):
+    pass
+
+
+# Delivery settings of a topic subscription, as defined in infra/components/eventgrid-domain.bicep.
+class Subscription(NamedTuple):
+    topic: str
+    name: str
+    endpoint_type: str
+    endpoint_url: Optional[str]
+    queue_name: Optional[str]
+    max_events_per_batch: int
+    preferred_batch_size_kb: int
+    max_delivery_attempts: int
+    event_ttl_minutes: int
+    deadletter_container: Optional[str]
+    latency_ms: float
+    latency_jitter_ms: float
+    failure_rate: float
+
+
+# Method to read a subscription from its bicep style properties. Event Grid defaults apply to anything left out.
+def _parse_subscription(topic: str, name: str, properties: Dict) -> Subscription:
+    destination = properties.get("destination") or {}
+    destination_properties = destination.get("properties") or {}
+    endpoint_type = destination.get("endpointType", WEBHOOK)
+
+    if endpoint_type not in (WEBHOOK, STORAGE_QUEUE):
+        raise InvalidSubscriptionException(f"Subscription {name} of {topic} has unsupported endpoint type {endpoint_type}.")
+    if endpoint_type == WEBHOOK and not destination_properties.get("endpointUrl"):
+        raise InvalidSubscriptionException(f"Subscription {name} of {topic} has no endpointUrl.")
+    if endpoint_type == STORAGE_QUEUE and not destination_properties.get("queueName"):
+        raise InvalidSubscriptionException(f"Subscription {name} of {topic} has no queueName.")
+
+    retry_policy = properties.get("retryPolicy") or {}
+    deadletter = ((properties.get("deadLetterDestination") or {}).get("properties")) or {}
+
+    # Fault injection is specific to the emulator, so it lives in a section of its own.
+    emulator = properties.get("emulator") or {}
+
+    return Subscription(
+        topic=topic,
+        name=name,
+        endpoint_type=endpoint_type,
+        endpoint_url=destination_properties.get("endpointUrl"),
+        queue_name=destination_properties.get("queueName"),
+        max_events_per_batch=destination_properties.get("maxEventsPerBatch", 1),
+        preferred_batch_size_kb=destination_properties.get("preferredBatchSizeInKilobytes", 64),
+        max_delivery_attempts=retry_policy.get("maxDeliveryAttempts", 30),
+        event_ttl_minutes=retry_policy.get("eventTimeToLiveInMinutes", 1440),
+        deadletter_container=deadletter.get("blobContainerName"),
+        latency_ms=emulator.get("latencyMs", AppConfig.INJECT_LATENCY_MS),
+        latency_jitter_ms=emulator.get("latencyJitterMs", AppConfig.INJECT_LATENCY_JITTER_MS),
+        failure_rate=emulator.get("failureRate", AppConfig.INJECT_FAILURE_RATE),
+    )
+
+
+# Method to load the subscriptions of every topic from the subscriptions file.
+# File format --> {"topics": {<topic>: {<subscription name>: <subscription properties>}}}
+def load_subscriptions(path: str) -> Dict[str, List[Subscription]]:
+    with open(path) as f:
+        topics = json.load(f).get("topics") or {}
+
+    return {
+        topic: [_parse_subscription(topic, name, properties) for name, properties in subscriptions.items()]
+        for topic, subscriptions in topics.items()
+    }
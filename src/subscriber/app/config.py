@@ -0,0 +1,37 @@
+import os
+
+
+class AppConfig:
+    # Events are acknowledged once queued and processed by a pool of workers. Requests are
+    # answered with 429 once the queue is filled past the high watermark, so Event Grid backs off.
+    QUEUE_SIZE = int(os.environ.get("QUEUE_SIZE", 10_000))
+    QUEUE_HIGH_WATERMARK = float(os.environ.get("QUEUE_HIGH_WATERMARK", 0.9))
+    RETRY_AFTER_SECONDS = int(os.environ.get("RETRY_AFTER_SECONDS", 5))
+
+    # Workers take up to WORKER_BATCH_SIZE queued events at a time, so handlers still get batches.
+    # Failed events are retried HANDLER_RETRIES times before they are given up on.
+    WORKERS = int(os.environ.get("WORKERS", 4))
+    WORKER_BATCH_SIZE = int(os.environ.get("WORKER_BATCH_SIZE", 50))
+    HANDLER_RETRIES = int(os.environ.get("HANDLER_RETRIES", 3))
+    HANDLER_RETRY_DELAY_SECONDS = float(os.environ.get("HANDLER_RETRY_DELAY_SECONDS", 1))
+
+    # IDs of recently accepted events, so redeliveries are acknowledged without processing them again.
+    IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 100_000))
+
+    # Time given to workers to drain the queue at shutdown.
+    SHUTDOWN_DRAIN_SECONDS = float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", 10))
+
+    # Events are reordered per entity before they reach the workers, as Event Grid does not guarantee
+    # delivery order. ORDERING_KEY is "version" (auditlog sequence numbers, released as soon as they
+    # are next in line) or "executed_at" (every entity is held for the whole wait, then released in order).
+    # Gaps are waited on for up to ORDERING_MAX_WAIT_MS, at most ORDERING_MAX_BUFFERED events are held.
+    # The first event of an entity not seen before is held for ORDERING_FIRST_WAIT_MS, by default
+    # it is released right away so restarts do not delay every entity. Set it to a short wait to
+    # also catch an update overtaking the insert of a new entity. Such events are counted as ordering_first_seen.
+    ORDERING_ENABLED = os.environ.get("ORDERING_ENABLED", "true").lower() == "true"
+    ORDERING_KEY = os.environ.get("ORDERING_KEY", "version")
+    ORDERING_MAX_WAIT_MS = float(os.environ.get("ORDERING_MAX_WAIT_MS", 2000))
+    ORDERING_FIRST_WAIT_MS = float(os.environ.get("ORDERING_FIRST_WAIT_MS", 0))
+    ORDERING_TICK_MS = float(os.environ.get("ORDERING_TICK_MS", 100))
+    ORDERING_MAX_BUFFERED = int(os.environ.get("ORDERING_MAX_BUFFERED", 10_000))
+    ORDERING_RELEASED_CACHE_SIZE = int(os.environ.get("ORDERING_RELEASED_CACHE_SIZE", 100_000))
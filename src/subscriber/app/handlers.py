@@ -0,0 +1,73 @@
+import fnmatch
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from fastapi_cloudevents import CloudEvent
+
+
+logger = logging.getLogger(__name__)
+
+# A handler gets every event of a batch that matches its type pattern at once. It returns the
+# failed events as {event ID: reason}, events left out are considered processed. Raising fails
+# every event it was given.
+Handler = Callable[[List[CloudEvent]], Awaitable[Dict[str, str]]]
+
+# Handlers by event type pattern, eg -> "comments.update" or "comments.*".
+_handlers: Dict[str, Handler] = {}
+
+
+# Decorator to register a handler for an event type. Wildcards are matched fnmatch style.
+def handles(pattern: str):
+    def register(handler: Handler) -> Handler:
+        _handlers[pattern] = handler
+        return handler
+
+    return register
+
+
+# Method to find the handler of an event type. Exact patterns win over wildcards, and longer
+# wildcards over shorter ones.
+def get_handler(event_type: str) -> Optional[Handler]:
+    if event_type in _handlers:
+        return _handlers[event_type]
+
+    matches = [pattern for pattern in _handlers if fnmatch.fnmatchcase(event_type, pattern)]
+    return _handlers[max(matches, key=len)] if matches else None
+
+
+# Method to dispatch a batch of events to their handlers, grouped by type in arrival order.
+# Returns a result for every event, in the order the events were given.
+async def dispatch(events: List[CloudEvent]) -> List[Dict]:
+    groups: Dict[str, List[CloudEvent]] = {}
+    for event in events:
+        groups.setdefault(event.type, []).append(event)
+
+    failures: Dict[str, str] = {}
+    unhandled = set()
+
+    for event_type, group in groups.items():
+        handler = get_handler(event_type)
+
+        # There is nothing to retry for events nobody handles, so they are not reported as failed.
+        if handler is None:
+            logger.warning(f"No handler registered for {len(group)} {event_type} event(s).")
+            unhandled.update(event.id for event in group)
+            continue
+
+        try:
+            failures.update(await handler(group))
+
+        except Exception as e:
+            logger.exception(f"Failed to handle {len(group)} {event_type} event(s).")
+            failures.update({event.id: str(e) or type(e).__name__ for event in group})
+
+    results = []
+    for event in events:
+        if event.id in failures:
+            results.append({"id": event.id, "status": "failed", "detail": failures[event.id]})
+        elif event.id in unhandled:
+            results.append({"id": event.id, "status": "ignored"})
+        else:
+            results.append({"id": event.id, "status": "processed"})
+
+    return results
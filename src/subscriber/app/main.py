@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 
+from app import metrics
 from app.router import router
 
 
@@ -24,3 +25,8 @@ app.include_router(router)
 @app.get("/")
 async def root():
     return {"message": "Hello! Navigate to /docs to check out the endpoints."}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
@@ -0,0 +1,169 @@
+import heapq
+import itertools
+import math
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from app import metrics
+
+
+# Events buffered for a single entity, as a heap of (sequence, arrival, event) plus the
+# timing wheel slot it is due in.
+class _EntityBuffer:
+    __slots__ = ("heap", "slot")
+
+    def __init__(self, slot: int):
+        self.heap: List[Tuple[Any, int, Any]] = []
+        self.slot = slot
+
+
+# Reorders events per entity before they are released, with a bounded wait and memory budget.
+#
+# -> Contiguous mode (sequence numbers such as auditlog versions): events are released as soon as
+#    they are next in line, gaps are waited on for up to max_wait_ms. Entities not seen before (new,
+#    or forgotten after a restart or eviction from the released cache) have no known position, so
+#    their first event is held for first_wait_ms only, 0 releasing it right away.
+# -> Timestamp mode (eg -> executed_at): gaps cannot be detected, so every entity with pending events
+#    is held for max_wait_ms from its first buffered event and then released in order.
+#
+# Deadlines are kept in a timing wheel of tick_ms slots, so expiring them costs the same whatever
+# the number of active entities. Once max_buffered events are held, the entities due first are
+# released early. The last released sequence of up to released_cache_size entities is remembered.
+# Events arriving after a later one was released are let through as they are, and counted as late.
+#
+# Not thread safe, it is meant to be driven from a single event loop.
+class OrderingBuffer:
+    def __init__(
+        self,
+        release: Callable[[Any], None],
+        key: Callable[[Any], Optional[Tuple[Hashable, Any]]],
+        contiguous: bool,
+        max_wait_ms: float,
+        first_wait_ms: float,
+        tick_ms: float,
+        max_buffered: int,
+        released_cache_size: int,
+    ):
+        self.release = release
+        self.key = key
+        self.contiguous = contiguous
+        self.max_buffered = max_buffered
+        self.released_cache_size = released_cache_size
+
+        self._delay = max(1, math.ceil(max_wait_ms / tick_ms))
+        self._first_delay = min(self._delay, math.ceil(first_wait_ms / tick_ms))
+        self._wheel: List[Set[Hashable]] = [set() for _ in range(self._delay + 1)]
+        self._cursor = 0
+
+        self._pending: Dict[Hashable, _EntityBuffer] = {}
+        self._released: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._arrivals = itertools.count()
+        self.buffered = 0
+
+        metrics.gauge("ordering_buffered", lambda: self.buffered)
+        metrics.gauge("ordering_entities", lambda: len(self._pending))
+
+    # Method to take in an event, releasing it and any events it unblocks if they are in order.
+    def offer(self, event):
+        key = self.key(event)
+
+        # Events that cannot be ordered go straight through.
+        if key is None:
+            self.release(event)
+            return
+
+        entity, sequence = key
+        last = self._released.get(entity)
+
+        if last is not None and sequence <= last:
+            metrics.counter("ordering_late").inc()
+            self.release(event)
+            return
+
+        pending = self._pending.get(entity)
+        first = pending is None and last is None and self.contiguous
+        if first:
+            metrics.counter("ordering_first_seen").inc()
+
+        if pending is None and (self._is_next(last, sequence) or (first and not self._first_delay)):
+            self._release_one(entity, sequence, event)
+            return
+
+        if pending is None:
+            delay = self._first_delay if first else self._delay
+            pending = self._pending[entity] = _EntityBuffer(self._slot_after(delay))
+            self._wheel[pending.slot].add(entity)
+
+        heapq.heappush(pending.heap, (sequence, next(self._arrivals), event))
+        self.buffered += 1
+
+        if self.contiguous:
+            self._drain(entity, pending)
+
+        # Over budget, entities are flushed one at a time in deadline order until there is room again.
+        ticks = 1
+        while self.buffered > self.max_buffered:
+            slot = self._wheel[self._slot_after(ticks)]
+            if slot:
+                self._flush(slot.pop(), reason="ordering_evicted")
+            else:
+                ticks += 1
+
+    # Method to advance the wheel by one tick, flushing every entity that has waited long enough.
+    def tick(self):
+        self._cursor = (self._cursor + 1) % len(self._wheel)
+        self._expire_slot(self._cursor, reason="ordering_expired")
+
+    # Method to release everything still buffered, eg -> at shutdown.
+    def flush(self):
+        for slot in range(len(self._wheel)):
+            self._expire_slot(slot, reason="ordering_flushed")
+
+    def _slot_after(self, ticks: int) -> int:
+        return (self._cursor + ticks) % len(self._wheel)
+
+    def _is_next(self, last, sequence) -> bool:
+        # The first event seen for an entity is only known to be next in contiguous mode, at 1.
+        if not self.contiguous:
+            return False
+        return sequence == (last + 1 if last is not None else 1)
+
+    def _release_one(self, entity: Hashable, sequence, event):
+        self._released[entity] = sequence
+        self._released.move_to_end(entity)
+        while len(self._released) > self.released_cache_size:
+            self._released.popitem(last=False)
+
+        self.release(event)
+
+    # Method to release the events at the head of an entity heap for as long as they are in order.
+    def _drain(self, entity: Hashable, pending: _EntityBuffer):
+        while pending.heap and self._is_next(self._released.get(entity), pending.heap[0][0]):
+            sequence, _, event = heapq.heappop(pending.heap)
+            self.buffered -= 1
+            self._release_one(entity, sequence, event)
+
+        if not pending.heap:
+            self._wheel[pending.slot].discard(entity)
+            del self._pending[entity]
+
+    def _expire_slot(self, slot: int, reason: str):
+        entities, self._wheel[slot] = self._wheel[slot], set()
+        for entity in entities:
+            self._flush(entity, reason)
+
+    # Method to release every buffered event of an entity in order, gaps or not.
+    def _flush(self, entity: Hashable, reason: str):
+        pending = self._pending.pop(entity)
+        metrics.counter(reason).inc(len(pending.heap))
+
+        while pending.heap:
+            sequence, _, event = heapq.heappop(pending.heap)
+            self.buffered -= 1
+
+            # Duplicates of a sequence already released are still passed on.
+            last = self._released.get(entity)
+            if last is None or sequence > last:
+                self._release_one(entity, sequence, event)
+            else:
+                self.release(event)
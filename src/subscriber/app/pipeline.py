@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+
+from fastapi_cloudevents import CloudEvent
+
+from app import metrics
+from app.config import AppConfig
+from app.handlers import dispatch
+from app.ordering import OrderingBuffer
+
+
+logger = logging.getLogger(__name__)
+
+
+# Exception raised when the queue has no room for a request, the sender should retry later.
+class QueueFullException(Exception):
+    pass
+
+
+# Bounded LRU of accepted event IDs.
+class IdempotencyCache:
+    def __init__(self, size: int):
+        self.size = size
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, event_id: str) -> bool:
+        if event_id in self._ids:
+            self._ids.move_to_end(event_id)
+            return True
+        return False
+
+    def add(self, event_id: str):
+        self._ids[event_id] = None
+        self._ids.move_to_end(event_id)
+        while len(self._ids) > self.size:
+            self._ids.popitem(last=False)
+
+
+# Method to make a datetime aware in UTC, naive ones being UTC already, so timestamps of any
+# offset can be compared with each other.
+def _utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+# Method to get the entity and sequence number events of an entity are ordered by, None for
+# events that are not auditlogs. Entities are scoped to their topic, as IDs can repeat across collections.
+def ordering_key(event: CloudEvent) -> Optional[Tuple[Hashable, Any]]:
+    data = event.data
+    if not isinstance(data, dict) or data.get("entity_id") is None:
+        return None
+
+    if AppConfig.ORDERING_KEY == "executed_at":
+        sequence = data.get("executed_at")
+        sequence = _utc(datetime.fromisoformat(sequence)) if isinstance(sequence, str) else None
+    else:
+        sequence = data.get("version")
+
+    if sequence is None:
+        return None
+    return (event.source, str(data["entity_id"])), sequence
+
+
+# Method to get the key events are partitioned and retried in order by, the event itself if it has no entity.
+def entity_of(event: CloudEvent) -> str:
+    key = ordering_key(event)
+    return str(key[0]) if key is not None else event.id
+
+
+# Ack-then-process pipeline. Webhooks only check for redeliveries and queue events, which keeps
+# delivery latency independent of processing time. Workers drain the queue in the background.
+#
+# Events go through the ordering buffer on their way in, and every worker has its own queue. Events
+# of an entity always land in the same queue, so they are also processed in the order released.
+class EventPipeline:
+    def __init__(self):
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self._ticker: Optional[asyncio.Task] = None
+        # IDs of processed events, and of those accepted but not processed yet. Events given up on
+        # are in neither, so a redelivery of them is processed again.
+        self._seen = IdempotencyCache(AppConfig.IDEMPOTENCY_CACHE_SIZE)
+        self._pending_ids: Set[str] = set()
+
+        self._ordering = OrderingBuffer(
+            release=self._enqueue,
+            key=lambda item: ordering_key(item[1]),
+            contiguous=AppConfig.ORDERING_KEY != "executed_at",
+            max_wait_ms=AppConfig.ORDERING_MAX_WAIT_MS,
+            first_wait_ms=AppConfig.ORDERING_FIRST_WAIT_MS,
+            tick_ms=AppConfig.ORDERING_TICK_MS,
+            max_buffered=AppConfig.ORDERING_MAX_BUFFERED,
+            released_cache_size=AppConfig.ORDERING_RELEASED_CACHE_SIZE,
+        ) if AppConfig.ORDERING_ENABLED else None
+
+        metrics.gauge("queue_depth", lambda: sum(queue.qsize() for queue in self._queues))
+
+    def start(self):
+        # Capacity is enforced on submit, across the queues and the ordering buffer together.
+        self._queues = [asyncio.Queue() for _ in range(AppConfig.WORKERS)]
+        self._workers = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+
+        if self._ordering is not None:
+            self._ticker = asyncio.create_task(self._tick())
+
+    async def stop(self):
+        # Whatever is still waiting on a gap is processed as is.
+        if self._ordering is not None:
+            self._ticker.cancel()
+            self._ordering.flush()
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self._queues)),
+                timeout=AppConfig.SHUTDOWN_DRAIN_SECONDS,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutting down with {self._depth()} events left in the queue.")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    # Method to count the accepted events not processed yet, buffered ones included.
+    def _depth(self) -> int:
+        buffered = self._ordering.buffered if self._ordering is not None else 0
+        return sum(queue.qsize() for queue in self._queues) + buffered
+
+    # Method to queue a released event on the worker queue of its entity.
+    def _enqueue(self, item: Tuple[float, CloudEvent]):
+        self._queues[zlib.crc32(entity_of(item[1]).encode()) % len(self._queues)].put_nowait(item)
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(AppConfig.ORDERING_TICK_MS / 1000)
+            self._ordering.tick()
+
+    # Method to queue the events of a request, returns the outcome of every event. Either the whole
+    # request is queued or none of it is, so a rejected batch can simply be redelivered.
+    def submit(self, events: List[CloudEvent]) -> List[Dict]:
+        fresh: Dict[str, CloudEvent] = {}
+        results = []
+        for event in events:
+            if event.id in self._seen or event.id in self._pending_ids or event.id in fresh:
+                results.append({"id": event.id, "status": "duplicate"})
+            else:
+                fresh[event.id] = event
+                results.append({"id": event.id, "status": "accepted"})
+
+        capacity = int(AppConfig.QUEUE_SIZE * AppConfig.QUEUE_HIGH_WATERMARK)
+        if self._depth() + len(fresh) > capacity:
+            metrics.counter("events_rejected").inc(len(events))
+            raise QueueFullException
+
+        # Events of an entity delivered together are offered in sequence order, so an insert and its
+        # update in the same batch are never inverted, even for entities the buffer does not know yet.
+        ordered = sorted(
+            fresh.values(),
+            key=lambda event: (key[1],) if (key := ordering_key(event)) is not None else (),
+        ) if self._ordering is not None else list(fresh.values())
+
+        enqueued_at = time.monotonic()
+        for event in ordered:
+            self._pending_ids.add(event.id)
+            if self._ordering is not None:
+                self._ordering.offer((enqueued_at, event))
+            else:
+                self._enqueue((enqueued_at, event))
+
+        metrics.counter("events_accepted").inc(len(fresh))
+        metrics.counter("events_duplicate").inc(len(events) - len(fresh))
+
+        return results
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < AppConfig.WORKER_BATCH_SIZE and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            try:
+                await self._process(batch)
+            except Exception:
+                logger.exception(f"Failed to process a batch of {len(batch)} events.")
+            finally:
+                for _, event in batch:
+                    self._pending_ids.discard(event.id)
+                    queue.task_done()
+
+    async def _process(self, batch: List[Tuple[float, CloudEvent]]):
+        now = time.monotonic()
+        for enqueued_at, event in batch:
+            metrics.histogram("queue_wait_ms").observe((now - enqueued_at) * 1000)
+
+            # End to end lag, from the time the event was published.
+            if event.time:
+                lag = datetime.now(timezone.utc) - event.time.astimezone(timezone.utc)
+                metrics.histogram("event_lag_ms").observe(lag.total_seconds() * 1000)
+
+        events = [event for _, event in batch]
+        for attempt in range(AppConfig.HANDLER_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(AppConfig.HANDLER_RETRY_DELAY_SECONDS * attempt)
+
+            start = time.perf_counter()
+            results = await dispatch(events)
+            metrics.histogram("processing_ms").observe((time.perf_counter() - start) * 1000)
+
+            # Events of an entity are retried from its first failure on, successful ones included,
+            # so they are never processed ahead of an earlier event of the same entity.
+            failed = {result["id"] for result in results if result["status"] == "failed"}
+            blocked = set()
+            retries = []
+            for event in events:
+                entity = entity_of(event)
+                if event.id in failed or entity in blocked:
+                    blocked.add(entity)
+                    retries.append(event)
+
+            retried = {event.id for event in retries}
+            for event in events:
+                if event.id not in retried:
+                    self._seen.add(event.id)
+
+            metrics.counter("events_processed").inc(len(events) - len(retries))
+            events = retries
+            if not events:
+                return
+
+        # The events were acknowledged already, so all that is left is to record them. They are not
+        # marked as seen, so redelivering them, eg -> from a dead-letter replay, processes them again.
+        metrics.counter("events_failed").inc(len(events))
+        logger.error(f"Gave up on {len(events)} events after {AppConfig.HANDLER_RETRIES} retries: {[e.id for e in events]}")
+
+
+# Global pipeline shared by the webhooks in this worker.
+_pipeline: Optional[EventPipeline] = None
+
+
+# Method to reuse the pipeline as a singleton.
+def get_pipeline() -> EventPipeline:
+    global _pipeline
+
+    if _pipeline is None:
+        _pipeline = EventPipeline()
+
+    return _pipeline
@@ -1,9 +1,16 @@
+import json
 import logging
+from typing import List
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi_cloudevents import CloudEvent
+from pydantic import ValidationError
+
+from app.config import AppConfig
+from app.handlers import handles
+from app.pipeline import QueueFullException, get_pipeline
 
 
 router = APIRouter(prefix="/webhooks", tags=["webhooks"])
@@ -11,49 +18,137 @@ router = APIRouter(prefix="/webhooks", tags=["webhooks"])
 logger = logging.getLogger(__name__)
 
 
+# Startup event to start the workers processing accepted events.
+@router.on_event("startup")
+async def startup():
+    get_pipeline().start()
+
+
+# Shutdown event to let the workers drain the queue before the service stops.
+@router.on_event("shutdown")
+async def shutdown():
+    await get_pipeline().stop()
+
+
 # Lets build upon our scenario where we have two collections - comments & blog_posts.
 # Changestreams on these collections from API DB will send the events to audit service
 # to be documented. Then changestreams on the corresponding audit collections will be
 # published on Event Grid under the appropriate topic.
 
-# So here we will introduce two demo webhooks to subscribe to these topics. They will
-# be mapped to the topic via destination.properties.endpointUrl property in Event Grid 
-# subscriptions defined in infra/components/eventgrid-domain.bicep.
+# Every topic is delivered to the generic events webhook below, which routes each event to the
+# handler registered for its type, eg -> "comments.update" or "blog-posts.*". They are mapped
+# to the topic via destination.properties.endpointUrl property in Event Grid subscriptions
+# defined in infra/components/eventgrid-domain.bicep.
 
 
-@router.post(
-    "/comments",
-    summary="Demo webhook to consume comment events.",
-    response_description="The changes identified in the comment if any.",
-)
-async def read_comments(event: CloudEvent):
-    # We can use fastapi_cloudevents module for a cloud event schema compatible with pydantic.
+@handles("comments.*")
+async def handle_comments(events: List[CloudEvent]):
     # The change details captured by audit service can be found in the data field.
-    data = event.data
-    
-    logger.info(f"Recieved a change event for comment {data['entity_id']}.")
-    logger.info(f"Operation type - {data['operation_type']}")
-    logger.info(f"Executed at - {data['executed_at']}")
-    logger.info(f"Executed by (User ID) - {data['executed_by']}")
+    for event in events:
+        data = event.data
+
+        logger.info(f"Recieved a change event for comment {data['entity_id']}.")
+        logger.info(f"Operation type - {data['operation_type']}")
+        logger.info(f"Executed at - {data['executed_at']}")
+        logger.info(f"Executed by (User ID) - {data['executed_by']}")
 
     # For an object-oriented approach, we can also define a schema in this module which would
     # be a copy of the Auditlog model we used in the audit service. Then we can use the
     # parse_obj method to convert the raw data into a pydantic object.
 
-    return JSONResponse(status_code=200, content=jsonable_encoder(data["changes"]))
+    return {}
+
+
+@handles("blog-posts.*")
+async def handle_blog_posts(events: List[CloudEvent]):
+    for event in events:
+        data = event.data
+
+        logger.info(f"Recieved a change event for blog post {data['entity_id']}.")
+        logger.info(f"Operation type - {data['operation_type']}")
+        logger.info(f"Executed at - {data['executed_at']}")
+        logger.info(f"Executed by (User ID) - {data['executed_by']}")
+
+    return {}
+
+
+# Method to queue events for processing, answering right away. A full queue gets a 429,
+# which makes Event Grid back off and redeliver later.
+def accept(events: List[CloudEvent]) -> JSONResponse:
+    try:
+        results = get_pipeline().submit(events)
+
+    except QueueFullException:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Too many events are waiting to be processed, retry later."},
+            headers={"Retry-After": str(AppConfig.RETRY_AFTER_SECONDS)},
+        )
+
+    return JSONResponse(status_code=200, content=jsonable_encoder({"results": results}))
+
+
+# Method to parse a structured CloudEvents body, either a single event or a batch of them.
+def parse_events(body: bytes) -> List[CloudEvent]:
+    payload = json.loads(body)
+    items = payload if isinstance(payload, list) else [payload]
+    return [CloudEvent.parse_obj(item) for item in items]
+
+
+@router.options(
+    "/events",
+    summary="CloudEvents webhook validation handshake.",
+)
+async def validate_webhook(request: Request):
+    # Event Grid checks the endpoint is willing to receive its events before delivering any,
+    # per the abuse protection section of the CloudEvents HTTP webhook spec.
+    origin = request.headers.get("webhook-request-origin", "*")
+    return Response(
+        status_code=200,
+        headers={"WebHook-Allowed-Origin": origin, "WebHook-Allowed-Rate": "*", "Allow": "POST"},
+    )
+
+
+@router.post(
+    "/events",
+    summary="Webhook to consume events of every topic, one at a time or in batches.",
+    response_description="Whether every event in the request was accepted or was a redelivery.",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/cloudevents+json": {"schema": {"type": "object"}},
+                "application/cloudevents-batch+json": {"schema": {"type": "array", "items": {"type": "object"}}},
+            },
+        },
+    },
+)
+async def read_events(request: Request):
+    try:
+        events = parse_events(await request.body())
+
+    except (ValueError, ValidationError) as e:
+        return JSONResponse(status_code=400, content={"detail": f"Invalid CloudEvents payload: {str(e)}"})
+
+    # Events are processed after they are acknowledged, by the handler registered for their type.
+    return accept(events)
+
+
+# Single event webhooks kept for subscriptions that still point to them.
+
+@router.post(
+    "/comments",
+    summary="Demo webhook to consume comment events.",
+    response_description="Whether the event was accepted or was a redelivery.",
+)
+async def read_comments(event: CloudEvent):
+    return accept([event])
 
 
 @router.post(
     "/blog_posts",
     summary="Demo webhook to consume blog post events.",
-    response_description="The changes identified in the blog post if any.",
+    response_description="Whether the event was accepted or was a redelivery.",
 )
 async def read_blog_posts(event: CloudEvent):
-    data = event.data
-
-    logger.info(f"Recieved a change event for blog post {data['entity_id']}.")
-    logger.info(f"Operation type - {data['operation_type']}")
-    logger.info(f"Executed at - {data['executed_at']}")
-    logger.info(f"Executed by (User ID) - {data['executed_by']}")
-
-    return JSONResponse(status_code=200, content=jsonable_encoder(data["changes"]))
+    return accept([event])
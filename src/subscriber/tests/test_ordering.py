@@ -0,0 +1,146 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi_cloudevents import CloudEvent
+
+from app.config import AppConfig
+from app.ordering import OrderingBuffer
+from app.pipeline import ordering_key
+
+
+# Events are (entity, sequence) tuples, released ones are collected in order.
+def _buffer(contiguous=True, max_wait_ms=30, first_wait_ms=0, max_buffered=100, released_cache_size=100):
+    released = []
+    buffer = OrderingBuffer(
+        release=released.append,
+        key=lambda event: event if event[0] is not None else None,
+        contiguous=contiguous,
+        max_wait_ms=max_wait_ms,
+        first_wait_ms=first_wait_ms,
+        tick_ms=10,
+        max_buffered=max_buffered,
+        released_cache_size=released_cache_size,
+    )
+    return buffer, released
+
+
+def _offer(buffer: OrderingBuffer, *events):
+    for event in events:
+        buffer.offer(event)
+
+
+def test_events_in_order_are_released_right_away():
+    buffer, released = _buffer()
+
+    _offer(buffer, ("a", 1), ("a", 2), ("b", 1), (None, 7))
+
+    assert released == [("a", 1), ("a", 2), ("b", 1), (None, 7)]
+    assert buffer.buffered == 0
+
+
+def test_gaps_are_released_once_filled():
+    buffer, released = _buffer()
+
+    _offer(buffer, ("a", 1), ("a", 4), ("a", 3))
+    assert released == [("a", 1)]
+    assert buffer.buffered == 2
+
+    buffer.offer(("a", 2))
+
+    assert released == [("a", 1), ("a", 2), ("a", 3), ("a", 4)]
+    assert buffer.buffered == 0
+
+
+def test_gaps_are_waited_on_for_max_wait_only():
+    buffer, released = _buffer(max_wait_ms=30)
+    _offer(buffer, ("a", 1), ("a", 3), ("a", 5))
+
+    buffer.tick()
+    buffer.tick()
+    assert released == [("a", 1)]
+
+    buffer.tick()
+    assert released == [("a", 1), ("a", 3), ("a", 5)]
+
+    # What the gap held back is now late, and let through as it is.
+    _offer(buffer, ("a", 2), ("a", 6))
+    assert released[3:] == [("a", 2), ("a", 6)]
+
+
+def test_first_events_of_unknown_entities_wait_for_first_wait():
+    buffer, released = _buffer(max_wait_ms=50, first_wait_ms=20)
+
+    _offer(buffer, ("a", 3), ("a", 2))
+    buffer.tick()
+    assert released == []
+
+    buffer.tick()
+    assert released == [("a", 2), ("a", 3)]
+
+
+def test_timestamp_mode_holds_every_entity_for_max_wait():
+    buffer, released = _buffer(contiguous=False, max_wait_ms=20)
+
+    _offer(buffer, ("a", 20), ("b", 5), ("a", 10))
+    buffer.tick()
+    assert released == []
+
+    buffer.tick()
+    assert sorted(released) == [("a", 10), ("a", 20), ("b", 5)]
+    assert released.index(("a", 10)) < released.index(("a", 20))
+
+
+def test_entities_due_first_are_released_when_over_budget():
+    buffer, released = _buffer(max_wait_ms=30, max_buffered=2)
+
+    _offer(buffer, ("a", 1), ("a", 3))
+    buffer.tick()
+    _offer(buffer, ("b", 1), ("b", 3))
+    assert released == [("a", 1), ("b", 1)]
+
+    buffer.offer(("b", 5))
+
+    assert released[2:] == [("a", 3)]
+    assert buffer.buffered == 2
+
+
+def test_flush_releases_everything_in_order():
+    buffer, released = _buffer(first_wait_ms=30)
+
+    _offer(buffer, ("a", 4), ("b", 3), ("a", 3))
+    buffer.flush()
+
+    assert sorted(released) == [("a", 3), ("a", 4), ("b", 3)]
+    assert released.index(("a", 3)) < released.index(("a", 4))
+    assert buffer.buffered == 0
+
+
+def _event(executed_at: str) -> CloudEvent:
+    return CloudEvent(
+        type="comments.update",
+        source="comments",
+        id=executed_at,
+        data={"entity_id": "a", "version": 1, "executed_at": executed_at},
+    )
+
+
+@pytest.fixture
+def timestamps(monkeypatch):
+    monkeypatch.setattr(AppConfig, "ORDERING_KEY", "executed_at")
+
+
+def test_timestamps_are_aware_and_in_utc(timestamps):
+    assert ordering_key(_event("2024-05-01T12:00:00"))[1] == datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+    assert ordering_key(_event("2024-05-01T14:00:00+02:00"))[1] == datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+    assert ordering_key(_event("2024-05-01T12:00:00Z"))[1].utcoffset() == timedelta(0)
+
+
+def test_naive_and_aware_timestamps_are_ordered_together(timestamps):
+    buffer, released = _buffer(contiguous=False, max_wait_ms=10)
+    buffer.key = ordering_key
+    events = [_event("2024-05-01T12:00:02"), _event("2024-05-01T14:00:01+02:00"), _event("2024-05-01T12:00:03Z")]
+
+    _offer(buffer, *events)
+    buffer.tick()
+
+    assert [event.id for event in released] == [events[1].id, events[0].id, events[2].id]
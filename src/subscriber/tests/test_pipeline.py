@@ -0,0 +1,177 @@
+import asyncio
+from typing import Dict, List
+
+import pytest
+from fastapi_cloudevents import CloudEvent
+
+from app import pipeline as pipeline_module
+from app.config import AppConfig
+from app.pipeline import EventPipeline, IdempotencyCache, QueueFullException
+from app.router import accept
+
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    monkeypatch.setattr(AppConfig, "WORKERS", 1)
+    monkeypatch.setattr(AppConfig, "HANDLER_RETRIES", 2)
+    monkeypatch.setattr(AppConfig, "HANDLER_RETRY_DELAY_SECONDS", 0)
+    monkeypatch.setattr(AppConfig, "ORDERING_TICK_MS", 1)
+
+
+# Handler stand-in recording every batch it is given, failing the events listed in failures
+# for as many attempts as given.
+class FakeDispatch:
+    def __init__(self, failures: Dict[str, int] = None):
+        self.failures = dict(failures or {})
+        self.batches: List[List[str]] = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, events: List[CloudEvent]) -> List[Dict]:
+        await self.release.wait()
+        self.batches.append([event.id for event in events])
+
+        results = []
+        for event in events:
+            if self.failures.get(event.id, 0) > 0:
+                self.failures[event.id] -= 1
+                results.append({"id": event.id, "status": "failed", "detail": "boom"})
+            else:
+                results.append({"id": event.id, "status": "processed"})
+        return results
+
+
+@pytest.fixture
+def dispatch(monkeypatch) -> FakeDispatch:
+    dispatch = FakeDispatch()
+    monkeypatch.setattr(pipeline_module, "dispatch", dispatch)
+    return dispatch
+
+
+def _event(event_id: str, entity_id: str = None, version: int = None) -> CloudEvent:
+    data = {"entity_id": entity_id, "version": version} if entity_id else {}
+    return CloudEvent(type="comments.update", source="comments", id=event_id, data=data)
+
+
+def _statuses(results: List[Dict]) -> List[str]:
+    return [result["status"] for result in results]
+
+
+# Method to submit requests to a running pipeline, then stop it once every event was processed.
+async def _run(pipeline: EventPipeline, *requests: List[CloudEvent]) -> List[List[Dict]]:
+    pipeline.start()
+    results = [pipeline.submit(events) for events in requests]
+    await pipeline.stop()
+    return results
+
+
+def test_idempotency_cache_evicts_the_least_recently_seen_ids():
+    cache = IdempotencyCache(2)
+    cache.add("a")
+    cache.add("b")
+
+    assert "a" in cache
+    cache.add("c")
+
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+
+
+def test_ids_repeated_in_a_request_are_reported_as_duplicates(dispatch):
+    (results,) = asyncio.run(_run(EventPipeline(), [_event("1"), _event("1"), _event("2")]))
+
+    assert _statuses(results) == ["accepted", "duplicate", "accepted"]
+    assert dispatch.batches == [["1", "2"]]
+
+
+def test_redeliveries_of_pending_and_processed_events_are_duplicates(dispatch):
+    async def run():
+        pipeline = EventPipeline()
+        pipeline.start()
+        dispatch.release.clear()
+
+        first = pipeline.submit([_event("1")])
+        await asyncio.sleep(0)
+        pending = pipeline.submit([_event("1"), _event("2")])
+
+        dispatch.release.set()
+        await pipeline.stop()
+        return first, pending, pipeline.submit([_event("1"), _event("2")])
+
+    first, pending, processed = asyncio.run(run())
+
+    assert _statuses(first) == ["accepted"]
+    assert _statuses(pending) == ["duplicate", "accepted"]
+    assert _statuses(processed) == ["duplicate", "duplicate"]
+    assert sorted(event for batch in dispatch.batches for event in batch) == ["1", "2"]
+
+
+def test_events_given_up_on_are_processed_again_when_redelivered(dispatch):
+    dispatch.failures = {"1": AppConfig.HANDLER_RETRIES + 1}
+    pipeline = EventPipeline()
+
+    asyncio.run(_run(pipeline, [_event("1")]))
+    assert dispatch.batches == [["1"]] * (AppConfig.HANDLER_RETRIES + 1)
+
+    (results,) = asyncio.run(_run(pipeline, [_event("1")]))
+
+    assert _statuses(results) == ["accepted"]
+    assert dispatch.batches[-1] == ["1"]
+
+
+def test_entities_are_retried_from_their_first_failure(dispatch):
+    dispatch.failures = {"a2": 1}
+    events = [_event("a1", "a", 1), _event("b1", "b", 1), _event("a2", "a", 2), _event("a3", "a", 3), _event("c")]
+
+    asyncio.run(_run(EventPipeline(), events))
+
+    # a3 succeeded, but it is retried along with a2 so it is never processed ahead of it.
+    first, retried = dispatch.batches
+    assert sorted(first) == ["a1", "a2", "a3", "b1", "c"]
+    assert retried == ["a2", "a3"]
+
+
+def test_events_of_an_entity_in_one_request_are_processed_in_order(dispatch):
+    events = [_event("a3", "a", 3), _event("a1", "a", 1), _event("a2", "a", 2)]
+
+    asyncio.run(_run(EventPipeline(), events))
+
+    assert dispatch.batches == [["a1", "a2", "a3"]]
+
+
+def test_requests_are_rejected_as_a_whole_once_the_queue_is_full(dispatch, monkeypatch):
+    monkeypatch.setattr(AppConfig, "QUEUE_SIZE", 4)
+    monkeypatch.setattr(AppConfig, "QUEUE_HIGH_WATERMARK", 0.5)
+
+    async def run():
+        pipeline = EventPipeline()
+        pipeline.start()
+        dispatch.release.clear()
+
+        with pytest.raises(QueueFullException):
+            pipeline.submit([_event("1"), _event("2"), _event("3")])
+
+        # Nothing of the rejected request was kept, so its redelivery is not a duplicate.
+        accepted = pipeline.submit([_event("1"), _event("2")])
+        with pytest.raises(QueueFullException):
+            pipeline.submit([_event("3")])
+
+        dispatch.release.set()
+        await pipeline.stop()
+        return accepted
+
+    assert _statuses(asyncio.run(run())) == ["accepted", "accepted"]
+    assert dispatch.batches == [["1", "2"]]
+
+
+def test_full_queues_answer_429_with_retry_after(monkeypatch):
+    class FullPipeline:
+        def submit(self, events):
+            raise QueueFullException
+
+    monkeypatch.setattr("app.router.get_pipeline", lambda: FullPipeline())
+
+    response = accept([_event("1")])
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(AppConfig.RETRY_AFTER_SECONDS)